@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the build engine on synthetic systems.
+
+Runs without root and without btrfs: Snapshots are done by copying plain
+directories and no external binaries are run. Store results with --json
+and pass them to --compare on a later run to see the effect of a change.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from argparse import ArgumentParser
+import contextlib
+import fnmatch
+import io
+import os
+import shutil
+import sys
+import tempfile
+import typing
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchlib import Results, add_arguments, best_time, finish
+from synthetic import (
+    DirectoryStorage,
+    FakeBinaryManager,
+    populate_tree,
+    write_commands,
+    write_systems,
+)
+
+from cleanroom.checkpoints import CheckpointManager
+from cleanroom.commandmanager import CommandManager
+from cleanroom.execobject import ExecObject
+from cleanroom.executor import Executor
+from cleanroom.helper.file import chmod, copy, expand_files, remove
+from cleanroom.location import Location
+from cleanroom.systemcontext import SystemContext
+from cleanroom.systemsmanager import SystemsManager, parse_system_definition_file
+from cleanroom.systemstate import load_system_state, store_system_state
+
+
+_COMMANDS_DIRECTORY = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "../cleanroom/commands")
+)
+
+
+class _Environment:
+    """Directories and objects shared by the benchmarks."""
+
+    def __init__(self, directory: str, scale: int) -> None:
+        self.directory = directory
+        self.scale = scale
+        self.bench_commands = write_commands(os.path.join(directory, "commands"))
+        self.systems_directory = os.path.join(directory, "systems")
+        self.systems = write_systems(
+            self.systems_directory,
+            depth=10 * scale,
+            width=20 * scale,
+            commands=30,
+            heredoc_lines=20,
+            substitutions=50,
+            hooks=10,
+        )
+        self.storage_directory = os.path.join(directory, "storage")
+        self.repository_directory = os.path.join(directory, "repository")
+        os.makedirs(self.storage_directory)
+        os.makedirs(self.repository_directory)
+        self.storage = DirectoryStorage()
+        self.command_manager = self.create_command_manager()
+
+    def create_command_manager(self, index_file: str = "") -> CommandManager:
+        return CommandManager(
+            _COMMANDS_DIRECTORY,
+            self.bench_commands,
+            index_file=index_file,
+            binary_manager=FakeBinaryManager(),
+            storage=self.storage,
+        )
+
+    def system_context(self, name: str) -> SystemContext:
+        scratch_directory = os.path.join(self.directory, "scratch", name)
+        for volume in ("fs", "meta", "boot", "cache"):
+            os.makedirs(os.path.join(scratch_directory, volume), exist_ok=True)
+        return SystemContext(
+            system_name=name,
+            base_system_name="",
+            scratch_directory=scratch_directory,
+            systems_definition_directory=self.systems_directory,
+            storage_directory=self.storage_directory,
+            repository_base_directory=self.repository_directory,
+            timestamp="20200101.000000",
+        )
+
+
+def _location(line: int) -> Location:
+    return Location(file_name="<benchmark>", line_number=line + 1)
+
+
+def bench_command_manager(env: _Environment, results: Results, repeat: int) -> None:
+    commands = len(env.command_manager.command_names())
+    results.add(
+        "command_manager/startup",
+        best_time(env.create_command_manager, repeat),
+        commands,
+    )
+
+    index_file = os.path.join(env.directory, "command_index.json")
+    env.create_command_manager(index_file)  # fill the index
+    results.add(
+        "command_manager/startup_indexed",
+        best_time(lambda: env.create_command_manager(index_file), repeat),
+        commands,
+    )
+
+
+def bench_parser(env: _Environment, results: Results, repeat: int) -> None:
+    files = [os.path.join(env.systems_directory, f"{s}.def") for s in env.systems]
+    for fast_parser in (False, True):
+
+        def parse() -> None:
+            for f in files:
+                parse_system_definition_file(
+                    env.command_manager, f, fast_parser=fast_parser
+                )
+
+        name = "fast" if fast_parser else "pyparsing"
+        results.add(f"parser/{name}", best_time(parse, repeat), len(files))
+
+    results.add(
+        "parser/systems_forest",
+        best_time(
+            lambda: SystemsManager(
+                env.command_manager,
+                env.systems_directory,
+                *env.systems,
+                fast_parser=True,
+            ),
+            repeat,
+        ),
+        len(env.systems),
+    )
+
+
+def bench_substitutions(env: _Environment, results: Results, repeat: int) -> None:
+    system_context = env.system_context("substitutions")
+    count = 200 * env.scale
+    for i in range(count):
+        value = "${ROOT_DIR}/start" if i == 0 else f"${{KEY_{i - 1}}}/{i}"
+        system_context.set_substitution(f"KEY_{i}", value)
+    texts = [f"${{KEY_{i}}} and ${{SYSTEM_NAME}} at $$literal" for i in range(count)]
+
+    def expand() -> None:
+        for t in texts:
+            system_context.expand(t)
+
+    results.add(
+        "substitutions/expand_cold",
+        best_time(
+            expand, repeat, setup=lambda: system_context.set_substitution("KEY_0", "/")
+        ),
+        count,
+    )
+    results.add("substitutions/expand_warm", best_time(expand, repeat), count)
+
+    meta_directory = system_context.meta_directory
+    hooks = {
+        "export": [
+            ExecObject(_location(i), "remove", (f"/etc/file{i}",), {"force": True})
+            for i in range(count)
+        ]
+    }
+
+    def store() -> None:
+        store_system_state(
+            meta_directory,
+            system_name="substitutions",
+            timestamp=system_context.timestamp,
+            base_system_names=[f"base-{i}" for i in range(10)],
+            hooks=hooks,
+            substitutions=system_context.substitutions,
+        )
+
+    os.makedirs(os.path.join(env.storage_directory, "substitutions"))
+    os.symlink(
+        meta_directory, os.path.join(env.storage_directory, "substitutions", "meta")
+    )
+    results.add("system_state/store", best_time(store, repeat), count)
+    results.add(
+        "system_state/load",
+        best_time(
+            lambda: load_system_state(env.storage_directory, "substitutions"), repeat
+        ),
+        count,
+    )
+
+
+def bench_executor(env: _Environment, results: Results, repeat: int) -> None:
+    count = 1000 * env.scale
+    exec_obj_list: typing.List[ExecObject] = []
+    for i in range(count):
+        if i % 10 == 0:
+            exec_obj_list.append(
+                ExecObject(
+                    _location(i), "bench_set", (f"KEY_{i}", f"${{ROOT_DIR}}/{i}"), {}
+                )
+            )
+        elif i % 10 == 1:
+            exec_obj_list.append(
+                ExecObject(
+                    _location(i),
+                    "add_hook",
+                    ("export", "bench_noop", f"${{KEY_{i - 1}}}"),
+                    {},
+                )
+            )
+        else:
+            exec_obj_list.append(
+                ExecObject(
+                    _location(i),
+                    "bench_noop",
+                    ("${SYSTEM_NAME}", i),
+                    {"mode": 0o644, "path": "${ROOT_DIR}/etc"},
+                )
+            )
+
+    system_context = env.system_context("executor")
+    executor = Executor(
+        scratch_directory=system_context.scratch_directory,
+        systems_definition_directory=env.systems_directory,
+        command_manager=env.command_manager,
+        repository_base_directory=env.repository_directory,
+        timestamp="20200101.000000",
+    )
+
+    def run() -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            executor.run("executor", None, exec_obj_list, env.storage_directory)
+
+    cwd = os.getcwd()
+    results.add("executor/dispatch", best_time(run, repeat), count)
+    os.chdir(cwd)
+
+
+def bench_file_helpers(env: _Environment, results: Results, repeat: int) -> None:
+    system_context = env.system_context("files")
+    fs_directory = system_context.fs_directory
+    files = populate_tree(
+        os.path.join(fs_directory, "tree"), files=5000 * env.scale, fan_out=10
+    )
+
+    results.add(
+        "file/expand_files_recursive",
+        best_time(
+            lambda: sum(
+                1 for _ in expand_files(system_context, "/tree/**", recursive=True)
+            ),
+            repeat,
+        ),
+        files,
+    )
+    results.add(
+        "file/chmod_recursive",
+        best_time(
+            lambda: chmod(system_context, 0o644, "/tree/**/*.txt", recursive=True),
+            repeat,
+        ),
+        files,
+    )
+
+    copies = [0]
+
+    def next_copy() -> None:
+        # Always copy to a new place: copy_tree remembers the directories it
+        # created and would not create them again after they got removed.
+        shutil.rmtree(
+            os.path.join(fs_directory, f"copy{copies[0]}"), ignore_errors=True
+        )
+        copies[0] += 1
+
+    results.add(
+        "file/copy_recursive",
+        best_time(
+            lambda: copy(system_context, "/tree", f"/copy{copies[0]}", recursive=True),
+            repeat,
+            setup=next_copy,
+        ),
+        files,
+    )
+
+    def copy_tree() -> None:
+        shutil.copytree(
+            os.path.join(fs_directory, "tree"), os.path.join(fs_directory, "removed")
+        )
+
+    results.add(
+        "file/remove_recursive",
+        best_time(
+            lambda: remove(system_context, "/removed", recursive=True),
+            repeat,
+            setup=copy_tree,
+        ),
+        files,
+    )
+
+    checkpoints = CheckpointManager(
+        env.storage,
+        os.path.join(env.directory, "checkpoints"),
+        max_checkpoints=1,
+    )
+    counter = [0]
+
+    def create_checkpoint() -> None:
+        counter[0] += 1
+        checkpoints.create(f"key{counter[0]}", system_context)
+
+    results.add("checkpoint/create", best_time(create_checkpoint, repeat), files)
+
+    restore_context = env.system_context("restored")
+    restore_scratch = restore_context.scratch_directory
+    results.add(
+        "checkpoint/restore",
+        best_time(
+            lambda: checkpoints.restore(f"key{counter[0]}", restore_context),
+            repeat,
+            setup=lambda: shutil.rmtree(restore_scratch, ignore_errors=True),
+        ),
+        files,
+    )
+
+
+_BENCHMARKS = {
+    "command_manager": bench_command_manager,
+    "parser": bench_parser,
+    "substitutions": bench_substitutions,
+    "executor": bench_executor,
+    "file": bench_file_helpers,
+}
+
+
+def run(args: typing.List[str]) -> None:
+    parser = ArgumentParser(description="Benchmark the cleanroom build engine.")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of runs per benchmark, the best one is reported.",
+    )
+    parser.add_argument(
+        "--scale",
+        type=int,
+        default=1,
+        help="Scale the size of the synthetic inputs by this factor.",
+    )
+    parser.add_argument(
+        "--only",
+        default="*",
+        metavar="<PATTERN>",
+        help="Only run the benchmark groups matching PATTERN: "
+        + ", ".join(_BENCHMARKS.keys()),
+    )
+    add_arguments(parser)
+    options = parser.parse_args(args[1:])
+
+    results = Results()
+    with tempfile.TemporaryDirectory(prefix="clrm-bench-") as directory:
+        env = _Environment(directory, options.scale)
+        print(f"{'benchmark':<44} {'items':>8} {'best':>12} {'per item':>16}")
+        for name, func in _BENCHMARKS.items():
+            if fnmatch.fnmatch(name, options.only):
+                func(env, results, options.repeat)
+
+    finish(results, options)
+
+
+if __name__ == "__main__":
+    run(sys.argv)
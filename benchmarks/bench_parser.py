@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare speed and results of the pyparsing and the hand-written parser.
+
+Runs both parsers over the examples and over generated system definitions
+of increasing size.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from argparse import ArgumentParser
+import glob
+import os
+import sys
+import typing
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchlib import Results, add_arguments, best_time, finish
+
+from cleanroom.parser import Parser
+
+
+def generate_definition(commands: int) -> str:
+    """Generate a system definition with heredocs and continuation lines."""
+    lines = ["# Generated system definition", "", "based_on type-base", ""]
+    for i in range(commands):
+        kind = i % 4
+        if kind == 0:
+            lines.append(f"pkg_{i} arg{i} 'quoted {i}' mode=0o644 force=True")
+        elif kind == 1:
+            lines.append(f"create /etc/file{i} <<<<")
+            lines += [f"line {j} of heredoc {i} # not a comment" for j in range(8)]
+            lines.append(">>>> mode=0o600")
+        elif kind == 2:
+            lines.append(f"pacman package{i}a package{i}b")
+            lines.append(f"    package{i}c   # continued")
+            lines.append(f'    "package {i}d"')
+        else:
+            lines.append(f'set KEY_{i} "value with \\t escape" # comment')
+            lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def _time(parser: Parser, data: str, repeat: int) -> float:
+    return best_time(lambda: parser._commands(data, "<benchmark>"), repeat)
+
+
+def run(args: typing.List[str]) -> None:
+    parser = ArgumentParser(description="Benchmark the system definition parsers.")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of runs per input, the best one is reported.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="*",
+        default=[10, 100, 1000, 5000],
+        help="Numbers of commands in the generated inputs.",
+    )
+    add_arguments(parser)
+    options = parser.parse_args(args[1:])
+
+    inputs: typing.List[typing.Tuple[str, str]] = []
+    examples = os.path.join(os.path.dirname(__file__), "../examples")
+    for file_name in sorted(glob.glob(os.path.join(examples, "*.def"))):
+        with open(file_name, "r") as f:
+            inputs.append((os.path.basename(file_name), f.read()))
+    for size in options.sizes:
+        inputs.append((f"<generated {size}>", generate_definition(size)))
+
+    slow = Parser(None)
+    fast = Parser(None, fast_parser=True)
+
+    results = Results()
+    print(f"{'input':<32} {'bytes':>9} {'pyparsing':>11} {'fast':>11} {'speedup':>8}")
+    failed = False
+    for name, data in inputs:
+        if slow._commands(data, name) != fast._commands(data, name):
+            print(f"{name}: parse results differ!")
+            failed = True
+            continue
+
+        slow_time = _time(slow, data, options.repeat)
+        fast_time = _time(fast, data, options.repeat)
+        results.add(f"parser/pyparsing/{name}", slow_time, len(data), report=False)
+        results.add(f"parser/fast/{name}", fast_time, len(data), report=False)
+        print(
+            f"{name:<32} {len(data):>9} {slow_time * 1000:>9.2f}ms "
+            f"{fast_time * 1000:>9.2f}ms {slow_time / fast_time:>7.1f}x"
+        )
+
+    finish(results, options)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run(sys.argv)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Timing and reporting shared by the benchmarks.
+
+Results can be stored as JSON and compared to the results of an earlier
+run, e.g. one done on the parent commit.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import typing
+
+
+_FORMAT_VERSION = 1
+
+
+def best_time(
+    func: typing.Callable[[], typing.Any],
+    repeat: int,
+    *,
+    setup: typing.Optional[typing.Callable[[], typing.Any]] = None,
+) -> float:
+    """Return the fastest of repeat runs of func in seconds.
+
+    setup is run before each run of func and is not timed."""
+    best = 0.0
+    for i in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        best = duration if i == 0 else min(best, duration)
+    return best
+
+
+def _git_commit() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    return result.stdout.strip() if result.returncode == 0 else ""
+
+
+class Results:
+    """Collect benchmark results, print, store and compare them."""
+
+    def __init__(self) -> None:
+        self._results: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+
+    def add(
+        self, name: str, seconds: float, items: int = 1, *, report: bool = True
+    ) -> None:
+        """Add the best time for a benchmark that processed items things."""
+        assert name not in self._results
+        self._results[name] = {"seconds": seconds, "items": items}
+        if report:
+            print(
+                f"{name:<44} {items:>8} {seconds * 1000:>10.2f}ms "
+                f"{seconds * 1000000 / items:>10.2f}us/item"
+            )
+
+    def write(self, file_name: str) -> None:
+        """Write results as JSON."""
+        data = {
+            "version": _FORMAT_VERSION,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": self._results,
+        }
+        with open(file_name, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+    def compare(self, file_name: str) -> None:
+        """Print the change relative to the results stored in file_name."""
+        with open(file_name, "r") as f:
+            data = json.load(f)
+        if data.get("version", 0) != _FORMAT_VERSION:
+            print(f'Can not compare to "{file_name}": Unsupported version.')
+            return
+
+        baseline = data["results"]
+        print(f"\nCompared to {data.get('commit') or file_name}:")
+        for name, result in self._results.items():
+            if name not in baseline:
+                print(f"{name:<44} {'(new)':>10}")
+                continue
+            if baseline[name]["items"] != result["items"]:
+                print(f"{name:<44} {'(items differ)':>10}")
+                continue
+            change = result["seconds"] / baseline[name]["seconds"] - 1.0
+            print(
+                f"{name:<44} {baseline[name]['seconds'] * 1000:>10.2f}ms "
+                f"-> {result['seconds'] * 1000:>10.2f}ms {change * 100:>+8.1f}%"
+            )
+
+
+def add_arguments(parser: typing.Any) -> None:
+    """Add the arguments to store and compare results to an ArgumentParser."""
+    parser.add_argument(
+        "--json",
+        dest="json_file",
+        default="",
+        metavar="<FILE>",
+        help="Store the results as JSON in FILE.",
+    )
+    parser.add_argument(
+        "--compare",
+        dest="compare_file",
+        default="",
+        metavar="<FILE>",
+        help="Compare the results to those stored in FILE by an earlier run.",
+    )
+
+
+def finish(results: Results, options: typing.Any) -> None:
+    """Store and compare results as requested by the command line options."""
+    if options.compare_file:
+        results.compare(options.compare_file)
+    if options.json_file:
+        results.write(options.json_file)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Synthetic inputs and stand-ins for benchmarking without root or btrfs.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import os
+import shutil
+import sys
+import typing
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.helper.storage import StorageBackend
+
+
+_NOOP_COMMAND = """
+from cleanroom.command import Command
+
+
+class BenchNoopCommand(Command):
+    def __init__(self, **services):
+        super().__init__(
+            "bench_noop",
+            syntax="<ARGS>*",
+            help_string="Do nothing (benchmarks only).",
+            file=__file__,
+            **services,
+        )
+
+    def validate(self, location, *args, **kwargs):
+        pass
+
+    def __call__(self, location, system_context, *args, **kwargs):
+        pass
+"""
+
+_SET_COMMAND = """
+from cleanroom.command import Command
+
+
+class BenchSetCommand(Command):
+    def __init__(self, **services):
+        super().__init__(
+            "bench_set",
+            syntax="<KEY> <VALUE>",
+            help_string="Set a substitution quietly (benchmarks only).",
+            file=__file__,
+            **services,
+        )
+
+    def validate(self, location, *args, **kwargs):
+        self._validate_arguments_exact(location, 2, "{} needs 2 arguments.", *args)
+
+    def __call__(self, location, system_context, *args, **kwargs):
+        system_context.set_substitution(args[0], args[1])
+"""
+
+
+def write_commands(directory: str) -> str:
+    """Write commands used by the benchmarks into directory and return it."""
+    os.makedirs(directory, exist_ok=True)
+    for name, contents in (("bench_noop", _NOOP_COMMAND), ("bench_set", _SET_COMMAND)):
+        with open(os.path.join(directory, f"{name}.py"), "w") as f:
+            f.write(contents)
+    return directory
+
+
+def system_definition(
+    base_system: str,
+    index: int,
+    *,
+    commands: int,
+    heredoc_lines: int,
+    substitutions: int,
+    hooks: int,
+) -> str:
+    """Generate the definition of one system.
+
+    Substitutions refer to the ones set before them, so expanding them
+    needs to resolve chains of references."""
+    lines = [f"# Synthetic system {index}", "", f"based_on {base_system}", ""]
+    for i in range(substitutions):
+        value = f"value_{index}_{i}" if i == 0 else f"${{S{index}_{i - 1}}}/{i}"
+        lines.append(f'set S{index}_{i} "{value}"')
+    for i in range(hooks):
+        lines.append(
+            f"add_hook export remove /etc/s{index}/file{i} force=True "
+            f"message='Remove file {i}'"
+        )
+    for i in range(commands):
+        kind = i % 3
+        if kind == 0:
+            lines.append(f"mkdir /usr/share/s{index}/d{i} mode=0o755 exist_ok=True")
+        elif kind == 1:
+            lines.append(f"create /etc/s{index}/file{i} <<<<")
+            lines += [
+                f"line {j} of file {i} with ${{SYSTEM_NAME}} # no comment"
+                for j in range(heredoc_lines)
+            ]
+            lines.append(">>>> mode=0o600 force=True")
+        else:
+            lines.append(f"chmod 0o644 /etc/s{index}/file{i - 1}")
+            lines.append(f"    /usr/share/s{index}/d{i - 2}  # continued")
+    return "\n".join(lines) + "\n"
+
+
+def write_systems(
+    directory: str,
+    *,
+    depth: int,
+    width: int,
+    commands: int = 20,
+    heredoc_lines: int = 10,
+    substitutions: int = 20,
+    hooks: int = 5,
+) -> typing.List[str]:
+    """Write a tree of system definitions into directory.
+
+    There is a chain of depth systems based on each other, the last of which
+    has width systems based on it. Returns the names of all systems, bases
+    first."""
+    os.makedirs(directory, exist_ok=True)
+    names = [f"chain-{i}" for i in range(depth)] + [f"leaf-{i}" for i in range(width)]
+    for index, name in enumerate(names):
+        if index < depth:
+            base_system = names[index - 1] if index > 0 else "scratch"
+        else:
+            base_system = names[depth - 1] if depth else "scratch"
+        with open(os.path.join(directory, f"{name}.def"), "w") as f:
+            f.write(
+                system_definition(
+                    base_system,
+                    index,
+                    commands=commands,
+                    heredoc_lines=heredoc_lines,
+                    substitutions=substitutions,
+                    hooks=hooks,
+                )
+            )
+    return names
+
+
+def populate_tree(
+    directory: str, *, files: int, fan_out: int = 10, file_size: int = 512
+) -> int:
+    """Fill directory with files spread over nested directories.
+
+    At most fan_out files and fan_out directories are put into each
+    directory. Returns the number of files created."""
+    contents = b"x" * file_size
+    created = 0
+    pending = [directory]
+    while pending and created < files:
+        current = pending.pop(0)
+        os.makedirs(current, exist_ok=True)
+        for i in range(min(fan_out, files - created)):
+            with open(os.path.join(current, f"file{i}.txt"), "wb") as f:
+                f.write(contents)
+            created += 1
+        pending += [os.path.join(current, f"dir{i}") for i in range(fan_out)]
+    return created
+
+
+class DirectoryStorage(StorageBackend):
+    """Stand-in for the btrfs storage backend using plain directories.
+
+    Snapshots are copies, so timings include copying where btrfs would
+    share extents."""
+
+    def __init__(self) -> None:
+        super().__init__("directory")
+
+    def is_supported(self, directory: str) -> bool:
+        return os.path.isdir(directory)
+
+    def create_volume(self, directory: str, *, compress: bool = True) -> None:
+        os.makedirs(directory)
+
+    def create_snapshot(
+        self, source: str, destination: str, *, read_only: bool = False
+    ) -> None:
+        shutil.copytree(source, destination, symlinks=True)
+
+    def delete_volume(self, directory: str) -> bool:
+        if not os.path.isdir(directory):
+            return False
+        shutil.rmtree(directory)
+        return True
+
+    def delete_volume_recursive(self, directory: str) -> None:
+        self.delete_volume(directory)
+
+    def is_volume(self, directory: str) -> bool:
+        return os.path.isdir(directory)
+
+
+class FakeBinaryManager:
+    """Stand-in for the BinaryManager: Every binary is /usr/bin/true."""
+
+    def preflight_check(self) -> None:
+        pass
+
+    def binary(self, selector: typing.Any) -> str:
+        return "/usr/bin/true"
@@ -19,6 +19,7 @@ class Binaries(Enum):
     APT_GET = auto()
     BORG = auto()
     BTRFS = auto()
+    CP = auto()
     CPIO = auto()
     DEBOOTSTRAP = auto()
     DEPMOD = auto()
@@ -87,6 +88,7 @@ def _find_binaries() -> typing.Dict[Binaries, str]:
         Binaries.APT_GET: _check_for_binary("apt-get"),
         Binaries.BORG: _check_for_binary("borg"),
         Binaries.BTRFS: _check_for_binary("btrfs"),
+        Binaries.CP: _check_for_binary("cp"),
         Binaries.CPIO: _check_for_binary("cpio"),
         Binaries.DEPMOD: _check_for_binary("depmod"),
         Binaries.DNF: _check_for_binary("dnf"),
@@ -135,6 +137,7 @@ class BinaryManager:
         self._optionals = set(
             [
                 Binaries.APT_GET,
+                Binaries.BTRFS,  # checked by the btrfs storage backend
                 Binaries.DEBOOTSTRAP,
                 Binaries.DNF,
                 Binaries.DPKG,
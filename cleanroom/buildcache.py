@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Cache keys for systems in storage.
+
+A system in storage is only reused when the cache key stored next to it
+matches the key calculated from its current inputs.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from .commandmanager import CommandManager
+from .execobject import ExecObject
+from .printer import trace
+
+from enum import Enum, auto, unique
+import hashlib
+import os
+import os.path
+import typing
+
+
+CACHE_KEY_FILE = "cache_key"
+
+
+@unique
+class CacheState(Enum):
+    """State of a system in storage."""
+
+    CACHED = auto()
+    STALE = auto()
+    MISSING = auto()
+
+
+def _update_with_file(hasher: typing.Any, path: str) -> None:
+    if os.path.islink(path):
+        hasher.update(b"L" + os.readlink(path).encode("utf-8") + b"\0")
+        return
+
+    hasher.update(b"F" + str(os.stat(path).st_mode & 0o7777).encode("utf-8") + b"\0")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    hasher.update(b"\0")
+
+
+def _update_with_directory(hasher: typing.Any, directory: str) -> None:
+    """Hash names, modes and contents of all files below directory."""
+    if not os.path.isdir(directory):
+        hasher.update(b"-\0")
+        return
+
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for f in sorted(files):
+            path = os.path.join(root, f)
+            hasher.update(os.path.relpath(path, directory).encode("utf-8") + b"\0")
+            _update_with_file(hasher, path)
+
+
+def command_set_digest(command_manager: CommandManager) -> str:
+    """Hash the sources of all known commands and their helper directories.
+
+    Commands call other commands and install hooks, so there is no way to
+    know which commands a system really depends on: Any change to any command
+    invalidates all systems."""
+    hasher = hashlib.sha256()
+    for name in command_manager.command_names():
+        command_info = command_manager.command(name)
+        assert command_info
+        hasher.update(name.encode("utf-8") + b"\0")
+        if not os.path.isfile(command_info.file_name):
+            continue  # built-in command, e.g. in tests
+        _update_with_file(hasher, command_info.file_name)
+        _update_with_directory(hasher, command_info.file_name[:-3])
+
+    return hasher.hexdigest()
+
+
+def _update_with_exec_object(hasher: typing.Any, exec_obj: ExecObject) -> None:
+    # The location is left out on purpose: Moving commands around in a
+    # definition file should not invalidate a system.
+    kwargs = sorted(exec_obj.kwargs.items())
+    hasher.update(repr((exec_obj.command, exec_obj.args, kwargs)).encode("utf-8"))
+    hasher.update(b"\0")
+
+
+def system_cache_key(
+    *,
+    system_name: str,
+    exec_obj_list: typing.List[ExecObject],
+    systems_definition_directory: str,
+    command_digest: str,
+    base_cache_key: str = "",
+) -> str:
+    """Calculate the cache key of a system.
+
+    The key covers the commands of the system, its helper directory, the
+    configuration directories of all commands used, the command sources and
+    the key of the base system."""
+    hasher = hashlib.sha256()
+    hasher.update(f"system:{system_name}\0".encode("utf-8"))
+    hasher.update(f"base:{base_cache_key}\0".encode("utf-8"))
+    hasher.update(f"commands:{command_digest}\0".encode("utf-8"))
+
+    for exec_obj in exec_obj_list:
+        _update_with_exec_object(hasher, exec_obj)
+
+    hasher.update(b"helper\0")
+    _update_with_directory(
+        hasher, os.path.join(systems_definition_directory, system_name)
+    )
+
+    for command in sorted({e.command for e in exec_obj_list}):
+        hasher.update(f"config:{command}\0".encode("utf-8"))
+        _update_with_directory(
+            hasher, os.path.join(systems_definition_directory, "config", command)
+        )
+
+    result = hasher.hexdigest()
+    trace(f'Cache key of "{system_name}" is {result}.')
+    return result
+
+
+def read_cache_key(storage_directory: str, system_name: str) -> str:
+    """Read the cache key of a system in storage."""
+    key_file = os.path.join(storage_directory, system_name, CACHE_KEY_FILE)
+    if not os.path.isfile(key_file):
+        return ""
+    with open(key_file, "r") as f:
+        return f.read().strip()
+
+
+def write_cache_key(storage_directory: str, system_name: str, cache_key: str) -> None:
+    """Write the cache key of a system in storage."""
+    key_file = os.path.join(storage_directory, system_name, CACHE_KEY_FILE)
+    with open(key_file + ".tmp", "w") as f:
+        f.write(cache_key + "\n")
+    os.rename(key_file + ".tmp", key_file)
+
+
+def cache_state(storage_directory: str, system_name: str, cache_key: str) -> CacheState:
+    """Check whether a system in storage matches the cache key."""
+    if not os.path.isdir(os.path.join(storage_directory, system_name)):
+        return CacheState.MISSING
+    if read_cache_key(storage_directory, system_name) != cache_key:
+        return CacheState.STALE
+    return CacheState.CACHED
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Durations of previous system builds.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from .printer import debug, warn
+
+import json
+import os
+import os.path
+import typing
+
+
+BUILD_TIMES_FILE = "build_times.json"
+
+
+class BuildTimes:
+    """Remember how long the last builds of each system took."""
+
+    def __init__(self, file_name: str, *, history: int = 5) -> None:
+        """Constructor."""
+        assert history > 0
+        self._file_name = file_name
+        self._history = history
+        self._durations: typing.Dict[str, typing.List[float]] = {}
+
+        if os.path.isfile(file_name):
+            try:
+                with open(file_name, "r") as f:
+                    data = json.load(f)
+                self._durations = {
+                    k: [float(d) for d in v] for k, v in data.get("systems", {}).items()
+                }
+            except (ValueError, AttributeError, TypeError) as e:
+                warn(f'Ignoring broken build times file "{file_name}": {e}')
+
+    def estimate(self, system_name: str) -> typing.Optional[float]:
+        """Estimate the duration of a build of system_name in seconds."""
+        durations = self._durations.get(system_name, [])
+        if not durations:
+            return None
+        return sum(durations) / len(durations)
+
+    def record(self, system_name: str, duration: float) -> None:
+        """Record a successful build and store the updated data."""
+        debug(f'Build of "{system_name}" took {duration:.1f}s.')
+        durations = self._durations.get(system_name, []) + [duration]
+        self._durations[system_name] = durations[-self._history :]
+        self._save()
+
+    def _save(self) -> None:
+        tmp_file = self._file_name + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"version": 1, "systems": self._durations}, f, indent=2)
+        os.rename(tmp_file, self._file_name)
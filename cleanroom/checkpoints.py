@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints taken while a system is being built.
+
+A checkpoint holds read-only snapshots of the scratch directory of a system
+after one of its commands was run, together with the state of the system
+context at that time. Checkpoints are keyed by a hash over all commands up
+to that point, so a rebuild can continue after the last unchanged expensive
+command instead of starting from scratch.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from .execobject import ExecObject
+from .helper.storage import StorageBackend
+from .printer import debug, info, trace, verbose
+from .systemcontext import SystemContext
+
+import fcntl
+import os
+import os.path
+import pickle
+import shutil
+import time
+import typing
+
+
+DEFAULT_CHECKPOINT_COMMANDS = ("debootstrap", "dnf", "pacman", "pacstrap", "swupd")
+
+_VOLUMES = ("fs", "meta", "boot", "cache")
+_STATE_FILE = "state.bin"
+_COMPLETE_FILE = "complete"
+_LOCK_FILE = ".lock"
+
+
+def checkpoint_keys(
+    exec_obj_list: typing.List[ExecObject],
+    commands: typing.Iterable[str],
+    key_function: typing.Callable[[typing.List[ExecObject]], str],
+) -> typing.Dict[int, str]:
+    """Calculate checkpoint keys for all commands that should be checkpointed.
+
+    key_function is called with the list of commands up to and including the
+    one to checkpoint after."""
+    command_set = set(commands)
+    result: typing.Dict[int, str] = {}
+    for index, exec_obj in enumerate(exec_obj_list[:-1]):  # never after _teardown
+        if exec_obj.command in command_set:
+            result[index] = key_function(exec_obj_list[: index + 1])
+    return result
+
+
+class _Lock:
+    def __init__(self, directory: str) -> None:
+        self._path = os.path.join(directory, _LOCK_FILE)
+        self._fd: typing.Optional[typing.IO[str]] = None
+
+    def __enter__(self) -> typing.Any:
+        self._fd = open(self._path, "a")
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type: typing.Any, exc_val: typing.Any, exc_tb: typing.Any):
+        assert self._fd
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._fd.close()
+        self._fd = None
+        return False
+
+
+class CheckpointManager:
+    """Create, restore and evict checkpoints."""
+
+    def __init__(
+        self,
+        storage: StorageBackend,
+        checkpoint_directory: str,
+        *,
+        max_checkpoints: int = 20,
+        max_age: int = 0,
+    ) -> None:
+        """Constructor.
+
+        Keep at most max_checkpoints checkpoints, evicting the least recently
+        used ones first. Checkpoints not used for more than max_age seconds
+        are evicted, too (unless max_age is 0)."""
+        assert max_checkpoints >= 0
+        self._storage = storage
+        self._directory = checkpoint_directory
+        self._max_checkpoints = max_checkpoints
+        self._max_age = max_age
+
+        os.makedirs(self._directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key)
+
+    def _is_complete(self, key: str) -> bool:
+        return os.path.isfile(os.path.join(self._path(key), _COMPLETE_FILE))
+
+    def find(self, keys: typing.Dict[int, str]) -> int:
+        """Return the index of the deepest command with a checkpoint or -1."""
+        for index in sorted(keys.keys(), reverse=True):
+            if self._is_complete(keys[index]):
+                debug(f"Found checkpoint {keys[index]} after command {index}.")
+                return index
+        return -1
+
+    def create(self, key: str, system_context: SystemContext) -> None:
+        """Create a checkpoint of the system_context."""
+        if self._max_checkpoints == 0:
+            return
+
+        with _Lock(self._directory):
+            if self._is_complete(key):
+                return
+
+            path = self._path(key)
+            if os.path.exists(path):
+                self._delete(key)  # incomplete leftover
+            os.makedirs(path)
+
+            verbose(f"Creating checkpoint {key}.")
+            for volume in _VOLUMES:
+                self._storage.create_snapshot(
+                    os.path.join(system_context.scratch_directory, volume),
+                    os.path.join(path, volume),
+                    read_only=True,
+                )
+            with open(os.path.join(path, _STATE_FILE), "wb") as sf:
+                pickle.dump(system_context.checkpoint_state(), sf)
+            with open(os.path.join(path, _COMPLETE_FILE), "w") as cf:
+                cf.write(f"{system_context.system_name}\n")
+
+            self._evict()
+
+    def restore(self, key: str, system_context: SystemContext) -> None:
+        """Restore a checkpoint into the scratch directory of system_context."""
+        with _Lock(self._directory):
+            path = self._path(key)
+            assert self._is_complete(key)
+
+            info(f"Restoring checkpoint {key}.")
+            scratch = system_context.scratch_directory
+            if not os.path.isdir(scratch):
+                self._storage.create_scratch(scratch)
+            for volume in _VOLUMES:
+                self._storage.create_snapshot(
+                    os.path.join(path, volume), os.path.join(scratch, volume)
+                )
+            with open(os.path.join(path, _STATE_FILE), "rb") as sf:
+                system_context.restore_checkpoint_state(pickle.load(sf))
+
+            os.utime(os.path.join(path, _COMPLETE_FILE))  # mark as recently used
+
+    def _delete(self, key: str) -> None:
+        trace(f"Deleting checkpoint {key}.")
+        path = self._path(key)
+        for volume in _VOLUMES:
+            volume_path = os.path.join(path, volume)
+            if os.path.isdir(volume_path):
+                self._storage.delete_volume(volume_path)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _evict(self) -> None:
+        """Evict checkpoints according to the eviction policy."""
+        checkpoints: typing.List[typing.Tuple[float, str]] = []
+        with os.scandir(self._directory) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                complete = os.path.join(entry.path, _COMPLETE_FILE)
+                if os.path.isfile(complete):
+                    checkpoints.append((os.path.getmtime(complete), entry.name))
+
+        checkpoints.sort(reverse=True)  # most recently used first
+        now = time.time()
+        for index, (mtime, key) in enumerate(checkpoints):
+            if index >= self._max_checkpoints or (
+                self._max_age > 0 and now - mtime > self._max_age
+            ):
+                debug(f"Evicting checkpoint {key}.")
+                self._delete(key)
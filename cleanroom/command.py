@@ -15,6 +15,7 @@ from .execobject import ExecObject
 from .location import Location
 from .printer import debug, fail, h3, success, verbose
 from .systemcontext import SystemContext
+from .tracing import span
 
 import os
 import os.path
@@ -134,7 +135,13 @@ class Command:
         if not command_info:
             raise GenerateError(f'Command "{command}" not found.')
         command_info.validate_func(location, args, kwargs)
-        command_info.execute_func(location, system_context, args, kwargs)
+        with span(
+            command,
+            "execute",
+            location=lambda: str(location),
+            command=lambda: stringify(command, args, kwargs),
+        ):
+            command_info.execute_func(location, system_context, args, kwargs)
 
     def _add_hook(
         self,
@@ -163,13 +170,21 @@ class Command:
 
         h3(f'Running "{hook_name}" hooks.')
 
-        for hook in system_context.hooks(hook_name):
-            command_info = self._service("command_manager").command(hook.command)
-            if not command_info:
-                raise GenerateError(f'Command "{hook.command}" not found.')
-            command_info.execute_func(
-                hook.location, system_context, hook.args, hook.kwargs
-            )
+        with span(hook_name, "hooks"):
+            for hook in system_context.hooks(hook_name):
+                command_info = self._service("command_manager").command(hook.command)
+                if not command_info:
+                    raise GenerateError(f'Command "{hook.command}" not found.')
+                with span(
+                    hook.command,
+                    "hook",
+                    hook=hook_name,
+                    location=lambda: str(hook.location),
+                    command=lambda: stringify(hook.command, hook.args, hook.kwargs),
+                ):
+                    command_info.execute_func(
+                        hook.location, system_context, hook.args, hook.kwargs
+                    )
 
         success(f'Hooks "{hook_name}" were run successfully.', verbosity=1)
 
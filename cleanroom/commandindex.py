@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Cache the descriptions of commands on disk.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from .printer import debug, trace, warn
+
+import json
+import os
+import os.path
+import typing
+
+
+# Bump this whenever the entries change in an incompatible way:
+_FORMAT_VERSION = 1
+
+
+class CommandIndexEntry(typing.NamedTuple):
+    name: str
+    syntax_string: str
+    help_string: str
+    target_distribution: str
+    substitutions: typing.List[typing.Tuple[str, str, str]]
+
+
+class CommandIndex:
+    """Map command files to the description of the command they contain.
+
+    Entries are invalidated when the modification time or the size of the
+    command file changes. This allows to list and parse commands without
+    importing all the command modules."""
+
+    def __init__(self, file_name: str) -> None:
+        """Constructor."""
+        self._file_name = file_name
+        self._entries: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self._changed = False
+
+        if os.path.isfile(file_name):
+            try:
+                with open(file_name, "r") as f:
+                    data = json.load(f)
+                if data.get("version", 0) == _FORMAT_VERSION:
+                    self._entries = data["commands"]
+            except (ValueError, KeyError, AttributeError, TypeError) as e:
+                warn(f'Ignoring broken command index "{file_name}": {e}')
+
+    @staticmethod
+    def _stamp(file_name: str) -> typing.List[int]:
+        stat = os.stat(file_name)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def get(self, file_name: str) -> typing.Optional[CommandIndexEntry]:
+        """Return the entry for file_name, None if it is missing or outdated."""
+        data = self._entries.get(file_name, None)
+        if data is None or data.get("stamp", []) != self._stamp(file_name):
+            trace(f'Command index miss for "{file_name}".')
+            return None
+
+        try:
+            return CommandIndexEntry(
+                name=data["name"],
+                syntax_string=data["syntax"],
+                help_string=data["help"],
+                target_distribution=data["target_distribution"],
+                substitutions=[
+                    (key, value, description)
+                    for key, value, description in data["substitutions"]
+                ],
+            )
+        except (KeyError, ValueError, TypeError) as e:
+            debug(f'Ignoring broken command index entry for "{file_name}": {e}.')
+            return None
+
+    def put(self, file_name: str, entry: CommandIndexEntry) -> None:
+        """Store the entry for file_name."""
+        self._entries[file_name] = {
+            "stamp": self._stamp(file_name),
+            "name": entry.name,
+            "syntax": entry.syntax_string,
+            "help": entry.help_string,
+            "target_distribution": entry.target_distribution,
+            "substitutions": [list(s) for s in entry.substitutions],
+        }
+        self._changed = True
+
+    def save(self) -> None:
+        """Write the index to disk if it changed, dropping deleted files."""
+        for file_name in [f for f in self._entries if not os.path.isfile(f)]:
+            del self._entries[file_name]
+            self._changed = True
+        if not self._changed:
+            return
+
+        os.makedirs(os.path.dirname(self._file_name) or ".", exist_ok=True)
+        tmp_file = f"{self._file_name}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"version": _FORMAT_VERSION, "commands": self._entries}, f)
+        os.rename(tmp_file, self._file_name)
+        self._changed = False
@@ -5,11 +5,13 @@
 """
 
 from .command import Command, stringify
+from .commandindex import CommandIndex, CommandIndexEntry
 from .exceptions import PreflightError
 from .location import Location
 from .printer import debug, h2, success, trace, warn
 from .systemcontext import SystemContext
 
+import functools
 import importlib.util
 import inspect
 import os
@@ -74,12 +76,21 @@ def call_command(
 class CommandManager:
     """Manage the list of available commands."""
 
-    def __init__(self, *command_directories: str, **services: typing.Any) -> None:
+    def __init__(
+        self, *command_directories: str, index_file: str = "", **services: typing.Any
+    ) -> None:
+        """Constructor.
+
+        Command modules are only imported once a command is first used when
+        an index_file is given to cache the command descriptions in."""
         self._commands: typing.Dict[str, CommandInfo] = {}
+        self._instances: typing.Dict[str, typing.Any] = {}
         self._search_directories = command_directories
         self._services_to_propagate = services
         self._services_to_propagate["command_manager"] = self
-        self._find_commands(*command_directories)
+        self._find_commands(
+            *command_directories, index=CommandIndex(index_file) if index_file else None
+        )
 
     def print_commands(self) -> None:
         """Print a list of all known commands."""
@@ -168,100 +179,158 @@ class CommandManager:
     def command(self, name: str) -> typing.Optional[CommandInfo]:
         return self._commands.get(name, None)
 
+    def command_names(self) -> typing.List[str]:
+        return sorted(self._commands.keys())
+
     def _add_command(self, name: str, file_name: str, command: typing.Any) -> None:
+        self._instances[file_name] = command
+        self._add_command_info(
+            file_name,
+            CommandIndexEntry(
+                name=name,
+                syntax_string=command.syntax_string,
+                help_string=command.help_string,
+                target_distribution=command.target_distribution,
+                substitutions=command.register_substitutions(),
+            ),
+        )
+
+    def _add_command_info(self, file_name: str, entry: CommandIndexEntry) -> None:
+        name = entry.name
+
         def __validate_func(
-            cmd: Command, location: Location, *args: typing.Any, **kwargs: typing.Any
+            location: Location, *args: typing.Any, **kwargs: typing.Any
         ) -> None:
-            cmd_str = stringify(cmd.name, args, kwargs)
-            trace(f"{location} Validating {cmd_str}.")
-            (command.validate(location, *args, **kwargs),)
-            success(f"{location}: Validated {cmd_str}.", verbosity=4)
+            cmd_str = functools.partial(stringify, name, args, kwargs)
+            trace(lambda: f"{location} Validating {cmd_str()}.")
+            self._instance(name, file_name).validate(location, *args, **kwargs)
+            success(lambda: f"{location}: Validated {cmd_str()}.", verbosity=4)
 
         def __dependency_func(
-            cmd: Command, *args: typing.Any, **kwargs: typing.Any
+            *args: typing.Any, **kwargs: typing.Any
         ) -> typing.Optional[str]:
-            cmd_str = stringify(cmd.name, args, kwargs)
-            trace(f"Getting dependency of {cmd_str}.")
-            result = cmd.dependency(*args, **kwargs)
+            cmd_str = functools.partial(stringify, name, args, kwargs)
+            trace(lambda: f"Getting dependency of {cmd_str()}.")
+            result = self._instance(name, file_name).dependency(*args, **kwargs)
             success(
-                f'Dependency of {cmd_str} is "{result}".',
+                lambda: f'Dependency of {cmd_str()} is "{result}".',
                 verbosity=4 if not result else 2,
             )
             return result
 
         def __execute_func(
-            cmd: Command,
             location: Location,
             system_context: SystemContext,
             *args: typing.Any,
             **kwargs: typing.Any,
         ) -> None:
-            cmd_str = stringify(cmd.name, args, kwargs)
-            trace(f"{system_context.system_name}::{location}: Executing {cmd_str}.")
-            call_command(location, system_context, cmd, *args, **kwargs)
+            system_name = system_context.system_name
+            cmd_str = functools.partial(stringify, name, args, kwargs)
+            trace(lambda: f"{system_name}::{location}: Executing {cmd_str()}.")
+            call_command(
+                location,
+                system_context,
+                self._instance(name, file_name),
+                *args,
+                **kwargs,
+            )
             success(
-                f"{system_context.system_name}::{location}: Executed {cmd_str}.",
+                lambda: f"{system_name}::{location}: Executed {cmd_str()}.",
                 verbosity=2,
             )
 
-        target_distribution = command.target_distribution
+        target_distribution = entry.target_distribution
         if target_distribution and not target_distribution.isalpha():
             raise PreflightError(
                 f'Command "{name}" has invalid target distribution "{target_distribution}".'
             )
 
+        substitutions = list(entry.substitutions)
         self._commands[name] = CommandInfo(
             name=name,
-            syntax_string=command.syntax_string,
-            help_string=command.help_string,
+            syntax_string=entry.syntax_string,
+            help_string=entry.help_string,
             file_name=file_name,
             target_distribution=target_distribution,
-            dependency_func=lambda args, kwargs: __dependency_func(
-                command, *args, **kwargs
-            ),
+            dependency_func=lambda args, kwargs: __dependency_func(*args, **kwargs),
             validate_func=lambda loc, args, kwargs: __validate_func(
-                command, loc, *args, **kwargs
+                loc, *args, **kwargs
             ),
             execute_func=lambda loc, sc, args, kwargs: __execute_func(
-                command, loc, sc, *args, **kwargs
+                loc, sc, *args, **kwargs
             ),
-            register_substitutions=command.register_substitutions,
+            register_substitutions=lambda: list(substitutions),
         )
 
-    def _find_commands_in_directory(self, directory: str) -> None:
+    def _instance(self, name: str, file_name: str) -> typing.Any:
+        instance = self._instances.get(file_name, None)
+        if instance is None:
+            instance = self._load_command(name, file_name)
+            if instance is None:
+                raise PreflightError(f'No command defined in "{file_name}".')
+            self._instances[file_name] = instance
+        return instance
+
+    def _load_command(self, command_name: str, command_file_name: str) -> typing.Any:
+        trace(f"Loading command from {command_file_name}.")
+
+        name = "cleanroom.commands." + command_name
+
+        spec = importlib.util.spec_from_file_location(name, command_file_name)
+        assert spec
+        cmd_module = importlib.util.module_from_spec(spec)
+        assert spec and spec.loader
+        spec.loader.exec_module(cmd_module)
+
+        def is_command(x: typing.Any) -> bool:
+            return (
+                inspect.isclass(x)
+                and x.__name__.endswith("Command")
+                and x.__module__ == name
+            )
+
+        command_class = inspect.getmembers(cmd_module, is_command)
+        if len(command_class) == 0:
+            return None
+        assert len(command_class) == 1
+        return command_class[0][1](**self._services_to_propagate)
+
+    def _find_commands_in_directory(
+        self, directory: str, index: typing.Optional[CommandIndex]
+    ) -> None:
         for f in sorted(os.listdir(directory)):
             if not f.endswith(".py"):
                 continue
 
             command_file_name = os.path.join(directory, f)
-
-            trace(f"Loading command from {command_file_name}.")
-
             command_name = f[:-3]
-            name = "cleanroom.commands." + command_name
-
-            spec = importlib.util.spec_from_file_location(name, command_file_name)
-            assert spec
-            cmd_module = importlib.util.module_from_spec(spec)
-            assert spec and spec.loader
-            spec.loader.exec_module(cmd_module)
-
-            def is_command(x: typing.Any) -> bool:
-                return (
-                    inspect.isclass(x)
-                    and x.__name__.endswith("Command")
-                    and x.__module__ == name
-                )
 
-            command_class = inspect.getmembers(cmd_module, is_command)
-            if len(command_class) == 0:
+            entry = index.get(os.path.abspath(command_file_name)) if index else None
+            if entry and entry.name == command_name:
+                self._add_command_info(command_file_name, entry)
+                continue
+
+            instance = self._load_command(command_name, command_file_name)
+            if instance is None:
                 warn("No command defined, SKIPPING.")
                 continue
-            assert len(command_class) == 1
-            instance = command_class[0][1](**self._services_to_propagate)
             self._add_command(command_name, command_file_name, instance)
+            if index:
+                info = self._commands[command_name]
+                index.put(
+                    os.path.abspath(command_file_name),
+                    CommandIndexEntry(
+                        name=command_name,
+                        syntax_string=info.syntax_string,
+                        help_string=info.help_string,
+                        target_distribution=info.target_distribution,
+                        substitutions=info.register_substitutions(),
+                    ),
+                )
 
-    def _find_commands(self, *directories: str) -> None:
+    def _find_commands(
+        self, *directories: str, index: typing.Optional[CommandIndex] = None
+    ) -> None:
         """Find possible commands in the file system."""
         debug("Searching for available commands")
         visited_directories: typing.Set[str] = set()
@@ -272,7 +341,10 @@ class CommandManager:
             if not os.path.isdir(directory):
                 continue  # skip non-existing directories
 
-            self._find_commands_in_directory(directory)
+            self._find_commands_in_directory(directory, index)
+
+        if index:
+            index.save()
 
         debug("Commands found:")
         for command_name, command_info in self._commands.items():
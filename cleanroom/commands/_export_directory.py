@@ -8,8 +8,10 @@ from cleanroom.binarymanager import Binaries
 from cleanroom.command import Command
 from cleanroom.helper.run import run
 from cleanroom.location import Location
+from cleanroom.metrics import record_metric
 from cleanroom.systemcontext import SystemContext
 
+import time
 import typing
 import os
 
@@ -60,13 +62,16 @@ class ExportDirectoryCommand(Command):
 
         backup_name = system_context.system_name + "-" + system_context.timestamp
 
-        env = os.environ
-        env["BORG_UNKNOWN_UNENCRYPTED_ACCESS_IS_OK"] = "yes"
-        env["BORG_RELOCATED_REPO_ACCESS_IS_OK"] = "yes"
+        env = {
+            **os.environ,
+            "BORG_UNKNOWN_UNENCRYPTED_ACCESS_IS_OK": "yes",
+            "BORG_RELOCATED_REPO_ACCESS_IS_OK": "yes",
+        }
 
         comp = kwargs.get("compression", "zstd")
         comp_level = kwargs.get("compression_level", 5)
 
+        start_time = time.monotonic()
         run(
             self._service("binary_manager").binary(Binaries.BORG),
             "create",
@@ -78,3 +83,8 @@ class ExportDirectoryCommand(Command):
             work_directory=export_directory,
             env=env,
         )
+        record_metric(
+            system_context.system_name,
+            "export_upload_seconds",
+            time.monotonic() - start_time,
+        )
@@ -48,25 +48,22 @@ class RestoreCommand(Command):
             and system_context.base_context.system_name == base
         )
 
-        btrfs_helper = self._service("btrfs_helper")
+        storage = self._service("storage")
 
         if not os.path.isdir(system_context.scratch_directory):
-            btrfs_helper.create_subvolume(system_context.scratch_directory)
-            btrfs_helper.set_property(
-                system_context.scratch_directory, name="compression", value="none"
-            )
+            storage.create_scratch(system_context.scratch_directory)
 
-        btrfs_helper.create_snapshot(
+        storage.create_snapshot(
             os.path.join(system_context.base_storage_directory, "meta"),
             system_context.meta_directory,
         )
-        btrfs_helper.create_snapshot(
+        storage.create_snapshot(
             os.path.join(system_context.base_storage_directory, "boot"),
             system_context.boot_directory,
         )
-        btrfs_helper.create_snapshot(
+        storage.create_snapshot(
             os.path.join(system_context.base_storage_directory, "fs"),
             system_context.fs_directory,
         )
 
-        btrfs_helper.create_subvolume(system_context.cache_directory)
+        storage.create_volume(system_context.cache_directory)
@@ -6,8 +6,8 @@
 
 from cleanroom.binarymanager import Binaries
 from cleanroom.command import Command
-from cleanroom.helper.btrfs import BtrfsHelper
 from cleanroom.helper.run import run
+from cleanroom.helper.storage import StorageBackend
 from cleanroom.location import Location
 from cleanroom.systemcontext import SystemContext
 
@@ -16,12 +16,12 @@ import typing
 
 
 def _setup_scratch_directory(
-    system_context: SystemContext, btrfs_helper: BtrfsHelper
+    system_context: SystemContext, storage: StorageBackend
 ) -> None:
-    btrfs_helper.create_subvolume(system_context.fs_directory)
-    btrfs_helper.create_subvolume(system_context.cache_directory)
-    btrfs_helper.create_subvolume(system_context.meta_directory)
-    btrfs_helper.create_subvolume(system_context.boot_directory)
+    storage.create_volume(system_context.fs_directory)
+    storage.create_volume(system_context.cache_directory)
+    storage.create_volume(system_context.meta_directory)
+    storage.create_volume(system_context.boot_directory)
 
 
 def _setup_fs_directory(system_context: SystemContext, mknod_command: str) -> None:
@@ -128,5 +128,5 @@ class SetupCommand(Command):
         **kwargs: typing.Any,
     ) -> None:
         """Execute command."""
-        _setup_scratch_directory(system_context, self._service("btrfs_helper"))
+        _setup_scratch_directory(system_context, self._service("storage"))
         _setup_fs_directory(system_context, self._binary(Binaries.MKNOD))
@@ -38,17 +38,17 @@ class StoreCommand(Command):
     ) -> None:
         """Execute command."""
 
-        btrfs_helper = self._service("btrfs_helper")
+        storage_backend = self._service("storage")
 
-        btrfs_helper.create_subvolume(system_context.system_storage_directory)
+        storage_backend.create_volume(system_context.system_storage_directory)
 
         storage = system_context.system_storage_directory
-        btrfs_helper.create_snapshot(
+        storage_backend.create_snapshot(
             system_context.meta_directory, os.path.join(storage, "meta"), read_only=True
         )
-        btrfs_helper.create_snapshot(
+        storage_backend.create_snapshot(
             system_context.boot_directory, os.path.join(storage, "boot"), read_only=True
         )
-        btrfs_helper.create_snapshot(
+        storage_backend.create_snapshot(
             system_context.fs_directory, os.path.join(storage, "fs"), read_only=True
         )
@@ -8,6 +8,7 @@ from cleanroom.command import Command
 from cleanroom.systemcontext import SystemContext
 from cleanroom.location import Location
 from cleanroom.printer import debug
+from cleanroom.workdir import move_to_trash
 
 import typing
 
@@ -40,11 +41,11 @@ class TeardownCommand(Command):
         self._run_hooks(system_context, "_teardown")
         self._run_hooks(system_context, "testing")
 
-        system_context.pickle()
+        system_context.store_state()
 
         self._execute(location, system_context, "_store")
 
         debug(f'Cleaning up everything in "{system_context.scratch_directory}".')
-        self._service("btrfs_helper").delete_subvolume_recursive(
-            system_context.scratch_directory
-        )
+        storage = self._service("storage")
+        if not move_to_trash(system_context.scratch_directory, storage):
+            storage.delete_volume_recursive(system_context.scratch_directory)
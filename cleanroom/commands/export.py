@@ -10,6 +10,7 @@ from cleanroom.exceptions import GenerateError, ParseError
 from cleanroom.location import Location
 from cleanroom.helper.file import exists, file_size
 from cleanroom.helper.run import run
+from cleanroom.metrics import record_metric
 from cleanroom.systemcontext import SystemContext
 from cleanroom.printer import debug, h2, info, trace, verbose
 
@@ -417,10 +418,10 @@ class ExportCommand(Command):
     def create_export_directory(self, system_context: SystemContext) -> str:
         """Return the root directory."""
         export_volume = os.path.join(system_context.scratch_directory, "export")
-        btrfs_helper = self._service("btrfs_helper")
-        if btrfs_helper.is_subvolume(export_volume):
-            btrfs_helper.delete_subvolume_recursive(export_volume)
-        btrfs_helper.create_subvolume(export_volume)
+        storage = self._service("storage")
+        if storage.is_volume(export_volume):
+            storage.delete_volume_recursive(export_volume)
+        storage.create_volume(export_volume)
 
         return export_volume
 
@@ -476,9 +477,22 @@ class ExportCommand(Command):
             verity_uuid=verity_uuid,
         )
 
+        for image, image_file in (
+            ("squashfs", root_partition),
+            ("verity", verity_partition),
+            ("efi", efi_partition),
+            ("img", image_filename),
+        ):
+            record_metric(
+                system_context.system_name,
+                "image_size_bytes",
+                file_size(None, image_file),
+                image=image,
+            )
+
     def delete_export_directory(self, export_directory: str) -> None:
         """Nothing to see, move on."""
-        self._service("btrfs_helper").delete_subvolume(export_directory)
+        self._service("storage").delete_volume(export_directory)
 
     def _create_efi_kernel(
         self,
@@ -4,10 +4,14 @@
 @author: Tobias Hunger <tobias.hunger@gmail.com>
 """
 
+from .checkpoints import CheckpointManager
+from .command import stringify
 from .commandmanager import CommandManager
 from .execobject import ExecObject
-from .printer import success
+from .printer import Printer, success
+from .resourceusage import set_system
 from .systemcontext import SystemContext
+from .tracing import span
 
 import os
 import typing
@@ -24,6 +28,7 @@ class Executor:
         command_manager: CommandManager,
         repository_base_directory: str,
         timestamp: str,
+        checkpoint_manager: typing.Optional[CheckpointManager] = None,
     ) -> None:
         assert scratch_directory
         assert systems_definition_directory
@@ -33,6 +38,7 @@ class Executor:
         self._command_manager = command_manager
         self._timestamp = timestamp
         self._repository_base_directory = repository_base_directory
+        self._checkpoint_manager = checkpoint_manager
 
     def run(
         self,
@@ -40,8 +46,43 @@ class Executor:
         base_system_name: typing.Optional[str],
         exec_obj_list: typing.List[ExecObject],
         storage_directory: str,
+        checkpoint_keys: typing.Optional[typing.Dict[int, str]] = None,
     ) -> None:
-        """Run the command_list for the system the executor was set up for."""
+        """Run the command_list for the system the executor was set up for.
+
+        checkpoint_keys maps indices into exec_obj_list to the keys of the
+        checkpoints to create after those commands."""
+        checkpoints = self._checkpoint_manager
+        keys = checkpoint_keys if checkpoints and checkpoint_keys else {}
+
+        printer = Printer.instance()
+        printer.set_context(system=system_name)
+        set_system(system_name)
+        try:
+            self._run(
+                printer,
+                system_name,
+                base_system_name,
+                exec_obj_list,
+                storage_directory,
+                keys,
+            )
+        finally:
+            printer.set_context()
+            set_system("")
+        success(f"System {system_name} created successfully.")
+
+    def _run(
+        self,
+        printer: Printer,
+        system_name: str,
+        base_system_name: typing.Optional[str],
+        exec_obj_list: typing.List[ExecObject],
+        storage_directory: str,
+        keys: typing.Dict[int, str],
+    ) -> None:
+        checkpoints = self._checkpoint_manager
+
         with SystemContext(
             system_name=system_name,
             base_system_name=base_system_name or "",
@@ -53,11 +94,35 @@ class Executor:
         ) as system_context:
             self._command_manager.setup_substitutions(system_context)
 
-            for exec_obj in exec_obj_list:
+            start = 0
+            if keys:
+                assert checkpoints
+                resume_index = checkpoints.find(keys)
+                if resume_index >= 0:
+                    checkpoints.restore(keys[resume_index], system_context)
+                    start = resume_index + 1
+
+            for index in range(start, len(exec_obj_list)):
+                exec_obj = exec_obj_list[index]
+                printer.set_context(system=system_name, location=str(exec_obj.location))
                 os.chdir(system_context.systems_definition_directory)
                 command = self._command_manager.command(exec_obj.command)
                 assert command
-                command.execute_func(
-                    exec_obj.location, system_context, exec_obj.args, exec_obj.kwargs
-                )
-        success(f"System {system_name} created successfully.")
+                with span(
+                    exec_obj.command,
+                    "exec_object",
+                    location=lambda: str(exec_obj.location),
+                    command=lambda: stringify(
+                        exec_obj.command, exec_obj.args, exec_obj.kwargs
+                    ),
+                ):
+                    command.execute_func(
+                        exec_obj.location,
+                        system_context,
+                        exec_obj.args,
+                        exec_obj.kwargs,
+                    )
+
+                if index in keys:
+                    assert checkpoints
+                    checkpoints.create(keys[index], system_context)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Hand-written single pass parser for system definition files.
+
+This reproduces the pyparsing grammar in parser.py exactly, but runs in
+linear time over the input.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from .exceptions import ParseError
+from .location import Location
+
+import re
+import string
+import typing
+
+
+Argument = typing.Dict[str, str]
+Command = typing.Tuple[int, str, typing.List[Argument]]
+
+
+_WHITESPACE = " \t"
+# Skipped before the indentation of a continuation line:
+_OTHER_WHITESPACE = frozenset(
+    "\n\r\f\xa0\u1680\u180e\u2000\u2001\u2002\u2003\u2004\u2005\u2006"
+    "\u2007\u2008\u2009\u200a\u200b\u202f\u205f\u3000"
+)
+_IDENTIFIER_START = frozenset(string.ascii_letters)
+_IDENTIFIER_BODY = frozenset(string.ascii_letters + string.digits + "_-")
+_SIMPLE = frozenset(string.ascii_letters + string.digits + "_-+*!$%&/()[]{}.,;:")
+
+_MULTILINE_START = "<<<<"
+_MULTILINE_END = ">>>>"
+
+# Escape sequences are resolved exactly like pyparsing's QuotedString does it,
+# quirks included: Its numeric escapes are "\0", "\x" followed by one hex
+# digit and a "2" and "\u" followed by one hex digit and a "4".
+_ESCAPES = {"\\t": "\t", "\\n": "\n", "\\f": "\f", "\\r": "\r"}
+_QUOTED_ESCAPE_PATTERN = re.compile(
+    r"(\\t|\\n|\\f|\\r)" r"|(\\[0-7]3|\\0|\\x[0-9a-fA-F]2|\\u[0-9a-fA-F]4)" r"|(\\.)"
+)
+_MULTILINE_ESCAPE_PATTERN = re.compile(
+    r"(\\t|\\n|\\f|\\r)" r"|(\\[0-7]3|\\0|\\x[0-9a-fA-F]2|\\u[0-9a-fA-F]4)"
+)
+
+
+def _replace_escape(match: typing.Match[str]) -> str:
+    if match.group(1):
+        return _ESCAPES[match.group(1)]
+    numeric = match.group(2)
+    if numeric:
+        if numeric == "\\0":
+            return "\0"
+        if numeric[1] in "xu":
+            return chr(int(numeric[2:], 16))
+        return numeric[1:]
+    return match.group(3)[-1]
+
+
+class _Tokenizer:
+    """State of one parser run over a string."""
+
+    def __init__(self, data: str, file_name: str) -> None:
+        self._data = data
+        self._length = len(data)
+        self._file_name = file_name
+
+        self._line = 1
+        self._line_pos = 0
+
+    def _line_number(self, pos: int) -> int:
+        # Positions are only ever requested in increasing order:
+        self._line += self._data.count("\n", self._line_pos, pos)
+        self._line_pos = pos
+        return self._line
+
+    def _error(self, message: str, pos: int) -> ParseError:
+        return ParseError(
+            message,
+            location=Location(
+                file_name=self._file_name,
+                line_number=self._line_number(min(pos, self._length)),
+            ),
+        )
+
+    def _skip_whitespace(self, pos: int) -> int:
+        data = self._data
+        length = self._length
+        while pos < length and data[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def _end_of_line(self, pos: int, skip: bool) -> int:
+        """Match an optional comment and the line end, return -1 if none."""
+        if pos > self._length:
+            return -1
+        if skip:
+            pos = self._skip_whitespace(pos)
+        if pos < self._length and self._data[pos] == "#":
+            pos = self._data.find("\n", pos)
+            if pos < 0:
+                pos = self._length
+        if pos == self._length:
+            return pos + 1  # The end of the input is only matched once!
+        if self._data[pos] == "\n":
+            return pos + 1
+        return -1
+
+    def _line_continuation(self, pos: int, skip: bool) -> int:
+        """Match line ends followed by an indented line, return -1 if none."""
+        pos = self._end_of_line(pos, skip)
+        if pos < 0:
+            return -1
+        while True:
+            next_pos = self._end_of_line(pos, skip)
+            if next_pos < 0:
+                break
+            pos = next_pos
+
+        if skip:
+            while pos < self._length and self._data[pos] in _OTHER_WHITESPACE:
+                pos += 1
+        end = pos
+        while end < self._length and self._data[end] in _WHITESPACE:
+            end += 1
+        return end if end - pos >= 4 else -1
+
+    def _identifier(self, pos: int) -> int:
+        data = self._data
+        length = self._length
+        if pos >= length or data[pos] not in _IDENTIFIER_START:
+            return -1
+        pos += 1
+        while pos < length and data[pos] in _IDENTIFIER_BODY:
+            pos += 1
+        return pos
+
+    def _quoted(self, pos: int, quote: str) -> typing.Tuple[int, str]:
+        data = self._data
+        length = self._length
+        start = pos + 1
+        pos = start
+        has_escapes = False
+        while pos < length:
+            c = data[pos]
+            if c == quote:
+                value = data[start:pos]
+                if has_escapes:
+                    value = _QUOTED_ESCAPE_PATTERN.sub(_replace_escape, value)
+                return pos + 1, value
+            if c == "\\":
+                if pos + 1 >= length or data[pos + 1] == "\n":
+                    break
+                has_escapes = True
+                pos += 2
+            elif c == "\n" or c == "\r":
+                break
+            else:
+                pos += 1
+        raise self._error(f"Unterminated string starting with {quote}.", start - 1)
+
+    def _multiline(self, pos: int) -> typing.Tuple[int, str]:
+        start = pos + len(_MULTILINE_START)
+        end = self._data.find(_MULTILINE_END, start)
+        if end < 0:
+            raise self._error(
+                f"Unterminated string starting with {_MULTILINE_START}.", pos
+            )
+        value = self._data[start:end]
+        if "\\" in value:
+            value = _MULTILINE_ESCAPE_PATTERN.sub(_replace_escape, value)
+        return end + len(_MULTILINE_END), value
+
+    def _value(self, pos: int, argument: Argument) -> int:
+        """Match a quoted or simple value, return -1 if there is none."""
+        data = self._data
+        if pos >= self._length:
+            return -1
+        c = data[pos]
+        if c == "'" or c == '"':
+            (pos, argument["quoted"]) = self._quoted(pos, c)
+            return pos
+        if data.startswith(_MULTILINE_START, pos):
+            (pos, argument["quoted"]) = self._multiline(pos)
+            return pos
+
+        start = pos
+        length = self._length
+        while pos < length and data[pos] in _SIMPLE:
+            pos += 1
+        if pos == start:
+            return -1
+        argument["simple"] = data[start:pos]
+        return pos
+
+    def _argument(self, pos: int, skip: bool, argument: Argument) -> int:
+        pos = self._value(pos, argument)
+        if pos < 0:
+            return -1
+        continued = self._line_continuation(pos, skip)
+        return pos if continued < 0 else continued
+
+    def _keyword_argument(self, pos: int) -> typing.Tuple[int, Argument]:
+        # Keyword arguments do not allow for any whitespace, not even before
+        # a line continuation:
+        end = self._identifier(pos)
+        if end < 0 or end >= self._length or self._data[end] != "=":
+            return -1, {}
+        argument = {"key": self._data[pos:end]}
+        return self._argument(end + 1, False, argument), argument
+
+    def _command(self, pos: int) -> typing.Tuple[int, typing.Optional[Command]]:
+        end = self._identifier(pos)
+        if end < 0:
+            return pos, None
+        name = self._data[pos:end]
+        line = self._line_number(pos)
+
+        continued = self._line_continuation(end, True)
+        pos = end if continued < 0 else continued
+
+        arguments: typing.List[Argument] = []
+        while True:
+            pos = self._skip_whitespace(pos)
+
+            (end, argument) = self._keyword_argument(pos)
+            if end < 0:
+                argument = {}
+                end = self._argument(pos, True, argument)
+                if end < 0:
+                    break
+            arguments.append(argument)
+            pos = end
+
+        return pos, (line, name, arguments)
+
+    def commands(self) -> typing.List[Command]:
+        result: typing.List[Command] = []
+        pos = 0
+        while pos <= self._length:
+            (pos, command) = self._command(self._skip_whitespace(pos))
+            end = self._end_of_line(pos, True)
+            if end < 0:
+                raise self._error(
+                    f'Unexpected input "{self._data[pos:pos + 10]}".', pos
+                )
+            if command:
+                result.append(command)
+            pos = end
+        return result
+
+
+def parse_commands(data: str, file_name: str) -> typing.List[Command]:
+    """Split data into commands.
+
+    Each command is returned as its line number, its name and its arguments.
+    Arguments have the same structure as the pyparsing results in parser.py."""
+    return _Tokenizer(data, file_name).commands()
@@ -6,17 +6,72 @@
 
 from __future__ import annotations
 
+from .buildcache import (
+    CacheState,
+    cache_state,
+    command_set_digest,
+    system_cache_key,
+    write_cache_key,
+)
+from .buildtimes import BuildTimes
+from .checkpoints import CheckpointManager, checkpoint_keys
 from .commandmanager import CommandManager
 from .exceptions import CleanRoomError, GenerateError
+from .execobject import ExecObject
 from .executor import Executor
-from .printer import fail, h1, success, verbose, Printer
+from .helper.namespace import private_mount_namespace
+from .metrics import record_metric
+from .printer import debug, fail, h1, info, success, verbose, Printer
 from .systemsmanager import SystemsManager
+from .tracing import span
 from .workdir import WorkDir
 
 import datetime
+import multiprocessing
+import multiprocessing.connection
 import os
 import os.path
+import time
+import sys
 import traceback
+import typing
+
+
+class _BuildJob(typing.NamedTuple):
+    system_name: str
+    target_distribution: str
+    base_system_name: typing.Optional[str]
+    exec_obj_list: typing.List[ExecObject]
+    cache_key: str
+    checkpoint_keys: typing.Dict[int, str]
+
+
+class _BuildEnvironment(typing.NamedTuple):
+    work_directory: WorkDir
+    command_manager: CommandManager
+    repository_base_directory: str
+    timestamp: str
+    checkpoint_manager: typing.Optional[CheckpointManager]
+    build_times: typing.Optional[BuildTimes]
+
+
+class PlanEntry(typing.NamedTuple):
+    system_name: str
+    base_system_name: typing.Optional[str]
+    state: str
+    estimate: typing.Optional[float]
+
+
+def _format_duration(duration: typing.Optional[float]) -> str:
+    if duration is None:
+        return "unknown"
+    minutes, seconds = divmod(int(duration + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02}m{seconds:02}s"
+    if minutes:
+        return f"{minutes}m{seconds:02}s"
+    return f"{seconds}s"
 
 
 class Generator:
@@ -66,19 +121,138 @@ class Generator:
         command_manager: CommandManager,
         repository_base_directory: str = "",
         ignore_errors: bool = False,
+        jobs: int = 1,
+        checkpoint_manager: typing.Optional[CheckpointManager] = None,
+        checkpoint_commands: typing.Iterable[str] = (),
+        rebuild: typing.Iterable[str] = (),
+        build_times: typing.Optional[BuildTimes] = None,
     ) -> None:
-        """Generate all systems in the dependency tree."""
+        """Generate all systems in the dependency tree.
 
-        exe = Executor(
-            scratch_directory=work_directory.scratch_directory,
-            systems_definition_directory=self._systems_manager.systems_definition_directory,
+        Systems listed in rebuild are removed from storage and get built
+        without using checkpoints."""
+        env = _BuildEnvironment(
+            work_directory=work_directory,
             command_manager=command_manager,
             repository_base_directory=repository_base_directory,
             timestamp=datetime.datetime.now().strftime("%Y%m%d.%H%M"),
+            checkpoint_manager=checkpoint_manager,
+            build_times=build_times,
         )
 
-        failed_systems = 0
-        total_systems = 0
+        build_jobs = self._build_jobs(
+            command_manager,
+            checkpoint_commands=checkpoint_commands if checkpoint_manager else (),
+        )
+
+        rebuild_set = set(rebuild)
+        for index, job in enumerate(build_jobs):
+            if job.system_name in rebuild_set:
+                verbose(f'Removing "{job.system_name}" from storage for rebuild.')
+                work_directory.clear_system_storage(job.system_name)
+                build_jobs[index] = job._replace(checkpoint_keys={})
+
+        if jobs > 1:
+            failed_systems = self._generate_parallel(
+                build_jobs, env, ignore_errors=ignore_errors, jobs=jobs
+            )
+        else:
+            failed_systems = self._generate_serial(
+                build_jobs, env, ignore_errors=ignore_errors
+            )
+
+        work_directory.reclaim()
+
+        if failed_systems == 0:
+            success("All systems generated successfully.")
+        else:
+            fail(
+                f"{failed_systems} of {len(build_jobs)} systems failed during generation phase."
+            )
+
+    def plan(
+        self,
+        *,
+        command_manager: CommandManager,
+        storage_directory: str,
+        build_times: typing.Optional[BuildTimes] = None,
+        rebuild: typing.Iterable[str] = (),
+    ) -> typing.List[PlanEntry]:
+        """Decide which systems need to get built without building anything."""
+        rebuild_set = set(rebuild)
+        result: typing.List[PlanEntry] = []
+
+        for job in self._build_jobs(command_manager):
+            if job.system_name in rebuild_set:
+                state = "rebuild"
+            elif not storage_directory:
+                state = CacheState.MISSING.name.lower()
+            else:
+                state = cache_state(
+                    storage_directory, job.system_name, job.cache_key
+                ).name.lower()
+
+            estimate: typing.Optional[float] = 0.0
+            if state != "cached":
+                estimate = (
+                    build_times.estimate(job.system_name) if build_times else None
+                )
+
+            result.append(
+                PlanEntry(job.system_name, job.base_system_name, state, estimate)
+            )
+
+        return result
+
+    def print_plan(self, plan: typing.List[PlanEntry]) -> None:
+        """Print a build plan in execution order with estimated durations."""
+        depth: typing.Dict[str, int] = {}
+        finish: typing.Dict[str, float] = {}
+        critical: typing.Dict[str, typing.List[str]] = {}
+        total = 0.0
+        unknown = 0
+
+        print("Build plan:")
+        for index, entry in enumerate(plan):
+            base = entry.base_system_name
+            depth[entry.system_name] = depth[base] + 1 if base else 0
+            estimate = entry.estimate or 0.0
+            if entry.estimate is None:
+                unknown += 1
+            total += estimate
+
+            finish[entry.system_name] = (finish[base] if base else 0.0) + estimate
+            critical[entry.system_name] = (critical[base] if base else []) + (
+                [entry.system_name] if entry.state != "cached" else []
+            )
+
+            indent = "  " * depth[entry.system_name]
+            print(
+                f"  {index + 1:3}. {indent}{entry.system_name:<{40 - len(indent)}} "
+                f"{entry.state:<8} {_format_duration(entry.estimate):>10}"
+            )
+
+        to_build = len([e for e in plan if e.state != "cached"])
+        print(f"\n{to_build} of {len(plan)} systems need to be built.")
+        print(f"Estimated duration (serial): {_format_duration(total)}")
+        if finish:
+            last = max(finish.keys(), key=lambda s: finish[s])
+            print(
+                f"Estimated duration (critical path): {_format_duration(finish[last])}"
+                + (f" via {' -> '.join(critical[last])}" if critical[last] else "")
+            )
+        if unknown:
+            print(f"{unknown} systems were never built before and are not estimated.")
+
+    def _build_jobs(
+        self,
+        command_manager: CommandManager,
+        *,
+        checkpoint_commands: typing.Iterable[str] = (),
+    ) -> typing.List[_BuildJob]:
+        command_digest = command_set_digest(command_manager)
+        cache_keys: typing.Dict[str, str] = {}
+        build_jobs: typing.List[_BuildJob] = []
 
         for (
             system_name,
@@ -87,30 +261,224 @@ class Generator:
             exec_obj_list,
             _,
         ) in self._systems_manager.walk_systems_forest():
-            total_systems += 1
+            base_cache_key = cache_keys[base_system_name] if base_system_name else ""
+
+            def key_function(
+                exec_objs: typing.List[ExecObject],
+                system_name: str = system_name,
+                base_cache_key: str = base_cache_key,
+            ) -> str:
+                return system_cache_key(
+                    system_name=system_name,
+                    exec_obj_list=exec_objs,
+                    systems_definition_directory=self._systems_manager.systems_definition_directory,
+                    command_digest=command_digest,
+                    base_cache_key=base_cache_key,
+                )
+
+            cache_key = key_function(exec_obj_list)
+            cache_keys[system_name] = cache_key
+            build_jobs.append(
+                _BuildJob(
+                    system_name,
+                    target_distribution,
+                    base_system_name,
+                    exec_obj_list,
+                    cache_key,
+                    checkpoint_keys(exec_obj_list, checkpoint_commands, key_function),
+                )
+            )
+
+        return build_jobs
 
-            h1(f'Generate "{system_name}" ({target_distribution})')
+    def _is_cached(self, job: _BuildJob, work_directory: WorkDir) -> bool:
+        """Check the storage for job, removing outdated versions of the system."""
+        state = cache_state(
+            work_directory.storage_directory, job.system_name, job.cache_key
+        )
+        if state == CacheState.STALE:
+            verbose(f'"{job.system_name}" in storage is outdated, removing it.')
+            work_directory.clear_system_storage(job.system_name)
+        cached = state == CacheState.CACHED
+        record_metric(job.system_name, "cache_hits" if cached else "cache_misses", 1)
+        return cached
+
+    def _build(self, job: _BuildJob, env: _BuildEnvironment, slot: int) -> None:
+        """Build one system in the scratch directory of slot.
+
+        The system is built in a mount namespace of its own, so everything
+        mounted during the build goes away with it."""
+        with private_mount_namespace():
+            env.work_directory.clear_scratch_directory(slot)
+
+            exe = Executor(
+                scratch_directory=env.work_directory.worker_scratch_directory(slot),
+                systems_definition_directory=self._systems_manager.systems_definition_directory,
+                command_manager=env.command_manager,
+                repository_base_directory=env.repository_base_directory,
+                timestamp=env.timestamp,
+                checkpoint_manager=env.checkpoint_manager,
+            )
+            with span(
+                job.system_name, "system", base_system=job.base_system_name, slot=slot
+            ):
+                exe.run(
+                    job.system_name,
+                    job.base_system_name,
+                    job.exec_obj_list,
+                    storage_directory=env.work_directory.storage_directory,
+                    checkpoint_keys=job.checkpoint_keys,
+                )
+        write_cache_key(
+            env.work_directory.storage_directory, job.system_name, job.cache_key
+        )
+
+    def _record_build_time(
+        self, job: _BuildJob, env: _BuildEnvironment, start_time: float
+    ) -> None:
+        duration = time.monotonic() - start_time
+        record_metric(job.system_name, "build_duration_seconds", duration)
+        if env.build_times:
+            env.build_times.record(job.system_name, duration)
+
+    def _generate_serial(
+        self,
+        build_jobs: typing.List[_BuildJob],
+        env: _BuildEnvironment,
+        *,
+        ignore_errors: bool,
+    ) -> int:
+        failed_systems = 0
+
+        for job in build_jobs:
+            h1(f'Generate "{job.system_name}" ({job.target_distribution})')
             try:
-                if os.path.isdir(
-                    os.path.join(work_directory.storage_directory, system_name)
-                ):
+                if self._is_cached(job, env.work_directory):
                     verbose("Already in storage, skipping.")
                 else:
-                    work_directory.clear_scratch_directory()
-
-                    exe.run(
-                        system_name,
-                        base_system_name,
-                        exec_obj_list,
-                        storage_directory=work_directory.storage_directory,
-                    )
+                    start_time = time.monotonic()
+                    self._build(job, env, 0)
+                    self._record_build_time(job, env, start_time)
             except Exception as e:
-                self._report_error(system_name, e, ignore_errors=ignore_errors)
+                record_metric(job.system_name, "failures", 1)
+                self._report_error(job.system_name, e, ignore_errors=ignore_errors)
                 failed_systems += 1
 
-        if failed_systems == 0:
-            success("All systems generated successfully.")
-        else:
-            fail(
-                f"{failed_systems} of {total_systems} systems failed during generation phase."
+        return failed_systems
+
+    def _run_worker(self, job: _BuildJob, slot: int, env: _BuildEnvironment) -> None:
+        """Build one system in a worker process, using the scratch of its slot."""
+        h1(f'Generate "{job.system_name}" ({job.target_distribution}) [slot {slot}]')
+        exit_code = 1
+        try:
+            self._build(job, env, slot)
+            exit_code = 0
+        except Exception as e:
+            self._report_error(job.system_name, e, ignore_errors=True)
+        finally:
+            # os._exit skips the flushing of stdio done on a normal exit:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    def _generate_parallel(
+        self,
+        build_jobs: typing.List[_BuildJob],
+        env: _BuildEnvironment,
+        *,
+        ignore_errors: bool,
+        jobs: int,
+    ) -> int:
+        """Build every system whose base is in storage concurrently.
+
+        Each system is built in a forked worker process with a scratch
+        directory of its own, so the process-wide state (working directory,
+        mounts, printer) of one build can not interfere with another."""
+        context = multiprocessing.get_context("fork")
+
+        pending = list(build_jobs)
+        stored: typing.Set[str] = set()
+        failed: typing.Set[str] = set()
+        uncached: typing.Set[str] = set()
+        free_slots = list(range(jobs))
+        running: typing.Dict[
+            typing.Any, typing.Tuple[_BuildJob, int, typing.Any, float]
+        ] = {}
+
+        while pending or running:
+            if not failed or ignore_errors:
+                for job in list(pending):
+                    if job.base_system_name in failed:
+                        fail(
+                            f'Skipping "{job.system_name}": Base system "{job.base_system_name}" failed.',
+                            force_exit=False,
+                        )
+                        pending.remove(job)
+                        failed.add(job.system_name)
+                        record_metric(job.system_name, "failures", 1)
+                        continue
+
+                    if job.base_system_name and job.base_system_name not in stored:
+                        continue  # base system is not ready yet
+
+                    # Jobs waiting for a slot are seen again on every pass:
+                    if job.system_name not in uncached:
+                        if self._is_cached(job, env.work_directory):
+                            verbose(
+                                f'"{job.system_name}" is already in storage, skipping.'
+                            )
+                            pending.remove(job)
+                            stored.add(job.system_name)
+                            continue
+                        uncached.add(job.system_name)
+
+                    if not free_slots:
+                        break
+
+                    slot = free_slots.pop(0)
+                    pending.remove(job)
+                    process = context.Process(
+                        target=self._run_worker,
+                        args=(job, slot, env),
+                        name=f"clrm-{job.system_name}",
+                    )
+                    process.start()
+                    info(f'Started "{job.system_name}" in slot {slot}.')
+                    running[process.sentinel] = (job, slot, process, time.monotonic())
+            elif pending:
+                debug(f"Not scheduling {len(pending)} systems after failure.")
+                pending = []
+
+            if not running:
+                if pending:
+                    # Bases of all pending systems are neither stored nor running:
+                    for job in pending:
+                        fail(
+                            f'Could not schedule "{job.system_name}".', force_exit=False
+                        )
+                        failed.add(job.system_name)
+                        record_metric(job.system_name, "failures", 1)
+                    pending = []
+                break
+
+            for sentinel in multiprocessing.connection.wait(list(running.keys())):
+                (job, slot, process, start_time) = running.pop(sentinel)
+                process.join()
+                free_slots.append(slot)
+                free_slots.sort()
+                # The worker left its scratch directory in the trash:
+                env.work_directory.reclaim()
+
+                if process.exitcode == 0:
+                    stored.add(job.system_name)
+                    self._record_build_time(job, env, start_time)
+                else:
+                    failed.add(job.system_name)
+                    record_metric(job.system_name, "failures", 1)
+
+        if failed and not ignore_errors:
+            raise GenerateError(
+                "Generation failed: {}.".format(", ".join(sorted(failed)))
             )
+
+        return len(failed)
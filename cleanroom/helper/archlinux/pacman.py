@@ -6,6 +6,7 @@
 
 from ...printer import debug, info
 from ...systemcontext import SystemContext
+from ..cgroup import create_process_group
 from ..run import run
 from ..mount import umount_all, mount
 
@@ -161,6 +162,7 @@ def _mount_directories_if_needed(root_dir: str, *, pacman_in_filesystem: bool =
 
 
 def _kill_processes_in(root_dir: str):
+    """Kill processes using files in root_dir, when cgroups are not available."""
     result = run("/usr/bin/lsof")
     result.check_returncode()
 
@@ -307,20 +309,28 @@ def pacman(
     _mount_directories_if_needed(
         system_context.fs_directory, pacman_in_filesystem=previous_pacstate
     )
-    _run_pacman(
-        system_context,
-        *action,
-        *packages,
-        pacman_command=pacman_command,
-        pacman_in_filesystem=previous_pacstate,
-    )
-
-    # Kill processes that pacman might have started (incl. gpg-agents)
-    _kill_processes_in(system_context.scratch_directory)
+    process_group = create_process_group("pacman")
+    try:
+        _run_pacman(
+            system_context,
+            *action,
+            *packages,
+            pacman_command=pacman_command,
+            pacman_in_filesystem=previous_pacstate,
+            process_group=process_group,
+        )
+    finally:
+        # Kill processes that pacman might have started (incl. gpg-agents)
+        if process_group:
+            process_group.close()
+        else:
+            _kill_processes_in(system_context.scratch_directory)
 
-    _umount_directories_if_needed(
-        system_context.fs_directory, pacman_in_filesystem=previous_pacstate
-    )
+        # /run and /sys are bind mounts of the host's: Never leave them up
+        # for the commands after pacman, not even in a private namespace.
+        _umount_directories_if_needed(
+            system_context.fs_directory, pacman_in_filesystem=previous_pacstate
+        )
 
     var_lib_pacman = system_context.file_name("/var/lib/pacman")
     if os.path.isdir(var_lib_pacman):
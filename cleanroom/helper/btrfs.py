@@ -1,16 +1,32 @@
 # -*- coding: utf-8 -*-
 """Helpers for btrfs.
 
+BtrfsHelper runs the btrfs binary for every operation. NativeBtrfsHelper
+does the common operations in-process via ioctls and statfs and falls
+back to the binary where that is not possible.
+
 @author: Tobias Hunger <tobias.hunger@gmail.com>
 """
 
 from ..printer import trace
 from .run import run
 
+import ctypes
+import errno
+import fcntl
 import os
+import struct
 import typing
 
 
+_BTRFS_IOCTL_MAGIC = 0x94
+_BTRFS_SUPER_MAGIC = 0x9123683E
+_BTRFS_FIRST_FREE_OBJECTID = 256  # inode number of the root of a subvolume
+_BTRFS_SUBVOL_RDONLY = 1 << 1
+
+_DELETE_BATCH_SIZE = 256  # subvolumes deleted by one btrfs process
+
+
 class BtrfsHelper:
     def __init__(self, btrfs_command: str):
         assert btrfs_command
@@ -61,15 +77,55 @@ class BtrfsHelper:
             == 0
         )
 
+    def delete_subvolumes(self, directories: typing.Sequence[str]) -> bool:
+        """Delete subvolumes, using one btrfs process for many of them.
+
+        Subvolumes inside of other subvolumes must be listed first."""
+        success = True
+        for start in range(0, len(directories), _DELETE_BATCH_SIZE):
+            batch = directories[start : start + _DELETE_BATCH_SIZE]
+            trace(f"BTRFS: Delete {len(batch)} subvolumes.")
+            success = (
+                run(
+                    self._command,
+                    "subvolume",
+                    "delete",
+                    *batch,
+                    returncode=None,
+                    trace_output=None,
+                ).returncode
+                == 0
+                and success
+            )
+        return success
+
+    def find_subvolumes(self, directory: str) -> typing.List[str]:
+        """Find all subvolumes in directory, including directory itself.
+
+        The tree is scanned once without running any process: The root
+        directory of a btrfs subvolume always has inode number 256. Inner
+        subvolumes are listed before the subvolumes containing them."""
+        if not self.is_btrfs_filesystem(directory):
+            return []
+
+        result: typing.List[str] = []
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            if os.lstat(current).st_ino == _BTRFS_FIRST_FREE_OBJECTID:
+                result.append(current)
+            with os.scandir(current) as it:
+                pending += [e.path for e in it if e.is_dir(follow_symlinks=False)]
+
+        # Every directory was listed before the directories inside of it:
+        result.reverse()
+        return result
+
     def delete_subvolume_recursive(self, directory: str) -> None:
         """Delete all subvolumes in a subvolume or directory."""
-        for f in os.listdir(directory):
-            child = os.path.join(directory, f)
-            if os.path.isdir(child):
-                self.delete_subvolume_recursive(child)
-
-        if self.is_subvolume(directory):
-            self.delete_subvolume(directory)
+        subvolumes = self.find_subvolumes(directory)
+        if subvolumes:
+            self.delete_subvolumes(subvolumes)
 
     def is_subvolume(self, directory: str) -> bool:
         """Check whether a subdirectory is a subvolume or snapshot."""
@@ -101,3 +157,189 @@ class BtrfsHelper:
             ).returncode
             == 0
         )
+
+
+def _ioc(direction: int, number: int, size: int) -> int:
+    """Calculate an ioctl request number like the _IOC macro of the kernel."""
+    return (direction << 30) | (size << 16) | (_BTRFS_IOCTL_MAGIC << 8) | number
+
+
+# struct btrfs_ioctl_vol_args: __s64 fd; char name[4088];
+_VOL_ARGS = struct.Struct("=q4088s")
+# struct btrfs_ioctl_vol_args_v2: __s64 fd; __u64 transid; __u64 flags;
+#                                 __u64 unused[4]; char name[4040];
+_VOL_ARGS_V2 = struct.Struct("=qQQ4Q4040s")
+
+_IOC_WRITE = 1
+BTRFS_IOC_SUBVOL_CREATE = _ioc(_IOC_WRITE, 14, _VOL_ARGS.size)
+BTRFS_IOC_SNAP_DESTROY = _ioc(_IOC_WRITE, 15, _VOL_ARGS.size)
+BTRFS_IOC_SNAP_CREATE_V2 = _ioc(_IOC_WRITE, 23, _VOL_ARGS_V2.size)
+
+
+def _vol_args(name: str, *, fd: int = 0) -> bytes:
+    encoded = os.fsencode(name)
+    if len(encoded) >= 4088:
+        raise OSError(errno.ENAMETOOLONG, "Subvolume name too long", name)
+    return _VOL_ARGS.pack(fd, encoded)
+
+
+def _vol_args_v2(name: str, *, fd: int, flags: int = 0) -> bytes:
+    encoded = os.fsencode(name)
+    if len(encoded) >= 4040:
+        raise OSError(errno.ENAMETOOLONG, "Subvolume name too long", name)
+    return _VOL_ARGS_V2.pack(fd, 0, flags, 0, 0, 0, 0, encoded)
+
+
+def _open_directory(directory: str) -> int:
+    return os.open(directory, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+
+
+def _parent_ioctl(directory: str, request: int, args: bytes) -> None:
+    """Run an ioctl on the parent of directory."""
+    parent = os.path.dirname(os.path.abspath(directory))
+    parent_fd = _open_directory(parent)
+    try:
+        fcntl.ioctl(parent_fd, request, args)
+    finally:
+        os.close(parent_fd)
+
+
+_libc: typing.Any = None
+
+
+def _filesystem_type(directory: str) -> typing.Optional[int]:
+    """Return the f_type of the filesystem holding directory.
+
+    Returns None if statfs is not available."""
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(None, use_errno=True)
+            _libc.statfs.argtypes = (ctypes.c_char_p, ctypes.c_void_p)
+        except (OSError, AttributeError):
+            _libc = False
+    if not _libc:
+        return None
+
+    # f_type is the first member of struct statfs, 256 bytes are more than
+    # the whole struct needs on all architectures:
+    buffer = ctypes.create_string_buffer(256)
+    if _libc.statfs(os.fsencode(directory), buffer) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), directory)
+    return ctypes.c_ulong.from_buffer(buffer).value & 0xFFFFFFFF
+
+
+class NativeBtrfsHelper(BtrfsHelper):
+    """Talk to btrfs via ioctls instead of running the btrfs binary.
+
+    Falls back to the btrfs binary whenever an ioctl fails, e.g. on kernels
+    or architectures where the ioctl is not available, so that the error
+    reporting of the binary is kept."""
+
+    def create_subvolume(self, directory: str) -> None:
+        trace(f"BTRFS: Create subvolume {directory} (ioctl).")
+        try:
+            _parent_ioctl(
+                directory,
+                BTRFS_IOC_SUBVOL_CREATE,
+                _vol_args(os.path.basename(directory)),
+            )
+        except OSError as e:
+            trace(f"BTRFS: ioctl failed ({e}), using the btrfs binary.")
+            super().create_subvolume(directory)
+
+    def set_property(self, object: str, *, name: str, value: str) -> None:
+        if name != "compression":
+            super().set_property(object, name=name, value=value)
+            return
+
+        trace(f"BTRFS: Set property {name} to {value} on {object} (xattr).")
+        try:
+            os.setxattr(object, "btrfs.compression", os.fsencode(value))
+        except OSError as e:
+            trace(f"BTRFS: setxattr failed ({e}), using the btrfs binary.")
+            super().set_property(object, name=name, value=value)
+
+    def create_snapshot(
+        self, source: str, destination: str, *, read_only: bool = False
+    ) -> None:
+        trace(
+            f'BTRFS: Create snapshot of {source} into {destination} ({"ro" if read_only else "rw"}, ioctl).'
+        )
+        try:
+            source_fd = _open_directory(source)
+            try:
+                _parent_ioctl(
+                    destination,
+                    BTRFS_IOC_SNAP_CREATE_V2,
+                    _vol_args_v2(
+                        os.path.basename(destination),
+                        fd=source_fd,
+                        flags=_BTRFS_SUBVOL_RDONLY if read_only else 0,
+                    ),
+                )
+            finally:
+                os.close(source_fd)
+        except OSError as e:
+            trace(f"BTRFS: ioctl failed ({e}), using the btrfs binary.")
+            super().create_snapshot(source, destination, read_only=read_only)
+
+    def delete_subvolume(self, directory: str) -> bool:
+        if not self.is_subvolume(directory):
+            return False
+
+        trace(f"BTRFS: Delete subvolume {directory} (ioctl).")
+        try:
+            _parent_ioctl(
+                directory,
+                BTRFS_IOC_SNAP_DESTROY,
+                _vol_args(os.path.basename(directory)),
+            )
+        except OSError as e:
+            trace(f"BTRFS: ioctl failed ({e}), using the btrfs binary.")
+            return super().delete_subvolume(directory)
+        return True
+
+    def delete_subvolumes(self, directories: typing.Sequence[str]) -> bool:
+        trace(f"BTRFS: Delete {len(directories)} subvolumes (ioctl).")
+        failed: typing.List[str] = []
+        for directory in directories:
+            try:
+                _parent_ioctl(
+                    directory,
+                    BTRFS_IOC_SNAP_DESTROY,
+                    _vol_args(os.path.basename(directory)),
+                )
+            except OSError as e:
+                trace(f"BTRFS: ioctl failed on {directory} ({e}).")
+                failed.append(directory)
+        if failed:
+            trace("BTRFS: Using the btrfs binary for failed deletions.")
+            return super().delete_subvolumes(failed)
+        return True
+
+    def is_subvolume(self, directory: str) -> bool:
+        if not os.path.isdir(directory):
+            return False
+        try:
+            fs_type = _filesystem_type(directory)
+        except OSError:
+            return False
+        if fs_type is None:
+            return super().is_subvolume(directory)
+        return (
+            fs_type == _BTRFS_SUPER_MAGIC
+            and os.stat(directory).st_ino == _BTRFS_FIRST_FREE_OBJECTID
+        )
+
+    def is_btrfs_filesystem(self, directory: str) -> bool:
+        if not os.path.isdir(directory):
+            return False
+        try:
+            fs_type = _filesystem_type(directory)
+        except OSError:
+            return False
+        if fs_type is None:
+            return super().is_btrfs_filesystem(directory)
+        return fs_type == _BTRFS_SUPER_MAGIC
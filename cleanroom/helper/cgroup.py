@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Track and kill processes started by cleanroom via cgroups (v2).
+
+Processes are started in a cgroup created below the cgroup of cleanroom
+itself. Everything they leave running (e.g. gpg-agents started by
+pacman) stays in that cgroup and can be killed without looking at any
+other process on the host.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from ..printer import debug, trace
+from .mounttable import mount_table
+
+import itertools
+import os
+import signal
+import time
+import typing
+
+
+_counter = itertools.count()
+
+
+def _cgroup2_root() -> str:
+    """Return where the cgroup v2 hierarchy is mounted or ''.
+
+    That is /sys/fs/cgroup usually and /sys/fs/cgroup/unified on systems
+    using the hybrid layout."""
+    for entry in mount_table().entries():
+        if entry.fs_type == "cgroup2":
+            return entry.mount_point
+    return ""
+
+
+def _own_cgroup() -> str:
+    """Return the cgroup v2 directory the current process is in or ''."""
+    root = _cgroup2_root()
+    if not root:
+        return ""
+    with open("/proc/self/cgroup", "r") as f:
+        for line in f:
+            (hierarchy, _, path) = line.rstrip("\n").split(":", 2)
+            if hierarchy == "0":
+                directory = os.path.normpath(root + path)
+                if os.path.isfile(os.path.join(directory, "cgroup.procs")):
+                    return directory
+    return ""
+
+
+def _read(directory: str, file_name: str) -> str:
+    with open(os.path.join(directory, file_name), "r") as f:
+        return f.read()
+
+
+def _write(directory: str, file_name: str, contents: str) -> None:
+    with open(os.path.join(directory, file_name), "w") as f:
+        f.write(contents)
+
+
+class ProcessGroup:
+    """A cgroup to start processes in and to kill them all at once.
+
+    Use create_process_group to get one."""
+
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def __enter__(self) -> "ProcessGroup":
+        return self
+
+    def __exit__(
+        self, exc_type: typing.Any, exc_val: typing.Any, exc_tb: typing.Any
+    ) -> None:
+        self.close()
+
+    def pids(self) -> typing.List[int]:
+        """Return the processes in the group."""
+        return [int(p) for p in _read(self._directory, "cgroup.procs").split()]
+
+    def is_populated(self) -> bool:
+        for line in _read(self._directory, "cgroup.events").split("\n"):
+            if line.startswith("populated "):
+                return line.split()[1] != "0"
+        return bool(self.pids())
+
+    def kill(self, *, timeout: float = 10.0) -> None:
+        """Kill all processes in the group and wait for them to go away."""
+        if not self.is_populated():
+            return
+
+        trace(f"Killing processes in {self._directory}.")
+        if os.path.exists(os.path.join(self._directory, "cgroup.kill")):
+            _write(self._directory, "cgroup.kill", "1")
+        else:
+            # Older kernels: Freeze first so nothing can fork in between.
+            _write(self._directory, "cgroup.freeze", "1")
+            for pid in self.pids():
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            _write(self._directory, "cgroup.freeze", "0")
+
+        deadline = time.monotonic() + timeout
+        while self.is_populated():
+            if time.monotonic() > deadline:
+                raise OSError(f"Processes in {self._directory} did not go away.")
+            time.sleep(0.01)
+
+    def close(self) -> None:
+        """Kill all processes in the group and remove the cgroup."""
+        if not os.path.isdir(self._directory):
+            return
+        self.kill()
+        os.rmdir(self._directory)
+
+
+def create_process_group(name: str) -> typing.Optional[ProcessGroup]:
+    """Create a cgroup below the one of the current process.
+
+    Returns None if that is not possible, e.g. when there is no cgroup v2
+    hierarchy or it is not delegated to us."""
+    parent = _own_cgroup()
+    if not parent:
+        debug("No cgroup v2 hierarchy found.")
+        return None
+
+    directory = os.path.join(parent, f"clrm-{name}-{os.getpid()}-{next(_counter)}")
+    try:
+        os.mkdir(directory)
+    except OSError as e:
+        debug(f"Can not create cgroup {directory}: {e}.")
+        return None
+    return ProcessGroup(directory)
+
+
+def in_process_group(group: ProcessGroup, *args: str) -> typing.Tuple[str, ...]:
+    """Return the command line that runs args inside of group."""
+    return (
+        "/bin/sh",
+        "-c",
+        'echo $$ > "$0/cgroup.procs" && exec "$@"',
+        group.directory,
+        *args,
+    )
@@ -5,7 +5,7 @@
 """
 
 from ..exceptions import GenerateError
-from ..printer import debug, info, trace, verbose
+from ..printer import debug, enabled, info, trace, verbose
 from ..systemcontext import SystemContext
 from .group import GroupHelper
 from .user import UserHelper
@@ -51,7 +51,8 @@ def file_name(system_context: typing.Optional[SystemContext], f: str) -> str:
         if full_path != root_path and not full_path.startswith(root_path + "/"):
             raise GenerateError(f'File path "{full_path}" is outside of "{root_path}"')
 
-    trace(f'Mapped file path "{f}" to "{full_path}".')
+    if enabled(4):
+        trace(f'Mapped file path "{f}" to "{full_path}".')
 
     return full_path
 
@@ -74,10 +75,13 @@ def expand_files(
 
     to_iterate = map(func, files)
 
+    # Only report on matches when it gets printed: There may be a lot of them.
+    report_matches = enabled(3)
     for pattern in to_iterate:
         debug(f"expand_files: Matching pattern: {pattern}.")
         for match in glob.iglob(pattern, recursive=recursive):
-            debug(f"expand_files: --- match {match}.")
+            if report_matches:
+                debug(f"expand_files: --- match {match}.")
             yield match
 
 
@@ -183,8 +187,10 @@ def _chmod(mode: int, *files: str) -> None:
     """For internal use only."""
     if mode is None:
         return
+    tracing = enabled(4)
     for f in files:
-        trace(f'Chmod of "{f}" to {mode}.')
+        if tracing:
+            trace(f'Chmod of "{f}" to {mode}.')
         if os.path.islink(f):
             debug(f" -> {f} is a symlink, skipping for chmod.")
             continue
@@ -203,8 +209,10 @@ def _chown(uid: int, gid: int, *files: str) -> None:
     assert uid is not str
     assert gid is not str
 
+    tracing = enabled(4)
     for f in files:
-        trace(f'Chown of "{f}" to {uid}:{gid}.')
+        if tracing:
+            trace(f'Chown of "{f}" to {uid}:{gid}.')
         os.chown(f, uid, gid, follow_symlinks=False)
 
 
@@ -434,8 +442,10 @@ def remove(
 ) -> None:
     """Delete a file inside of a system."""
     sc = None if outside else system_context
+    tracing = enabled(4)
     for file in expand_files(sc, *files, recursive=recursive):
-        trace(f'Removing "{file}".')
+        if tracing:
+            trace(f'Removing "{file}".')
 
         if not os.path.exists(file):
             if force:
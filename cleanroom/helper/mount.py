@@ -4,10 +4,9 @@
 @author: Tobias Hunger <tobias.hunger@gmail.com>
 """
 
-from ..printer import none
+from .mounttable import mount_table
 from .run import run
 
-import re
 import os
 import stat
 import typing
@@ -33,22 +32,7 @@ def mount_points(
 ) -> typing.List[str]:
     """Return a list of mount points at or below the given directory."""
     assert not directory.endswith("/")
-    directory = _map_into_chroot(directory, chroot)
-
-    pattern = re.compile("^(.*) on (.*) type (.*)$")
-    result = run("/usr/bin/mount", trace_output=none)
-    sub_mounts: typing.List[str] = []
-    for line in result.stdout.split("\n"):
-        if not line:
-            continue
-        match = re.match(pattern, line)
-        assert match
-        mount_point = match.group(2)
-
-        if mount_point == directory or mount_point.startswith(directory + "/"):
-            sub_mounts.append(mount_point)
-
-    return sorted(sub_mounts, key=len, reverse=True)
+    return mount_table().mounts_below(_map_into_chroot(directory, chroot))
 
 
 def umount(directory: str, chroot: typing.Optional[str] = None) -> None:
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""The mount table of the current process.
+
+The table is read from /proc/thread-self/mountinfo and kept in memory. The
+kernel signals changes to the mount table through poll, so the file is only
+read again after something got mounted or unmounted.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import os
+import re
+import select
+import threading
+import typing
+
+
+# Threads can be in mount namespaces of their own, /proc/self/mountinfo
+# shows the one of the main thread:
+MOUNTINFO = "/proc/thread-self/mountinfo"
+
+_ESCAPE = re.compile(rb"\\([0-7]{3})")
+
+
+class MountEntry(typing.NamedTuple):
+    mount_id: int
+    parent_id: int
+    root: str
+    mount_point: str
+    fs_type: str
+    source: str
+    options: str
+
+
+def _unescape(field: bytes) -> str:
+    """Undo the octal escaping of spaces, tabs, newlines and backslashes."""
+    return os.fsdecode(_ESCAPE.sub(lambda m: bytes((int(m.group(1), 8),)), field))
+
+
+def parse_mountinfo(data: bytes) -> typing.List[MountEntry]:
+    """Parse the contents of a mountinfo file."""
+    result: typing.List[MountEntry] = []
+    for line in data.split(b"\n"):
+        if not line:
+            continue
+        fields = line.split(b" ")
+        # Optional fields are terminated by a single "-":
+        separator = fields.index(b"-", 6)
+        result.append(
+            MountEntry(
+                mount_id=int(fields[0]),
+                parent_id=int(fields[1]),
+                root=_unescape(fields[3]),
+                mount_point=_unescape(fields[4]),
+                fs_type=_unescape(fields[separator + 1]),
+                source=_unescape(fields[separator + 2]),
+                options=_unescape(fields[5]),
+            )
+        )
+    return result
+
+
+class _Node:
+    __slots__ = ("children", "mounts")
+
+    def __init__(self) -> None:
+        self.children: typing.Dict[str, "_Node"] = {}
+        self.mounts = 0  # more than one if mounts are stacked
+
+
+def _components(directory: str) -> typing.List[str]:
+    return [c for c in os.path.normpath(directory).split("/") if c]
+
+
+class MountTable:
+    """Answer questions about the mount table of the current process."""
+
+    def __init__(self, mountinfo: str = MOUNTINFO) -> None:
+        self._mountinfo = mountinfo
+        self._lock = threading.Lock()
+        self._pid = 0
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._poller: typing.Any = None
+        self._entries: typing.List[MountEntry] = []
+        self._tree = _Node()
+
+    def invalidate(self) -> None:
+        """Read the mount table again on next use.
+
+        Needed after switching into another mount namespace."""
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        if self._file:
+            self._file.close()
+        self._file = None
+        self._poller = None
+
+    def _update(self) -> None:
+        # The poll state is per open file: Forked processes must not share
+        # it, they would consume each other's change notifications.
+        if self._file and self._pid == os.getpid():
+            if not self._poller.poll(0):
+                return  # unchanged
+        else:
+            self._close()
+            self._pid = os.getpid()
+            self._file = open(self._mountinfo, "rb", buffering=0)
+            self._poller = select.poll()
+            self._poller.register(self._file, select.POLLPRI | select.POLLERR)
+            self._poller.poll(0)  # Only changes from now on are of interest
+
+        self._file.seek(0)
+        chunks: typing.List[bytes] = []
+        while True:
+            chunk = self._file.read(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self._entries = parse_mountinfo(b"".join(chunks))
+
+        self._tree = _Node()
+        for entry in self._entries:
+            node = self._tree
+            for component in _components(entry.mount_point):
+                node = node.children.setdefault(component, _Node())
+            node.mounts += 1
+
+    def entries(self) -> typing.List[MountEntry]:
+        """Return all mounts in the order the kernel lists them."""
+        with self._lock:
+            self._update()
+            return list(self._entries)
+
+    def mounts_below(self, directory: str) -> typing.List[str]:
+        """Return the mount points at or below directory, deepest first.
+
+        Stacked mounts are listed once per mount."""
+        assert os.path.isabs(directory)
+        with self._lock:
+            self._update()
+            node: typing.Optional[_Node] = self._tree
+            for component in _components(directory):
+                node = node.children.get(component) if node else None
+            if not node:
+                return []
+
+            result: typing.List[str] = []
+            pending = [(os.path.normpath(directory), node)]
+            while pending:
+                path, node = pending.pop()
+                result += [path] * node.mounts
+                pending += [
+                    (os.path.join(path, name), child)
+                    for name, child in node.children.items()
+                ]
+        return sorted(result, key=len, reverse=True)
+
+
+_tables = threading.local()
+
+
+def mount_table() -> MountTable:
+    """Return the mount table of the current thread.
+
+    Every thread has a table of its own, so no table is shared between
+    mount namespaces and a forked child never inherits a table another
+    thread was using."""
+    table = getattr(_tables, "table", None)
+    if table is None:
+        table = MountTable()
+        _tables.table = table
+    return table
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Build systems in mount namespaces of their own.
+
+Everything mounted while building a system is only visible to the build
+and goes away with the namespace, even when the build crashes.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from ..printer import debug, warn
+from .mounttable import mount_table
+
+import contextlib
+import ctypes
+import os
+import threading
+import typing
+
+
+CLONE_NEWNS = 0x00020000
+MS_REC = 0x4000
+MS_PRIVATE = 1 << 18
+
+_libc: typing.Any = None
+_state = threading.local()
+
+
+def _c_library() -> typing.Any:
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    return _libc
+
+
+def _check(result: int, what: str) -> None:
+    if result != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, f"{what}: {os.strerror(error)}")
+
+
+def in_private_mount_namespace() -> bool:
+    """Check whether a private_mount_namespace is active in this thread."""
+    return getattr(_state, "depth", 0) > 0
+
+
+@contextlib.contextmanager
+def private_mount_namespace() -> typing.Iterator[bool]:
+    """Run the body in a new mount namespace and return to the old one after.
+
+    Mounts do not propagate out of the new namespace. Yields False if no
+    namespace could be created, the body runs in the current namespace
+    then. Only the calling thread (and the processes it starts) enters
+    the new namespace, other threads stay where they are."""
+    cwd = os.getcwd()
+    original = os.open("/proc/thread-self/ns/mnt", os.O_RDONLY | os.O_CLOEXEC)
+    unshared = False
+    try:
+        libc = _c_library()
+        _check(libc.unshare(CLONE_NEWNS), "unshare")
+        unshared = True
+        _check(
+            libc.mount(b"none", b"/", None, MS_REC | MS_PRIVATE, None),
+            "make / private",
+        )
+    except (OSError, AttributeError) as e:
+        if unshared:
+            libc.setns(original, CLONE_NEWNS)
+            os.chdir(cwd)
+        os.close(original)
+        warn(f"Can not use a private mount namespace ({e}).")
+        yield False
+        return
+
+    debug("Entered private mount namespace.")
+    mount_table().invalidate()
+    _state.depth = getattr(_state, "depth", 0) + 1
+    try:
+        yield True
+    finally:
+        _state.depth -= 1
+        try:
+            _check(libc.setns(original, CLONE_NEWNS), "setns")
+        finally:
+            os.close(original)
+            mount_table().invalidate()
+        os.chdir(cwd)
+        debug("Left private mount namespace.")
@@ -5,13 +5,184 @@
 """
 
 from cleanroom.exceptions import GenerateError
+from cleanroom.helper.cgroup import ProcessGroup, in_process_group
 from cleanroom.printer import trace
+from cleanroom.resourceusage import record_process
+from cleanroom.tracing import span
 
+import codecs
+import collections
+import concurrent.futures
 import os
+import selectors
 import subprocess
+import threading
+import time
 import typing
 
 
+OUTPUT_LIMIT = 16 * 1024 * 1024  # characters of output kept per stream
+
+
+def _wait4(
+    process: subprocess.Popen, timeout: typing.Optional[float]
+) -> typing.Tuple[int, typing.Any]:
+    """Reap process and return its return code and resource usage.
+
+    Popen.wait does not report the resource usage, so reap the child with
+    os.wait4 and tell Popen about the return code."""
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    delay = 0.0005
+    while True:
+        try:
+            (pid, status, rusage) = os.wait4(
+                process.pid, 0 if deadline is None else os.WNOHANG
+            )
+        except ChildProcessError:  # reaped by someone else
+            (pid, status, rusage) = (process.pid, 0, None)
+        if pid == process.pid:
+            break
+        assert deadline is not None and timeout is not None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.05)
+
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return (process.returncode, rusage)
+
+
+def _feed_input(pipe: typing.Any, data: bytes) -> None:
+    try:
+        pipe.write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+class _Output:
+    """Decode one output stream of a process into lines.
+
+    Only the last limit characters are kept, if a limit is given."""
+
+    def __init__(self, limit: typing.Optional[int]) -> None:
+        self._limit = limit
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial = ""
+        self._lines: typing.Deque[str] = collections.deque()
+        self._size = 0
+        self._dropped = 0
+
+    def feed(self, data: bytes, *, final: bool = False) -> typing.List[str]:
+        """Add data and return the lines completed by it."""
+        parts = (self._partial + self._decoder.decode(data, final)).split("\n")
+        self._partial = parts.pop()
+        lines = [f"{p}\n" for p in parts]
+        if self._partial and (
+            final or (self._limit is not None and len(self._partial) > self._limit)
+        ):
+            lines.append(self._partial)
+            self._partial = ""
+
+        for line in lines:
+            self._lines.append(line)
+            self._size += len(line)
+        while self._limit is not None and self._size > self._limit and self._lines:
+            dropped = self._lines.popleft()
+            self._size -= len(dropped)
+            self._dropped += len(dropped)
+        return lines
+
+    def text(self) -> str:
+        dropped = f"[... {self._dropped} characters dropped ...]\n"
+        return (dropped if self._dropped else "") + "".join(self._lines)
+
+
+def _run_process(
+    args: typing.Sequence[str],
+    *,
+    input: typing.Any = None,
+    timeout: typing.Optional[float] = None,
+    check: bool = False,
+    output_limit: typing.Optional[int] = None,
+    on_line: typing.Optional[typing.Callable[[str, str], None]] = None,
+    **kwargs: typing.Any,
+) -> typing.Tuple[subprocess.CompletedProcess, typing.Any]:
+    """Do what subprocess.run does, but also return the rusage of the child.
+
+    Output is read as it arrives and on_line is called with the name of
+    the stream and the line for every line of it."""
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    outputs: typing.Dict[str, _Output] = {}
+
+    with subprocess.Popen(args, **kwargs) as process:
+        if input is not None:
+            threading.Thread(
+                target=_feed_input, args=(process.stdin, input), daemon=True
+            ).start()
+            process.stdin = None  # closed by _feed_input
+
+        try:
+            with selectors.DefaultSelector() as selector:
+                for name, pipe in (
+                    ("stdout", process.stdout),
+                    ("stderr", process.stderr),
+                ):
+                    if pipe:
+                        outputs[name] = _Output(output_limit)
+                        selector.register(pipe, selectors.EVENT_READ, name)
+
+                while selector.get_map():
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        assert timeout is not None
+                        raise subprocess.TimeoutExpired(process.args, timeout)
+                    for key, _ in selector.select(remaining):
+                        data = os.read(key.fd, 65536)
+                        if not data:
+                            selector.unregister(key.fileobj)
+                        lines = outputs[key.data].feed(data, final=not data)
+                        if on_line:
+                            for line in lines:
+                                on_line(key.data, line.rstrip("\n"))
+
+            remaining = deadline - time.monotonic() if deadline else None
+            (returncode, rusage) = _wait4(process, remaining)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise subprocess.TimeoutExpired(
+                process.args,
+                timeout or 0,
+                output=outputs["stdout"].text() if "stdout" in outputs else None,
+                stderr=outputs["stderr"].text() if "stderr" in outputs else None,
+            )
+        except:  # noqa: E722 - same as subprocess.run
+            process.kill()
+            raise
+
+    stdout = outputs["stdout"].text() if "stdout" in outputs else None
+    stderr = outputs["stderr"].text() if "stderr" in outputs else None
+    if check and returncode:
+        raise subprocess.CalledProcessError(
+            returncode, process.args, output=stdout, stderr=stderr
+        )
+    return (
+        subprocess.CompletedProcess(process.args, returncode, stdout, stderr),
+        rusage,
+    )
+
+
 def _quote_args(*args: str) -> str:
     # FIXME: Do better quoting!
     return '"' + " ".join(args) + '"'
@@ -51,11 +222,21 @@ def run(
     stdout: typing.Optional[str] = None,
     stderr: typing.Optional[str] = None,
     chroot_helper: typing.Optional[str] = None,
+    process_group: typing.Optional[ProcessGroup] = None,
+    output_limit: typing.Optional[int] = OUTPUT_LIMIT,
     **kwargs: typing.Any,
 ) -> subprocess.CompletedProcess:
-    """Run command and trace the external command result and output."""
-    if work_directory is not None:
-        os.chdir(work_directory)
+    """Run command and trace the external command result and output.
+
+    The command runs in work_directory, the working directory of the
+    current process is not changed. Pass env to run it with a different
+    environment. Output is passed on to trace_output line by line while
+    the command runs. Only the last output_limit characters of stdout and
+    stderr are kept in the result each, pass None to keep everything.
+
+    The command and everything it starts is put into process_group if
+    that is given."""
+    program = os.path.basename(str(args[0]).split(" ", 1)[0]) if args else ""
 
     if shell:
         args = ("/usr/bin/bash", "-c", _quote_args(*args))
@@ -70,6 +251,8 @@ def run(
             "--keep-unit",
             *args,
         )
+    if process_group is not None:
+        args = in_process_group(process_group, *args)
 
     if trace_output:
         if work_directory:
@@ -90,12 +273,33 @@ def run(
                 trace_output(f">> Redirecting stderr to {stderr}.")
             stderr_fd = open(stderr, mode="w")
 
-        completed_process = subprocess.run(
-            args,
-            stdout=stdout_fd or subprocess.PIPE,
-            stderr=stdout_fd or subprocess.PIPE,
-            **kwargs,
-        )
+        streamed = [0]
+
+        def on_line(stream: str, line: str) -> None:
+            assert trace_output
+            streamed[0] += 1
+            trace_output(f"    [{stream}] {line}")
+
+        with span(
+            program, "process", argv=args, work_directory=work_directory
+        ) as span_args:
+            start_time = time.monotonic()
+            (completed_process, rusage) = _run_process(
+                args,
+                cwd=work_directory,
+                stdout=stdout_fd or subprocess.PIPE,
+                stderr=stderr_fd or stdout_fd or subprocess.PIPE,
+                output_limit=output_limit,
+                on_line=on_line if trace_output else None,
+                **kwargs,
+            )
+            wall_time = time.monotonic() - start_time
+            span_args["exit_code"] = completed_process.returncode
+            if rusage:
+                span_args["user_time"] = rusage.ru_utime
+                span_args["system_time"] = rusage.ru_stime
+                span_args["max_rss"] = rusage.ru_maxrss
+        record_process(program, completed_process.returncode, wall_time, rusage)
     except subprocess.TimeoutExpired as to:
         print(f"Timeout: STDOUT so far: {to.stdout!r}\nSTDERR so far:{to.stderr!r}\n.")
         raise
@@ -106,14 +310,11 @@ def run(
         if stderr_fd:
             stderr_fd.close()
 
-    if completed_process.stdout is not str and completed_process.stdout is not None:
-        completed_process.stdout = completed_process.stdout.decode("utf-8")
-    if completed_process.stderr is not str and completed_process.stderr is not None:
-        completed_process.stderr = completed_process.stderr.decode("utf-8")
-
     assert completed_process is not None
 
-    report_completed_process(trace_output, completed_process)
+    if trace_output and (completed_process.returncode != 0 or streamed[0]):
+        trace_output("Arguments  : {}".format(" ".join(completed_process.args)))
+        trace_output(f"Return Code: {completed_process.returncode}")
 
     if returncode is not None and completed_process.returncode != returncode:
         raise GenerateError(
@@ -123,6 +324,43 @@ def run(
     return completed_process
 
 
+def run_many(
+    *commands: typing.Sequence[str],
+    jobs: int = 0,
+    **kwargs: typing.Any,
+) -> typing.List[subprocess.CompletedProcess]:
+    """Run independent commands concurrently, at most jobs at a time.
+
+    kwargs are passed on to run for every command. All commands are run to
+    the end, even if some of them fail. A failing command raises its error,
+    several failing commands raise one GenerateError listing all of them.
+    Returns the completed processes in the order of commands."""
+    if not commands:
+        return []
+
+    jobs = jobs or min(len(commands), os.cpu_count() or 1)
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=jobs, thread_name_prefix="clrm-run"
+    ) as executor:
+        futures = [executor.submit(run, *c, **kwargs) for c in commands]
+    concurrent.futures.wait(futures)
+
+    errors = [
+        (command, future.exception())
+        for command, future in zip(commands, futures)
+        if future.exception() is not None
+    ]
+    if len(errors) == 1:
+        raise typing.cast(BaseException, errors[0][1])
+    if errors:
+        raise GenerateError(
+            f"{len(errors)} of {len(commands)} commands failed:\n"
+            + "\n".join(f"    {' '.join(c)}: {e}" for c, e in errors),
+            original_exception=typing.cast(Exception, errors[0][1]),
+        )
+    return [f.result() for f in futures]
+
+
 def _report_output_lines(
     channel: typing.Callable[..., None], headline: str, line_data: str
 ) -> None:
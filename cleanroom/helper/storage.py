@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""Storage backends holding the volumes systems are built in and stored into.
+
+A volume is a directory tree that can be snapshotted as a whole: The
+scratch volumes a system is built in and the volumes a finished system is
+stored into.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from ..binarymanager import Binaries
+from ..exceptions import PreflightError
+from ..printer import trace
+from .btrfs import BtrfsHelper, NativeBtrfsHelper
+from .mount import mount, umount_all
+from .run import run
+
+import os
+import shutil
+import tempfile
+import typing
+
+
+STORAGE_BACKENDS = ("btrfs", "overlayfs", "reflink")
+
+
+def _copy_tree(cp_command: str, source: str, destination: str) -> None:
+    """Copy source to destination, merging into destination if that exists."""
+    trace(f"Copy {source} to {destination}.")
+    run(
+        cp_command,
+        "--archive",
+        "--reflink=auto",
+        "--no-target-directory",
+        source,
+        destination,
+        trace_output=trace,
+    )
+
+
+class StorageBackend(object):
+    """Create, snapshot and delete volumes."""
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def is_supported(self, directory: str) -> bool:
+        """Check whether volumes can be created in directory."""
+        assert False
+
+    def create_volume(self, directory: str, *, compress: bool = True) -> None:
+        """Create a new, empty volume.
+
+        Set compress to False for volumes holding short-lived scratch data."""
+        assert False
+
+    def create_scratch(self, directory: str) -> None:
+        """Create the scratch directory systems are built in."""
+        self.create_volume(directory, compress=False)
+
+    def create_snapshot(
+        self, source: str, destination: str, *, read_only: bool = False
+    ) -> None:
+        """Create destination as a snapshot of the volume source."""
+        assert False
+
+    def make_read_only(self, directory: str) -> None:
+        """Make a volume read-only, e.g. after copying a system into it."""
+        assert False
+
+    def delete_volume(self, directory: str) -> bool:
+        """Delete a volume, but none of the volumes inside of it."""
+        assert False
+
+    def delete_volumes(self, directories: typing.Sequence[str]) -> bool:
+        """Delete several volumes, inner volumes must be listed first.
+
+        Returns True if all volumes were deleted."""
+        success = True
+        for directory in directories:
+            success = self.delete_volume(directory) and success
+        return success
+
+    def delete_volume_recursive(self, directory: str) -> None:
+        """Delete all volumes in a volume or directory."""
+        assert False
+
+    def is_volume(self, directory: str) -> bool:
+        """Check whether a directory is a volume."""
+        assert False
+
+
+class BtrfsStorage(StorageBackend):
+    """Volumes are btrfs subvolumes, snapshots are btrfs snapshots."""
+
+    def __init__(self, btrfs_helper: BtrfsHelper) -> None:
+        super().__init__("btrfs")
+        self._btrfs_helper = btrfs_helper
+
+    def is_supported(self, directory: str) -> bool:
+        return self._btrfs_helper.is_btrfs_filesystem(directory)
+
+    def create_volume(self, directory: str, *, compress: bool = True) -> None:
+        self._btrfs_helper.create_subvolume(directory)
+        if not compress:
+            self._btrfs_helper.set_property(directory, name="compression", value="none")
+
+    def create_snapshot(
+        self, source: str, destination: str, *, read_only: bool = False
+    ) -> None:
+        self._btrfs_helper.create_snapshot(source, destination, read_only=read_only)
+
+    def make_read_only(self, directory: str) -> None:
+        self._btrfs_helper.set_property(directory, name="ro", value="true")
+
+    def delete_volume(self, directory: str) -> bool:
+        return self._btrfs_helper.delete_subvolume(directory)
+
+    def delete_volumes(self, directories: typing.Sequence[str]) -> bool:
+        return self._btrfs_helper.delete_subvolumes(directories)
+
+    def delete_volume_recursive(self, directory: str) -> None:
+        self._btrfs_helper.delete_subvolume_recursive(directory)
+
+    def is_volume(self, directory: str) -> bool:
+        return self._btrfs_helper.is_subvolume(directory)
+
+
+class ReflinkStorage(StorageBackend):
+    """Volumes are directories, snapshots are reflink copies.
+
+    Reflinks share the data of the copied files until either copy gets
+    changed (e.g. on XFS), so snapshots are cheap, but still need to walk
+    the whole tree. Files are copied where reflinks are not possible, e.g.
+    across filesystems. Read-only snapshots are not enforced."""
+
+    def __init__(self, cp_command: str, *, name: str = "reflink") -> None:
+        super().__init__(name)
+        assert cp_command
+        self._command = cp_command
+
+    def is_supported(self, directory: str) -> bool:
+        if not os.path.isdir(directory):
+            return False
+        with tempfile.TemporaryDirectory(dir=directory, prefix=".reflink-") as probe:
+            source = os.path.join(probe, "source")
+            with open(source, "wb") as f:
+                f.write(b"reflink probe")
+            return (
+                run(
+                    self._command,
+                    "--reflink=always",
+                    source,
+                    os.path.join(probe, "destination"),
+                    returncode=None,
+                    trace_output=None,
+                ).returncode
+                == 0
+            )
+
+    def create_volume(self, directory: str, *, compress: bool = True) -> None:
+        trace(f"{self.name}: Create volume {directory}.")
+        os.makedirs(directory)
+
+    def create_snapshot(
+        self, source: str, destination: str, *, read_only: bool = False
+    ) -> None:
+        _copy_tree(self._command, source, destination)
+
+    def make_read_only(self, directory: str) -> None:
+        pass  # Not enforced, see above
+
+    def delete_volume(self, directory: str) -> bool:
+        trace(f"{self.name}: Delete volume {directory}.")
+        if not os.path.isdir(directory):
+            return False
+        shutil.rmtree(directory)
+        return True
+
+    def delete_volume_recursive(self, directory: str) -> None:
+        self.delete_volume(directory)
+
+    def is_volume(self, directory: str) -> bool:
+        return os.path.isdir(directory)
+
+
+def _overlay_directory(directory: str) -> str:
+    """The directory holding the upper and work directories of an overlay."""
+    return os.path.join(
+        os.path.dirname(directory), f".{os.path.basename(directory)}.overlay"
+    )
+
+
+class OverlayStorage(ReflinkStorage):
+    """Volumes are directories, writable snapshots are overlayfs mounts.
+
+    Stacking a writable volume on a base volume is a mount and does not
+    depend on the size of the base. Read-only snapshots, used to store
+    finished systems, copy the merged tree, using reflinks where the
+    filesystem supports them."""
+
+    def __init__(self, cp_command: str) -> None:
+        super().__init__(cp_command, name="overlayfs")
+
+    def is_supported(self, directory: str) -> bool:
+        if not os.path.isdir(directory):
+            return False
+        with open("/proc/filesystems", "r") as f:
+            return any(line.split()[-1] == "overlay" for line in f if line.strip())
+
+    def create_snapshot(
+        self, source: str, destination: str, *, read_only: bool = False
+    ) -> None:
+        if read_only:
+            _copy_tree(self._command, source, destination)
+            return
+
+        overlay = _overlay_directory(destination)
+        upper = os.path.join(overlay, "upper")
+        work = os.path.join(overlay, "work")
+        os.makedirs(upper)
+        os.makedirs(work)
+        os.makedirs(destination)
+
+        trace(f"{self.name}: Mount {source} on {destination}.")
+        run(
+            "/usr/bin/mount",
+            "-t",
+            "overlay",
+            "overlay",
+            "-o",
+            f"lowerdir={source},upperdir={upper},workdir={work}",
+            destination,
+            trace_output=trace,
+        )
+
+    def delete_volume(self, directory: str) -> bool:
+        if os.path.ismount(directory):
+            trace(f"{self.name}: Umount {directory}.")
+            run("/usr/bin/umount", directory, trace_output=trace)
+        overlay = _overlay_directory(directory)
+        if os.path.isdir(overlay):
+            shutil.rmtree(overlay)
+        return super().delete_volume(directory)
+
+    def delete_volume_recursive(self, directory: str) -> None:
+        umount_all(directory)
+        self.delete_volume(directory)
+
+
+class MemoryScratchStorage(StorageBackend):
+    """Build systems in RAM: Scratch directories are tmpfs mounts.
+
+    Everything else is passed on to the storage backend. Volumes get copied
+    from storage into RAM when restoring a base system and back when storing
+    the finished system."""
+
+    def __init__(self, storage: StorageBackend, cp_command: str, *, size: str):
+        super().__init__(f"{storage.name} (scratch in tmpfs)")
+        assert cp_command
+        self._storage = storage
+        self._command = cp_command
+        self._size = size
+        self._scratch_directories: typing.Set[str] = set()
+
+    def _scratch_of(self, directory: str) -> str:
+        """Return the in-memory scratch directory holding directory or ''."""
+        directory = os.path.normpath(os.path.abspath(directory))
+        for scratch in self._scratch_directories:
+            if directory == scratch or directory.startswith(scratch + "/"):
+                return scratch
+        return ""
+
+    def is_supported(self, directory: str) -> bool:
+        return self._storage.is_supported(directory)
+
+    def create_volume(self, directory: str, *, compress: bool = True) -> None:
+        if self._scratch_of(directory):
+            os.makedirs(directory)
+        else:
+            self._storage.create_volume(directory, compress=compress)
+
+    def create_scratch(self, directory: str) -> None:
+        directory = os.path.normpath(os.path.abspath(directory))
+        os.makedirs(directory, exist_ok=True)
+        trace(f"{self.name}: Mount tmpfs (size={self._size}) on {directory}.")
+        mount("tmp", directory, options=f"size={self._size},mode=0755", fs_type="tmpfs")
+        self._scratch_directories.add(directory)
+
+    def create_snapshot(
+        self, source: str, destination: str, *, read_only: bool = False
+    ) -> None:
+        if self._scratch_of(destination):
+            assert not read_only  # Volumes in memory are always writable
+            _copy_tree(self._command, source, destination)
+        elif self._scratch_of(source):
+            self._storage.create_volume(destination)
+            _copy_tree(self._command, source, destination)
+            if read_only:
+                self._storage.make_read_only(destination)
+        else:
+            self._storage.create_snapshot(source, destination, read_only=read_only)
+
+    def make_read_only(self, directory: str) -> None:
+        assert not self._scratch_of(directory)
+        self._storage.make_read_only(directory)
+
+    def delete_volume(self, directory: str) -> bool:
+        scratch = self._scratch_of(directory)
+        if not scratch:
+            return self._storage.delete_volume(directory)
+        if not os.path.isdir(directory):
+            return False
+
+        if scratch == os.path.normpath(os.path.abspath(directory)):
+            umount_all(scratch)
+            os.rmdir(scratch)
+            self._scratch_directories.discard(scratch)
+        else:
+            shutil.rmtree(directory)
+        return True
+
+    def delete_volume_recursive(self, directory: str) -> None:
+        if self._scratch_of(directory):
+            self.delete_volume(directory)
+        else:
+            self._storage.delete_volume_recursive(directory)
+
+    def is_volume(self, directory: str) -> bool:
+        if self._scratch_of(directory):
+            return os.path.isdir(directory)
+        return self._storage.is_volume(directory)
+
+
+def create_storage(
+    name: str, binary_manager: typing.Any, *, scratch_in_memory: str = ""
+) -> StorageBackend:
+    """Create the storage backend called name.
+
+    Scratch directories are tmpfs mounts of size scratch_in_memory if that
+    is set (e.g. "8G" or "50%")."""
+    storage = _create_storage(name, binary_manager)
+    if not scratch_in_memory:
+        return storage
+
+    cp_binary = binary_manager.binary(Binaries.CP)
+    if not cp_binary:
+        raise PreflightError("Building in memory needs the cp binary.")
+    return MemoryScratchStorage(storage, cp_binary, size=scratch_in_memory)
+
+
+def _create_storage(name: str, binary_manager: typing.Any) -> StorageBackend:
+    if name == "btrfs":
+        btrfs_binary = binary_manager.binary(Binaries.BTRFS)
+        if not btrfs_binary:
+            raise PreflightError("The btrfs storage backend needs the btrfs binary.")
+        return BtrfsStorage(NativeBtrfsHelper(btrfs_binary))
+
+    cp_binary = binary_manager.binary(Binaries.CP)
+    if not cp_binary:
+        raise PreflightError(f"The {name} storage backend needs the cp binary.")
+    if name == "overlayfs":
+        return OverlayStorage(cp_binary)
+    if name == "reflink":
+        return ReflinkStorage(cp_binary)
+    raise PreflightError(f'Unknown storage backend "{name}".')
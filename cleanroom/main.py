@@ -6,18 +6,29 @@
 """
 
 from .binarymanager import Binaries, BinaryManager
+from .buildcache import command_set_digest
+from .buildtimes import BuildTimes
+from .checkpoints import CheckpointManager, DEFAULT_CHECKPOINT_COMMANDS
 from .commandmanager import CommandManager
 from .generator import Generator
-from .helper.btrfs import BtrfsHelper
+from .parsecache import ParseCache, default_cache_directory
+from .helper.btrfs import NativeBtrfsHelper
 from .helper.group import GroupHelper
+from .helper.storage import STORAGE_BACKENDS, StorageBackend, create_storage
 from .helper.user import UserHelper
 from .preflight import preflight_check, users_check
+from .metrics import BuildMetrics
+from .resourceusage import ResourceAccounting
 from .printer import Printer, h2
-from .workdir import WorkDir
-from .systemsmanager import SystemsManager
+from .server import BuildRequest, BuildServer, request_build
+from .tracing import Tracer
+from .workdir import WorkDir, build_times_path, storage_path
+from .systemsmanager import SystemsManager, affected_systems, reverse_dependencies
 
 from argparse import ArgumentParser
+import contextlib
 import os
+import signal
 import sys
 import typing
 
@@ -29,6 +40,23 @@ def _parse_commandline(*arguments: str) -> typing.Any:
     )
 
     parser.add_argument("--verbose", action="count", default=0, help="Be verbose")
+    parser.add_argument(
+        "--log-buffer-size",
+        dest="log_buffer_size",
+        action="store",
+        type=int,
+        default=2000,
+        metavar="<N>",
+        help="Keep the last N messages (at any verbosity) for error reports.",
+    )
+    parser.add_argument(
+        "--log-spill-file",
+        dest="log_spill_file",
+        action="store",
+        default="",
+        metavar="<FILE>",
+        help="Append messages that drop out of the message buffer to FILE.",
+    )
     parser.add_argument(
         "--list-commands",
         dest="list_commands",
@@ -42,6 +70,14 @@ def _parse_commandline(*arguments: str) -> typing.Any:
         help="List known substitutions that can be used in definition files",
     )
 
+    parser.add_argument(
+        "--plan",
+        dest="plan",
+        action="store_true",
+        help="Print which systems would get built in which order and how long "
+        "that is expected to take. Does not need root permissions.",
+    )
+
     parser.add_argument(
         "--ignore-errors",
         dest="ignore_errors",
@@ -68,6 +104,26 @@ def _parse_commandline(*arguments: str) -> typing.Any:
         help="The directory containing image repositories.",
     )
 
+    parser.add_argument(
+        "--cache-directory",
+        dest="cache_directory",
+        action="store",
+        default=default_cache_directory(),
+        help="Directory to keep caches in that speed up cleanroom startup.",
+    )
+    parser.add_argument(
+        "--no-parse-cache",
+        dest="parse_cache",
+        action="store_false",
+        help="Always parse system definition files, ignoring cached results.",
+    )
+    parser.add_argument(
+        "--fast-parser",
+        dest="fast_parser",
+        action="store_true",
+        help="Use the hand-written parser for system definition files.",
+    )
+
     parser.add_argument(
         "--clear-scratch-directory",
         dest="clear_scratch_directory",
@@ -80,6 +136,34 @@ def _parse_commandline(*arguments: str) -> typing.Any:
         action="store_true",
         help="Clear the storage before proceeding.",
     )
+    parser.add_argument(
+        "--storage-backend",
+        dest="storage_backend",
+        action="store",
+        choices=STORAGE_BACKENDS,
+        default="btrfs",
+        help="How to create and snapshot the volumes systems are built in "
+        "[default: btrfs]. overlayfs mounts a system on top of its base, "
+        "reflink copies volumes with shared data (e.g. on XFS).",
+    )
+    parser.add_argument(
+        "--scratch-in-memory",
+        dest="scratch_in_memory",
+        action="store",
+        default="",
+        metavar="<SIZE>",
+        help="Build systems in a tmpfs of SIZE (e.g. 8G or 50%%) and copy "
+        "them into storage when done.",
+    )
+    parser.add_argument(
+        "--rebuild",
+        dest="rebuild",
+        action="append",
+        metavar="<system>",
+        help="Rebuild this system and all systems based on it, keeping "
+        "unrelated systems in storage. Checkpoints are not used for "
+        "these systems.",
+    )
     parser.add_argument(
         "--keep-temporary-data",
         dest="keep_temporary_data",
@@ -87,6 +171,98 @@ def _parse_commandline(*arguments: str) -> typing.Any:
         help="Keep temporary data in work directory.",
     )
 
+    parser.add_argument(
+        "--socket",
+        dest="socket",
+        action="store",
+        default="",
+        metavar="<SOCKET>",
+        help='Send the build to the "clrm serve" server listening on SOCKET '
+        'and stream its output. With "serve": Listen on SOCKET.',
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        dest="jobs",
+        action="store",
+        type=int,
+        default=1,
+        metavar="<N>",
+        help="Build up to N independent systems in parallel.",
+    )
+
+    parser.add_argument(
+        "--checkpoints",
+        dest="checkpoints",
+        action="store_true",
+        help="Snapshot systems after expensive commands and resume "
+        "rebuilds from the latest matching snapshot.",
+    )
+    parser.add_argument(
+        "--checkpoint-after",
+        dest="checkpoint_after",
+        action="append",
+        metavar="<COMMAND>",
+        help="Take checkpoints after this command (default: "
+        + ", ".join(DEFAULT_CHECKPOINT_COMMANDS)
+        + ").",
+    )
+    parser.add_argument(
+        "--max-checkpoints",
+        dest="max_checkpoints",
+        action="store",
+        type=int,
+        default=20,
+        metavar="<N>",
+        help="Keep at most N checkpoints, evicting the least recently used.",
+    )
+    parser.add_argument(
+        "--max-checkpoint-age",
+        dest="max_checkpoint_age",
+        action="store",
+        type=int,
+        default=14,
+        metavar="<DAYS>",
+        help="Evict checkpoints unused for more than DAYS days (0: never).",
+    )
+
+    parser.add_argument(
+        "--resource-usage-file",
+        dest="resource_usage_file",
+        action="store",
+        default="",
+        metavar="<FILE>",
+        help="Write the resources used by external programs into FILE (JSON).",
+    )
+    parser.add_argument(
+        "--trace-file",
+        dest="trace_file",
+        action="store",
+        default="",
+        metavar="<FILE>",
+        help="Record the time taken by systems, commands, hooks and external "
+        "programs into FILE (Chrome trace event format, see ui.perfetto.dev).",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        dest="metrics_file",
+        action="store",
+        default="",
+        metavar="<FILE>",
+        help="Write build metrics (durations, cache hits, failures, image sizes) "
+        "into FILE once generation is done.",
+    )
+    parser.add_argument(
+        "--metrics-format",
+        dest="metrics_format",
+        action="store",
+        choices=["prometheus", "json"],
+        default="",
+        help="Format of the metrics file [default: json for *.json files, "
+        "prometheus text format otherwise].",
+    )
+
     parser.add_argument(
         dest="systems", nargs="*", metavar="<system>", help="systems to create"
     )
@@ -107,10 +283,42 @@ def run() -> None:
 
 
 def main(*command_arguments: str) -> None:
-    """Run cleanroom with arguments."""
-    args = _parse_commandline(*command_arguments)
-
-    if not args.list_commands and not args.list_substitutions and not args.systems:
+    """Run cleanroom with arguments.
+
+    "clrm serve --socket <SOCKET> [options]" starts a build server,
+    "clrm --socket <SOCKET> [options] <systems>" sends a build to it."""
+    serve = len(command_arguments) > 1 and command_arguments[1] == "serve"
+    if serve:
+        args = _parse_commandline(command_arguments[0], *command_arguments[2:])
+        if not args.socket:
+            print("No socket to serve on.")
+            sys.exit(1)
+    else:
+        args = _parse_commandline(*command_arguments)
+
+    if args.socket and not serve:
+        if not args.systems and not args.rebuild:
+            print("No systems to process.")
+            sys.exit(1)
+        request = BuildRequest(
+            systems=tuple(args.systems),
+            rebuild=tuple(args.rebuild or ()),
+            ignore_errors=args.ignore_errors,
+        )
+        try:
+            succeeded = request_build(args.socket, request)
+        except OSError as e:
+            print(f'Failed to talk to build server on "{args.socket}": {e}')
+            succeeded = False
+        sys.exit(0 if succeeded else 1)
+
+    if (
+        not serve
+        and not args.list_commands
+        and not args.list_substitutions
+        and not args.systems
+        and not args.rebuild
+    ):
         print("No systems to process.")
         sys.exit(1)
 
@@ -119,16 +327,35 @@ def main(*command_arguments: str) -> None:
     # Set up printing:
     pr = Printer.instance()
     pr.set_verbosity(args.verbose)
+    pr.set_buffer_size(args.log_buffer_size)
+    pr.set_spill_file(
+        os.path.abspath(args.log_spill_file) if args.log_spill_file else ""
+    )
     pr.show_verbosity_level()
 
     # Find binaries:
     binary_manager = BinaryManager()
 
-    preflight_check(
-        "binaries", binary_manager.preflight_check, ignore_errors=args.ignore_errors
-    )
+    if not args.plan:
+        preflight_check(
+            "binaries", binary_manager.preflight_check, ignore_errors=args.ignore_errors
+        )
+
+    btrfs_binary = binary_manager.binary(Binaries.BTRFS)
+    btrfs_helper = NativeBtrfsHelper(btrfs_binary) if btrfs_binary else None
+    storage: typing.Optional[StorageBackend] = None
+
+    def storage_check() -> None:
+        nonlocal storage
+        storage = create_storage(
+            args.storage_backend,
+            binary_manager,
+            scratch_in_memory=args.scratch_in_memory,
+        )
+
+    if not args.plan:
+        preflight_check("storage", storage_check, ignore_errors=args.ignore_errors)
 
-    btrfs_helper = BtrfsHelper(binary_manager.binary(Binaries.BTRFS))
     user_helper = UserHelper(
         binary_manager.binary(Binaries.USERADD),
         binary_manager.binary(Binaries.USERMOD),
@@ -138,7 +365,8 @@ def main(*command_arguments: str) -> None:
         binary_manager.binary(Binaries.GROUPMOD),
     )
 
-    preflight_check("users", users_check, ignore_errors=args.ignore_errors)
+    if not args.plan:
+        preflight_check("users", users_check, ignore_errors=args.ignore_errors)
 
     systems_directory = (
         args.systems_directory if args.systems_directory else os.getcwd()
@@ -147,8 +375,10 @@ def main(*command_arguments: str) -> None:
     command_manager = CommandManager(
         os.path.join(os.path.dirname(__file__), "commands"),
         os.path.join(systems_directory, "cleanroom/commands"),
+        index_file=os.path.join(args.cache_directory, "command_index.json"),
         binary_manager=binary_manager,
         btrfs_helper=btrfs_helper,
+        storage=storage,
         group_helper=group_helper,
         user_helper=user_helper,
     )
@@ -165,24 +395,206 @@ def main(*command_arguments: str) -> None:
         "command", command_manager.preflight_check, ignore_errors=args.ignore_errors
     )
 
+    parse_cache = (
+        ParseCache(
+            os.path.join(args.cache_directory, "parse"),
+            command_set_digest(command_manager),
+        )
+        if args.parse_cache
+        else None
+    )
+
+    if serve:
+        _serve(
+            args,
+            command_manager=command_manager,
+            parse_cache=parse_cache,
+            storage=storage,
+            systems_directory=systems_directory,
+        )
+        return
+
+    (systems, rebuild) = _systems_to_process(
+        args.systems,
+        args.rebuild or [],
+        command_manager=command_manager,
+        parse_cache=parse_cache,
+        systems_directory=systems_directory,
+        fast_parser=args.fast_parser,
+    )
+
+    if args.plan:
+        generator = Generator(
+            SystemsManager(
+                command_manager,
+                systems_directory,
+                *systems,
+                parse_cache=parse_cache,
+                fast_parser=args.fast_parser,
+            )
+        )
+        plan = generator.plan(
+            command_manager=command_manager,
+            storage_directory=storage_path(args.work_directory)
+            if args.work_directory
+            else "",
+            build_times=BuildTimes(build_times_path(args.work_directory))
+            if args.work_directory
+            else None,
+            rebuild=rebuild,
+        )
+        generator.print_plan(plan)
+        exit(0)
+
     h2("Starting preparation phase")
 
+    assert storage
     with WorkDir(
-        btrfs_helper,
+        storage,
         work_directory=args.work_directory,
         clear_scratch_directory=args.clear_scratch_directory,
         clear_storage=args.clear_storage,
     ) as work_directory:
-        h2("Starting generation phase")
+        _generate(
+            args,
+            systems,
+            rebuild,
+            ignore_errors=args.ignore_errors,
+            work_directory=work_directory,
+            command_manager=command_manager,
+            parse_cache=parse_cache,
+            storage=storage,
+            systems_directory=systems_directory,
+        )
 
-        systems_manager = SystemsManager(
-            command_manager, systems_directory, *args.systems
+
+def _systems_to_process(
+    systems: typing.List[str],
+    rebuild_systems: typing.List[str],
+    *,
+    command_manager: CommandManager,
+    parse_cache: typing.Optional[ParseCache],
+    systems_directory: str,
+    fast_parser: bool,
+) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """Return the systems to build and the systems to rebuild from scratch."""
+    systems = list(systems)
+    rebuild: typing.List[str] = []
+    if rebuild_systems:
+        rebuild = affected_systems(
+            reverse_dependencies(
+                command_manager,
+                systems_directory,
+                parse_cache=parse_cache,
+                fast_parser=fast_parser,
+            ),
+            *rebuild_systems,
+        )
+        h2("Systems to rebuild: {}".format(", ".join(rebuild)))
+        systems += [s for s in rebuild if s not in systems]
+    return systems, rebuild
+
+
+def _generate(
+    args: typing.Any,
+    systems: typing.List[str],
+    rebuild: typing.List[str],
+    *,
+    ignore_errors: bool,
+    work_directory: WorkDir,
+    command_manager: CommandManager,
+    parse_cache: typing.Optional[ParseCache],
+    storage: StorageBackend,
+    systems_directory: str,
+) -> None:
+    h2("Starting generation phase")
+
+    systems_manager = SystemsManager(
+        command_manager,
+        systems_directory,
+        *systems,
+        parse_cache=parse_cache,
+        fast_parser=args.fast_parser,
+    )
+
+    checkpoint_manager = (
+        CheckpointManager(
+            storage,
+            work_directory.checkpoint_directory,
+            max_checkpoints=args.max_checkpoints,
+            max_age=args.max_checkpoint_age * 24 * 60 * 60,
         )
+        if args.checkpoints
+        else None
+    )
 
-        generator = Generator(systems_manager)
+    generator = Generator(systems_manager)
+    with ResourceAccounting(args.resource_usage_file), (
+        Tracer(args.trace_file) if args.trace_file else contextlib.nullcontext()
+    ), (
+        BuildMetrics(args.metrics_file, format=args.metrics_format)
+        if args.metrics_file
+        else contextlib.nullcontext()
+    ):
         generator.generate_systems(
             work_directory=work_directory,
             command_manager=command_manager,
-            ignore_errors=args.ignore_errors,
+            ignore_errors=ignore_errors,
             repository_base_directory=args.repository_base_directory,
+            jobs=args.jobs,
+            checkpoint_manager=checkpoint_manager,
+            checkpoint_commands=args.checkpoint_after or DEFAULT_CHECKPOINT_COMMANDS,
+            rebuild=rebuild,
+            build_times=BuildTimes(work_directory.build_times_file),
         )
+
+
+def _serve(
+    args: typing.Any,
+    *,
+    command_manager: CommandManager,
+    parse_cache: typing.Optional[ParseCache],
+    storage: typing.Optional[StorageBackend],
+    systems_directory: str,
+) -> None:
+    """Keep everything set up and build systems on request."""
+    h2("Starting preparation phase")
+
+    assert storage
+    work_directory: typing.Optional[WorkDir] = None
+
+    def build(request: BuildRequest) -> None:
+        assert work_directory
+        (systems, rebuild) = _systems_to_process(
+            list(request.systems),
+            list(request.rebuild),
+            command_manager=command_manager,
+            parse_cache=parse_cache,
+            systems_directory=systems_directory,
+            fast_parser=args.fast_parser,
+        )
+        _generate(
+            args,
+            systems,
+            rebuild,
+            ignore_errors=request.ignore_errors,
+            work_directory=work_directory,
+            command_manager=command_manager,
+            parse_cache=parse_cache,
+            storage=storage,
+            systems_directory=systems_directory,
+        )
+
+    # Fails if another server is running, before touching its work directory:
+    server = BuildServer(args.socket, build)
+    try:
+        with WorkDir(
+            storage,
+            work_directory=args.work_directory,
+            clear_scratch_directory=args.clear_scratch_directory,
+            clear_storage=args.clear_storage,
+        ) as work_directory:
+            signal.signal(signal.SIGTERM, lambda *_: server.shutdown())
+            server.serve_forever()
+    finally:
+        server.shutdown()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Export metrics about a build for dashboards.
+
+Metrics are written in the Prometheus text format (e.g. for the textfile
+collector of the node_exporter) or as JSON once generation is done.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from __future__ import annotations
+
+from .printer import trace
+from .processrecords import ProcessRecords
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import typing
+
+
+# name: (help text, whether to sum up values of all systems into a total)
+METRICS: typing.Dict[str, typing.Tuple[str, bool]] = {
+    "build_duration_seconds": ("Time taken to build the system.", False),
+    "cache_hits": ("Systems found up to date in storage.", True),
+    "cache_misses": ("Systems that needed to be built.", True),
+    "failures": ("Systems that failed to build.", True),
+    "image_size_bytes": ("Size of images created for the system.", False),
+    "export_upload_seconds": ("Time taken to upload the system export.", False),
+}
+
+_PREFIX = "clrm_"
+
+
+class Metric(typing.NamedTuple):
+    name: str
+    labels: typing.Dict[str, str]
+    value: float
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: typing.Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def collect(
+    records: typing.Iterable[typing.Dict[str, typing.Any]]
+) -> typing.List[Metric]:
+    """Turn records into metrics: The last value recorded wins, totals get added."""
+    values: typing.Dict[typing.Tuple[str, str], Metric] = {}
+    for r in records:
+        labels = {"system": r["system"], **r.get("labels", {})}
+        key = (r["name"], json.dumps(labels, sort_keys=True))
+        values[key] = Metric(r["name"], labels, float(r["value"]))
+
+    metrics = sorted(values.values(), key=lambda m: (m.name, sorted(m.labels.items())))
+    totals: typing.List[Metric] = []
+    for name, (_, summed) in METRICS.items():
+        if summed:
+            total = sum(m.value for m in metrics if m.name == name)
+            totals.append(Metric(f"{name}_total", {}, total))
+    return metrics + totals
+
+
+def format_prometheus(metrics: typing.List[Metric], timestamp: float) -> str:
+    """Format metrics in the Prometheus text exposition format."""
+    lines: typing.List[str] = []
+    names = sorted({m.name for m in metrics})
+    for name in names:
+        help_text = METRICS.get(name, METRICS.get(name[: -len("_total")], ("", False)))[
+            0
+        ]
+        lines.append(f"# HELP {_PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {_PREFIX}{name} gauge")
+        for m in metrics:
+            if m.name == name:
+                lines.append(f"{_PREFIX}{name}{_labels(m.labels)} {m.value:g}")
+    lines.append(f"# HELP {_PREFIX}last_build_timestamp_seconds End of the last build.")
+    lines.append(f"# TYPE {_PREFIX}last_build_timestamp_seconds gauge")
+    lines.append(f"{_PREFIX}last_build_timestamp_seconds {timestamp:.0f}")
+    return "\n".join(lines) + "\n"
+
+
+def format_json(metrics: typing.List[Metric], timestamp: float) -> str:
+    """Format metrics as JSON."""
+    return json.dumps(
+        {
+            "version": 1,
+            "timestamp": timestamp,
+            "metrics": [m._asdict() for m in metrics],
+        },
+        indent=2,
+    )
+
+
+class BuildMetrics:
+    """Collect metrics during a build and write them once it is done."""
+
+    _instance: typing.Optional[BuildMetrics] = None
+
+    @staticmethod
+    def instance() -> typing.Optional[BuildMetrics]:
+        """Get the active metrics collection, if any."""
+        return BuildMetrics._instance
+
+    def __init__(self, file_name: str, *, format: str = "") -> None:
+        """Constructor.
+
+        format is "prometheus" or "json". It defaults to "json" for file
+        names ending in ".json" and to "prometheus" otherwise."""
+        self._file_name = os.path.abspath(file_name)
+        self._format = format or (
+            "json" if file_name.endswith(".json") else "prometheus"
+        )
+        assert self._format in ("prometheus", "json")
+        self._directory = ""
+        self._records: typing.Optional[ProcessRecords] = None
+
+    def __enter__(self) -> BuildMetrics:
+        self._directory = tempfile.mkdtemp(prefix="clrm-metrics-")
+        self._records = ProcessRecords(self._directory)
+        BuildMetrics._instance = self
+        return self
+
+    def __exit__(self, exc_type: typing.Any, exc_val: typing.Any, exc_tb: typing.Any):
+        BuildMetrics._instance = None
+        assert self._records
+        metrics = collect(self._records.read())
+        shutil.rmtree(self._directory, ignore_errors=True)
+        self.write(metrics)
+        return False
+
+    def record(self, system: str, name: str, value: float, **labels: str) -> None:
+        """Record a value of metric name for system."""
+        assert name in METRICS
+        assert self._records
+        self._records.append(
+            {"system": system, "name": name, "labels": labels, "value": value}
+        )
+
+    def write(self, metrics: typing.List[Metric]) -> None:
+        """Write metrics atomically, so collectors never see a partial file."""
+        timestamp = time.time()
+        if self._format == "json":
+            data = format_json(metrics, timestamp)
+        else:
+            data = format_prometheus(metrics, timestamp)
+
+        os.makedirs(os.path.dirname(self._file_name), exist_ok=True)
+        tmp_file = f"{self._file_name}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            f.write(data)
+        os.rename(tmp_file, self._file_name)
+        trace(f'Wrote {len(metrics)} metrics to "{self._file_name}".')
+
+
+def record_metric(system: str, name: str, value: float, **labels: str) -> None:
+    """Record a value of metric name for system if metrics are collected."""
+    metrics = BuildMetrics._instance
+    if metrics:
+        metrics.record(system, name, value, **labels)
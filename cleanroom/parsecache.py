@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Cache parse results of system definition files on disk.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from .execobject import ExecObject
+from .printer import debug, trace
+
+import hashlib
+import os
+import os.path
+import pickle
+import typing
+
+
+# Bump this whenever the parser output changes in an incompatible way:
+_FORMAT_VERSION = 1
+
+
+ParseResult = typing.Tuple[str, str, typing.List[ExecObject]]
+
+
+def default_cache_directory() -> str:
+    """Return the directory cleanroom uses for caches by default."""
+    base = os.environ.get("XDG_CACHE_HOME", "") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "cleanroom")
+
+
+class ParseCache:
+    """Map the contents of a system definition file to its parse result.
+
+    Entries are keyed by the file name, the file contents and the digest of
+    all commands known (the command set version), since the parser validates
+    all commands it finds."""
+
+    def __init__(self, directory: str, command_digest: str) -> None:
+        """Constructor."""
+        self._directory = directory
+        self._command_digest = command_digest
+        self._memory: typing.Dict[str, bytes] = {}
+
+        os.makedirs(self._directory, exist_ok=True)
+
+    def _key(self, file_name: str, contents: bytes) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(f"{_FORMAT_VERSION}\0{self._command_digest}\0".encode("utf-8"))
+        hasher.update(os.path.abspath(file_name).encode("utf-8") + b"\0")
+        hasher.update(contents)
+        return hasher.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.bin")
+
+    def get(self, file_name: str) -> typing.Tuple[str, typing.Optional[ParseResult]]:
+        """Return the cache key of file_name and its cached parse result.
+
+        The parse result is None if file_name is not in the cache. Every call
+        returns fresh objects, so callers may modify the result."""
+        with open(file_name, "rb") as f:
+            key = self._key(file_name, f.read())
+
+        data = self._memory.get(key, None)
+        if data is None:
+            path = self._path(key)
+            if not os.path.isfile(path):
+                trace(f'Parse cache miss for "{file_name}".')
+                return key, None
+            with open(path, "rb") as f:
+                data = f.read()
+
+        try:
+            result = pickle.loads(data)
+        except Exception as e:
+            debug(f'Ignoring broken parse cache entry for "{file_name}": {e}.')
+            return key, None
+
+        self._memory[key] = data
+        trace(f'Parse cache hit for "{file_name}".')
+        return key, result
+
+    def put(self, key: str, result: ParseResult) -> None:
+        """Store the parse result for the key returned by get."""
+        data = pickle.dumps(result)
+        self._memory[key] = data
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
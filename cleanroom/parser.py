@@ -10,6 +10,7 @@ from .location import Location
 from .printer import debug
 from .commandmanager import CommandManager
 from .execobject import ExecObject
+from .fastparser import parse_commands
 
 import re
 import pyparsing as pp  # type: ignore
@@ -110,11 +111,20 @@ class Parser:
     parse_and_verify_string: typing.Optional[MethodType] = None  # for pytest use only!
 
     def __init__(
-        self, command_manager: CommandManager, *, debug_parser: bool = False
+        self,
+        command_manager: CommandManager,
+        *,
+        debug_parser: bool = False,
+        fast_parser: bool = False,
     ) -> None:
-        """Constructor."""
+        """Constructor.
+
+        The fast parser is a hand-written replacement of the pyparsing grammar
+        that needs to prove itself before it becomes the default."""
         self._command_manager = command_manager
-        self._grammar = _generate_grammar(debug_parser=debug_parser)
+        self._grammar = (
+            None if fast_parser else _generate_grammar(debug_parser=debug_parser)
+        )
 
     def parse(self, input_file: str) -> typing.Tuple[str, str, typing.List[ExecObject]]:
         """Parse a file."""
@@ -129,71 +139,85 @@ class Parser:
         target_distribution = ""
         exec_obj_list: typing.List[ExecObject] = []
 
-        current_location = Location(file_name=input_file_name)
-
-        try:
-            parse_result = self._grammar.parseString(data, parseAll=True)
-
-            for c in parse_result:
-                if not c:
-                    continue
-
-                child_dict = c.asDict()
-                arguments = child_dict.get("args", [])
-                if isinstance(arguments, dict):
-                    arguments = [arguments]
-                assert isinstance(arguments, list)
+        for line_number, command_name, arguments in self._commands(
+            data, input_file_name
+        ):
+            current_location = Location(
+                file_name=input_file_name,
+                line_number=line_number,
+                description=command_name,
+            )
+            command_info = self._command_manager.command(command_name)
+
+            if not command_info:
+                raise ParseError(
+                    f'Unknown command "{command_name}".', location=current_location
+                )
 
-                command = child_dict.get("command", {})
-                assert len(command) == 3
+            (args, kwargs) = _process_arguments(arguments)
 
-                command_pos = command.get("locn_start", -1)
-                command_name: str = command.get("value", "")
+            command_info.validate_func(current_location, args, kwargs)
+            command_dependency = command_info.dependency_func(args, kwargs)
+            command_target_distribution = command_info.target_distribution
 
-                current_location = Location(
-                    file_name=input_file_name,
-                    line_number=pp.lineno(command_pos, data),
-                    description=command_name,
-                )
-                command_info = self._command_manager.command(command_name)
-
-                if not command_info:
-                    raise ParseError(f"Unknown command {c}.", location=current_location)
-
-                (args, kwargs) = _process_arguments(arguments)
-
-                command_info.validate_func(current_location, args, kwargs)
-                command_dependency = command_info.dependency_func(args, kwargs)
-                command_target_distribution = command_info.target_distribution
-
-                if command_dependency:
-                    if base_system_name:
-                        raise ParseError(
-                            f'More than one base system was provided in "{input_file_name}".'
-                        )
-                    base_system_name = command_dependency
-                if command_target_distribution:
-                    if (
-                        target_distribution
-                        and target_distribution != command_target_distribution
-                    ):
-                        raise ParseError(
-                            "Target distributions detected for system provided in "
-                            + f'"{input_file_name}" (== {command_target_distribution}) '
-                            + f'does not match "{target_distribution}" used earlier in the same file.'
-                        )
-                    target_distribution = command_target_distribution
-
-                exec_obj_list.append(
-                    ExecObject(
-                        location=current_location,
-                        command=command_name,
-                        args=args,
-                        kwargs=kwargs,
+            if command_dependency:
+                if base_system_name:
+                    raise ParseError(
+                        f'More than one base system was provided in "{input_file_name}".'
                     )
+                base_system_name = command_dependency
+            if command_target_distribution:
+                if (
+                    target_distribution
+                    and target_distribution != command_target_distribution
+                ):
+                    raise ParseError(
+                        "Target distributions detected for system provided in "
+                        + f'"{input_file_name}" (== {command_target_distribution}) '
+                        + f'does not match "{target_distribution}" used earlier in the same file.'
+                    )
+                target_distribution = command_target_distribution
+
+            exec_obj_list.append(
+                ExecObject(
+                    location=current_location,
+                    command=command_name,
+                    args=args,
+                    kwargs=kwargs,
                 )
-
-        except pp.ParseException as pe:
-            raise ParseError(str(pe), location=current_location)
+            )
 
         return base_system_name, target_distribution, exec_obj_list
+
+    def _commands(
+        self, data: str, input_file_name: str
+    ) -> typing.List[typing.Tuple[int, str, typing.List[typing.Dict[str, str]]]]:
+        if self._grammar is None:
+            return parse_commands(data, input_file_name)
+
+        try:
+            parse_result = self._grammar.parseString(data, parseAll=True)
+        except pp.ParseException as pe:
+            raise ParseError(str(pe), location=Location(file_name=input_file_name))
+
+        result: typing.List[
+            typing.Tuple[int, str, typing.List[typing.Dict[str, str]]]
+        ] = []
+        for c in parse_result:
+            if not c:
+                continue
+
+            child_dict = c.asDict()
+            arguments = child_dict.get("args", [])
+            if isinstance(arguments, dict):
+                arguments = [arguments]
+            assert isinstance(arguments, list)
+
+            command = child_dict.get("command", {})
+            assert len(command) == 3
+
+            command_pos = command.get("locn_start", -1)
+            result.append(
+                (pp.lineno(command_pos, data), command.get("value", ""), arguments)
+            )
+        return result
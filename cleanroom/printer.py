@@ -4,73 +4,90 @@
 @author: Tobias Hunger <tobias.hunger@gmail.com>
 """
 
-from io import StringIO
+from collections import deque
 from os import getenv
 import sys
+import time
 import typing
 
 
-def h1(*args: str, **kwargs: typing.Any) -> None:
+# Messages are passed as any number of parts. A part that is callable gets
+# called to produce the text to show, but only if the message actually gets
+# printed or written out from the message buffer. That may happen much later,
+# so callables must not depend on anything that changes in the meantime.
+Message = typing.Any
+
+
+def enabled(verbosity: int) -> bool:
+    """Check whether messages at verbosity get printed."""
+    return Printer.instance().enabled(verbosity)
+
+
+def _resolve(part: Message) -> typing.Any:
+    return part() if callable(part) else part
+
+
+def h1(*args: Message, **kwargs: typing.Any) -> None:
     """Print main headline."""
     Printer.instance().h1(*args, **kwargs)
 
 
-def h2(*args: str, **kwargs: typing.Any) -> None:
+def h2(*args: Message, **kwargs: typing.Any) -> None:
     """Print sub headline."""
     Printer.instance().h2(*args, **kwargs)
 
 
-def h3(*args: str, **kwargs: typing.Any) -> None:
+def h3(*args: Message, **kwargs: typing.Any) -> None:
     """Print sub-sub headline."""
     Printer.instance().h3(*args, **kwargs)
 
 
-def error(*args: str, **kwargs: typing.Any) -> None:
+def error(*args: Message, **kwargs: typing.Any) -> None:
     """Print error message."""
     Printer.instance().error(*args, **kwargs)
 
 
-def warn(*args: str, **kwargs: typing.Any) -> None:
+def warn(*args: Message, **kwargs: typing.Any) -> None:
     """Print warning message."""
     Printer.instance().warn(*args, **kwargs)
 
 
-def success(*args: str, **kwargs: typing.Any) -> None:
+def success(*args: Message, **kwargs: typing.Any) -> None:
     """Print success message."""
     Printer.instance().success(*args, **kwargs)
 
 
-def fail(*args: str, **kwargs: typing.Any) -> None:
+def fail(*args: Message, **kwargs: typing.Any) -> None:
     """Print fail message."""
     Printer.instance().fail(*args, **kwargs)
 
 
-def msg(*args: str) -> None:
+def msg(*args: Message) -> None:
     """Print arguments."""
     Printer.instance().msg(*args)
 
 
-def verbose(*args: str) -> None:
+def verbose(*args: Message) -> None:
     """Print if verbose is set."""
     Printer.instance().verbose(*args)
 
 
-def info(*args: str) -> None:
+def info(*args: Message) -> None:
     """Print even more verbose."""
     Printer.instance().info(*args)
 
 
-def debug(*args: str) -> None:
+def debug(*args: Message) -> None:
     """Print if debug is set."""
     Printer.instance().debug(*args)
 
 
-def trace(*args: str) -> None:
+def trace(*args: Message) -> None:
     """Print trace messsages."""
     Printer.instance().trace(*args)
 
 
-def none(*args: str) -> None:
+def none(*args: Message) -> None:
     """Do nothing."""
     pass
 
@@ -85,6 +102,32 @@ def _ansi_fy(seq: str) -> str:
     return ""
 
 
+class LogRecord(typing.NamedTuple):
+    """One message passed to the Printer.
+
+    The message is only formatted when the record gets written out."""
+
+    level: int
+    timestamp: float
+    system: str
+    location: str
+    args: typing.Tuple[Message, ...]
+
+    @property
+    def message(self) -> str:
+        try:
+            return " ".join(str(_resolve(a)) for a in self.args)
+        except Exception as e:
+            return f"<Failed to format message: {e}>"
+
+    def format(self) -> str:
+        stamp = time.strftime("%H:%M:%S", time.localtime(self.timestamp))
+        millis = int(self.timestamp * 1000) % 1000
+        system = f" [{self.system}]" if self.system else ""
+        location = f" {self.location}:" if self.location else ""
+        return f"{stamp}.{millis:03}{system}{location} {self.message}"
+
+
 class Printer:
     """Pretty-print output.
 
@@ -105,8 +148,14 @@ class Printer:
             Printer._instance = Printer(verbosity=verbosity)
         return Printer._instance
 
-    def __init__(self, verbosity: int = 0) -> None:
-        """Constructor."""
+    def __init__(
+        self, verbosity: int = 0, *, buffer_size: int = 2000, spill_file: str = ""
+    ) -> None:
+        """Constructor.
+
+        The last buffer_size messages are kept for error reports. Messages
+        dropped from that buffer get appended to spill_file if it is set,
+        the older half of the buffer at a time."""
         self._verbose = 0
         self._prefix = ""
 
@@ -127,17 +176,51 @@ class Printer:
         self._extra_prefix = _ansi_fy("\033[1;36m")
         self._extra_suffix = _ansi_fy("\033[0;m\033[2;m")
 
-        self._buffer = ""
+        self._buffer: typing.Deque[LogRecord] = deque(maxlen=buffer_size)
+        self._spill_file = spill_file
+        self._system = ""
+        self._location = ""
 
         Printer._instance = self
 
+    def set_buffer_size(self, buffer_size: int) -> None:
+        """Keep the last buffer_size messages for error reports."""
+        while len(self._buffer) > buffer_size:
+            self._spill([self._buffer.popleft()])
+        self._buffer = deque(self._buffer, maxlen=buffer_size)
+
+    def set_spill_file(self, spill_file: str) -> None:
+        """Append messages dropped from the buffer to spill_file."""
+        self._spill_file = spill_file
+
+    def set_context(self, *, system: str = "", location: str = "") -> None:
+        """Set the system and location to attach to following messages."""
+        self._system = system
+        self._location = location
+
+    def records(self) -> typing.List[LogRecord]:
+        """Return the buffered messages."""
+        return list(self._buffer)
+
+    def _spill(self, records: typing.Iterable[LogRecord]) -> None:
+        if not self._spill_file:
+            return
+        with open(self._spill_file, "a") as f:
+            for record in records:
+                f.write(record.format() + "\n")
+
+    def _clear_buffer(self) -> None:
+        self._spill(self._buffer)
+        self._buffer.clear()
+
     def flush(self) -> None:
-        buf = self._buffer
-        self._buffer = ""
+        records = list(self._buffer)
+        self._clear_buffer()
 
-        if buf:
+        if records:
             print(">>>>>> Flushing buffer:")
-            print(buf)
+            for record in records:
+                print(record.format())
             print(">>>>>> End of Buffer <<<<<<")
         else:
             print(">>>>>> No buffered output <<<<<<")
@@ -155,24 +238,36 @@ class Printer:
             debug("Debug output enabled.")
             trace("Trace output enabled.")
 
-    def _print_to_buffer(self, *args: str) -> None:
-        buf = StringIO()
-        print(*args, file=buf)
-        self._buffer += buf.getvalue()
-
-    def _print_impl(self, *args: str, **kwargs: typing.Any) -> None:
+    def _print_to_buffer(self, verbosity: int, *args: Message) -> None:
+        if (
+            self._spill_file
+            and self._buffer
+            and len(self._buffer) == self._buffer.maxlen
+        ):
+            # Spill the older half at once instead of opening the file per message:
+            half = max(1, len(self._buffer) // 2)
+            self._spill([self._buffer.popleft() for _ in range(half)])
+        self._buffer.append(
+            LogRecord(verbosity, time.time(), self._system, self._location, args)
+        )
+
+    def _print_impl(self, *args: typing.Any, **kwargs: typing.Any) -> None:
         print(*args, **kwargs)
 
-    def _print(self, *args: str, verbosity: int = 0) -> None:
-        self._print_to_buffer(*args)
+    def _print(self, *args: Message, verbosity: int = 0) -> None:
+        self._print_to_buffer(verbosity, *args)
 
-        if self._print_at_verbosity_level(verbosity):
-            self._print_impl(*args)
+        if verbosity <= self._verbose:
+            self._print_impl(*[_resolve(a) for a in args])
 
-    def _print_at_verbosity_level(self, verbosity: int) -> bool:
+    def enabled(self, verbosity: int) -> bool:
+        """Check whether messages at verbosity get printed."""
         return verbosity <= self._verbose
 
-    def h1(self, *args: str, verbosity: int = 0) -> None:
+    def _print_at_verbosity_level(self, verbosity: int) -> bool:
+        return self.enabled(verbosity)
+
+    def h1(self, *args: Message, verbosity: int = 0) -> None:
         """Print big headline."""
         intro = f"\n\n{self._h1_suffix}============================================{self._ansi_reset}"
         prefix = f"{self._h1_suffix}== "
@@ -181,37 +276,37 @@ class Printer:
         self._print(prefix, *args, self._ansi_reset, verbosity=verbosity)
         self._print(postfix, verbosity=verbosity)
         self._print(verbosity=verbosity)
-        self._buffer = ""
+        self._clear_buffer()
 
-    def h2(self, *args: str, verbosity: int = 0) -> None:
+    def h2(self, *args: Message, verbosity: int = 0) -> None:
         """Print a headline."""
         intro = f"\n{self._h_prefix}******{self._h1_suffix}"
         self._print(intro, *args, self._ansi_reset, verbosity=verbosity)
 
-    def h3(self, *args: str, verbosity: int = 0) -> None:
+    def h3(self, *args: Message, verbosity: int = 0) -> None:
         """Print a subheading."""
         intro = f"\n{self._h_prefix}******{self._ansi_reset}"
         self._print(intro, *args, verbosity=verbosity)
 
-    def error(self, *args: str, verbosity: int = 0) -> None:
+    def error(self, *args: Message, verbosity: int = 0) -> None:
         """Print error message."""
         intro = f"{self._error_prefix}ERROR:"
         self._print(intro, *args, self._ansi_reset, verbosity=verbosity)
 
-    def warn(self, *args: str, verbosity: int = 0) -> None:
+    def warn(self, *args: Message, verbosity: int = 0) -> None:
         """Print warning message."""
         intro = f"{self._warn_prefix}warn: "
         self._print(intro, *args, self._ansi_reset, verbosity=verbosity)
 
-    def success(self, *args: str, verbosity: int = 0) -> None:
+    def success(self, *args: Message, verbosity: int = 0) -> None:
         """Print success message."""
         intro = f"{self._ok_prefix}  OK  {self._ok_suffix}"
         self._print(intro, *args, self._ansi_reset, verbosity=verbosity)
-        self._buffer = ""
+        self._clear_buffer()
 
     def fail(
         self,
-        *args: str,
+        *args: Message,
         verbosity: int = 0,
         force_exit: bool = True,
         ignore: bool = False,
@@ -228,25 +323,25 @@ class Printer:
             if force_exit:
                 sys.exit(1)
 
-    def msg(self, *args: str) -> None:
+    def msg(self, *args: Message) -> None:
         """Print arguments."""
         self._print(self._prefix, *args, verbosity=0)
 
-    def verbose(self, *args: str) -> None:
+    def verbose(self, *args: Message) -> None:
         """Print if verbose is set."""
         self._print(self._prefix, *args, verbosity=1)
 
-    def info(self, *args: str) -> None:
+    def info(self, *args: Message) -> None:
         """Print even more verbose."""
         intro = f"{self._extra_prefix}......{self._extra_suffix}"
         self._print(intro, *args, self._ansi_reset, verbosity=2)
 
-    def debug(self, *args: str) -> None:
+    def debug(self, *args: Message) -> None:
         """Print if debug is set."""
         intro = f"{self._extra_prefix}------{self._extra_suffix}"
         self._print(intro, *args, self._ansi_reset, verbosity=3)
 
-    def trace(self, *args: str) -> None:
+    def trace(self, *args: Message) -> None:
         """Print trace messsages."""
         intro = f"{self._extra_prefix}++++++{self._extra_suffix}"
         self._print(intro, *args, self._ansi_reset, verbosity=4)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Collect records from a process and all the worker processes it forks.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from .printer import debug
+
+import glob
+import json
+import os
+import threading
+import typing
+
+
+class ProcessRecords:
+    """Append JSON records to one file per process and read them back.
+
+    Each process appends to a file of its own and flushes after every
+    record, so records of forked workers are kept even when these leave
+    through os._exit."""
+
+    def __init__(self, directory: str, prefix: str = "") -> None:
+        """Constructor.
+
+        Records are stored in files named "<prefix><pid>.part" in directory."""
+        self._directory = directory
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._pid = 0
+        self._file: typing.Optional[typing.TextIO] = None
+
+    def _files(self) -> typing.List[str]:
+        pattern = glob.escape(os.path.join(self._directory, self._prefix))
+        return sorted(glob.glob(pattern + "*.part"))
+
+    def append(self, record: typing.Dict[str, typing.Any]) -> None:
+        """Append a record, written by the current process."""
+        with self._lock:
+            pid = os.getpid()
+            if self._file is None or self._pid != pid:
+                # Never write into the file of the parent process:
+                self._pid = pid
+                self._file = open(
+                    os.path.join(self._directory, f"{self._prefix}{pid}.part"), "a"
+                )
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def read(self) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Return the records of all processes."""
+        with self._lock:
+            if self._file and self._pid == os.getpid():
+                self._file.close()
+                self._file = None
+
+        result: typing.List[typing.Dict[str, typing.Any]] = []
+        for file_name in self._files():
+            with open(file_name, "r") as f:
+                for line in f:
+                    try:
+                        result.append(json.loads(line))
+                    except ValueError:
+                        debug(f'Skipping broken record in "{file_name}".')
+        return result
+
+    def remove(self) -> None:
+        """Remove the files of all processes."""
+        with self._lock:
+            if self._file and self._pid == os.getpid():
+                self._file.close()
+                self._file = None
+        for file_name in self._files():
+            os.unlink(file_name)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Account for the resources used by external programs.
+
+helper.run reports the resource usage of every program it started here.
+The usage gets aggregated per program and per system and is reported at the
+end of the build.
+
+Processes append their records to a file of their own, so that usage of
+programs started in forked worker processes is not lost.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from __future__ import annotations
+
+from .printer import debug, h2, msg, trace
+from .processrecords import ProcessRecords
+
+import json
+import os
+import shutil
+import tempfile
+import typing
+
+
+class ProcessUsage(typing.NamedTuple):
+    system: str
+    program: str
+    returncode: int
+    wall_time: float  # seconds
+    user_time: float  # seconds
+    system_time: float  # seconds
+    max_rss: int  # KiB
+    blocks_read: int
+    blocks_written: int
+
+
+class UsageSummary(typing.NamedTuple):
+    runs: int
+    wall_time: float
+    user_time: float
+    system_time: float
+    max_rss: int
+    blocks_read: int
+    blocks_written: int
+
+
+def summarize(
+    usages: typing.Iterable[ProcessUsage], key: typing.Callable[[ProcessUsage], str]
+) -> typing.Dict[str, UsageSummary]:
+    """Sum up usages grouped by key. max_rss is the maximum of the group."""
+    result: typing.Dict[str, UsageSummary] = {}
+    for u in usages:
+        s = result.get(key(u), UsageSummary(0, 0.0, 0.0, 0.0, 0, 0, 0))
+        result[key(u)] = UsageSummary(
+            runs=s.runs + 1,
+            wall_time=s.wall_time + u.wall_time,
+            user_time=s.user_time + u.user_time,
+            system_time=s.system_time + u.system_time,
+            max_rss=max(s.max_rss, u.max_rss),
+            blocks_read=s.blocks_read + u.blocks_read,
+            blocks_written=s.blocks_written + u.blocks_written,
+        )
+    return result
+
+
+class ResourceAccounting:
+    """Collect the resource usage of external programs during a build."""
+
+    _instance: typing.Optional[ResourceAccounting] = None
+
+    @staticmethod
+    def instance() -> typing.Optional[ResourceAccounting]:
+        """Get the active resource accounting, if any."""
+        return ResourceAccounting._instance
+
+    def __init__(self, report_file: str = "") -> None:
+        """Constructor.
+
+        The usage data is written to report_file (JSON) if that is set."""
+        self._report_file = os.path.abspath(report_file) if report_file else ""
+        self._directory = ""
+        self._records: typing.Optional[ProcessRecords] = None
+        self._system = ""
+
+    def __enter__(self) -> ResourceAccounting:
+        self._directory = tempfile.mkdtemp(prefix="clrm-usage-")
+        self._records = ProcessRecords(self._directory)
+        ResourceAccounting._instance = self
+        return self
+
+    def __exit__(self, exc_type: typing.Any, exc_val: typing.Any, exc_tb: typing.Any):
+        ResourceAccounting._instance = None
+        usages = self.usages()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+        self.print_summary(usages)
+        if self._report_file:
+            self.write_report(self._report_file, usages)
+        return False
+
+    def set_system(self, system: str) -> None:
+        """Account following programs to system."""
+        self._system = system
+
+    def record(
+        self,
+        program: str,
+        returncode: int,
+        wall_time: float,
+        rusage: typing.Any,
+    ) -> None:
+        """Record the usage of one program, rusage is as returned by os.wait4."""
+        usage = ProcessUsage(
+            system=self._system,
+            program=program,
+            returncode=returncode,
+            wall_time=wall_time,
+            user_time=rusage.ru_utime if rusage else 0.0,
+            system_time=rusage.ru_stime if rusage else 0.0,
+            max_rss=rusage.ru_maxrss if rusage else 0,
+            blocks_read=rusage.ru_inblock if rusage else 0,
+            blocks_written=rusage.ru_oublock if rusage else 0,
+        )
+        assert self._records
+        self._records.append(usage._asdict())
+
+    def usages(self) -> typing.List[ProcessUsage]:
+        """Return the usage of all programs recorded so far, in any process."""
+        assert self._records
+        result: typing.List[ProcessUsage] = []
+        for record in self._records.read():
+            try:
+                result.append(ProcessUsage(**record))
+            except TypeError:
+                debug(f"Skipping broken usage record {record}.")
+        return result
+
+    @staticmethod
+    def print_summary(usages: typing.List[ProcessUsage]) -> None:
+        """Print tables of resource usage per program and per system."""
+        if not usages:
+            return
+
+        for title, key in (
+            ("program", lambda u: u.program),
+            ("system", lambda u: u.system or "<none>"),
+        ):
+            h2(f"Resource usage by {title}")
+            msg(
+                f"{title:<32} {'runs':>6} {'wall':>9} {'user':>9} {'sys':>9} "
+                f"{'max rss':>10} {'blk read':>10} {'blk write':>10}"
+            )
+            summary = summarize(usages, key)
+            for name in sorted(summary, key=lambda n: -summary[n].wall_time):
+                s = summary[name]
+                msg(
+                    f"{name:<32} {s.runs:>6} {s.wall_time:>8.1f}s "
+                    f"{s.user_time:>8.1f}s {s.system_time:>8.1f}s "
+                    f"{s.max_rss // 1024:>8}MiB {s.blocks_read:>10} "
+                    f"{s.blocks_written:>10}"
+                )
+
+    @staticmethod
+    def write_report(file_name: str, usages: typing.List[ProcessUsage]) -> None:
+        """Write usage data as JSON."""
+        data = {
+            "version": 1,
+            "processes": [u._asdict() for u in usages],
+            "programs": {
+                k: v._asdict()
+                for k, v in summarize(usages, lambda u: u.program).items()
+            },
+            "systems": {
+                k: v._asdict() for k, v in summarize(usages, lambda u: u.system).items()
+            },
+        }
+        tmp_file = f"{file_name}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f, indent=2)
+        os.rename(tmp_file, file_name)
+        trace(f'Wrote resource usage of {len(usages)} processes to "{file_name}".')
+
+
+def record_process(
+    program: str, returncode: int, wall_time: float, rusage: typing.Any
+) -> None:
+    """Record the usage of one program if resources are accounted for."""
+    accounting = ResourceAccounting._instance
+    if accounting:
+        accounting.record(program, returncode, wall_time, rusage)
+
+
+def set_system(system: str) -> None:
+    """Account following programs to system."""
+    accounting = ResourceAccounting._instance
+    if accounting:
+        accounting.set_system(system)
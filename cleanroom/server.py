@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""Serve build requests over a Unix socket.
+
+A long running server keeps commands, parse results and the work directory
+set up between builds. Clients send one request per connection and get the
+output of their build streamed back.
+
+The protocol uses one JSON object per line. Clients send a request:
+    {"systems": [...], "rebuild": [...], "ignore_errors": false}
+The server answers with any number of messages:
+    {"type": "queued", "position": <builds ahead of this one>}
+    {"type": "output", "text": "..."}
+and finishes with:
+    {"type": "done", "success": true|false, "message": "..."}
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from .exceptions import PreflightError
+from .printer import debug, error, h2, trace
+
+from contextlib import redirect_stdout
+import json
+import os
+import queue
+import socket
+import stat
+import sys
+import threading
+import typing
+
+
+class BuildRequest(typing.NamedTuple):
+    systems: typing.Tuple[str, ...]
+    rebuild: typing.Tuple[str, ...]
+    ignore_errors: bool
+
+
+def _parse_request(line: bytes) -> BuildRequest:
+    data = json.loads(line.decode("utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError("Request is not a JSON object.")
+
+    systems = data.get("systems", [])
+    rebuild = data.get("rebuild", [])
+    if not all(isinstance(s, str) for s in [*systems, *rebuild]):
+        raise ValueError("System names must be strings.")
+    if not systems and not rebuild:
+        raise ValueError("No systems to process.")
+
+    return BuildRequest(
+        systems=tuple(systems),
+        rebuild=tuple(rebuild),
+        ignore_errors=bool(data.get("ignore_errors", False)),
+    )
+
+
+def _remove_stale_socket(socket_path: str) -> None:
+    """Remove the socket of a server that is gone.
+
+    Raise a PreflightError if socket_path is anything else, e.g. the socket
+    of a server that is still running."""
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise PreflightError(f'"{socket_path}" exists and is not a socket.')
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            debug(f'Removing stale socket "{socket_path}".')
+            os.unlink(socket_path)
+            return
+    raise PreflightError(f'A build server is already running on "{socket_path}".')
+
+
+class _Connection:
+    """Send messages to one client, ignoring clients that went away."""
+
+    def __init__(self, connection: socket.socket) -> None:
+        self._connection = connection
+        self._lock = threading.Lock()
+        self._connected = True
+
+    def send(self, **message: typing.Any) -> None:
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with self._lock:
+            if not self._connected:
+                return
+            try:
+                self._connection.sendall(data)
+            except OSError:
+                debug("Client disconnected, discarding its output.")
+                self._connected = False
+
+    def close(self) -> None:
+        with self._lock:
+            self._connected = False
+            self._connection.close()
+
+
+class _OutputStream:
+    """File-like object forwarding everything written to a client."""
+
+    def __init__(self, connection: _Connection) -> None:
+        self._connection = connection
+
+    def write(self, text: str) -> int:
+        if text:
+            self._connection.send(type="output", text=text)
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+    def isatty(self) -> bool:
+        return False
+
+
+class _Job(typing.NamedTuple):
+    request: BuildRequest
+    connection: _Connection
+
+
+class BuildServer:
+    """Queue build requests from clients and run them one after another.
+
+    Builds share the work directory, so running them one at a time is what
+    makes it safe for several clients to use the same server."""
+
+    def __init__(
+        self,
+        socket_path: str,
+        build_function: typing.Callable[[BuildRequest], None],
+    ) -> None:
+        """Constructor."""
+        self._socket_path = socket_path
+        self._build_function = build_function
+        self._queue: queue.Queue[typing.Optional[_Job]] = queue.Queue()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        _remove_stale_socket(socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # bind creates the socket file, make sure it is never more than 0o660:
+        umask = os.umask(0o117)
+        try:
+            self._socket.bind(socket_path)
+        except OSError:
+            self._socket.close()
+            raise
+        finally:
+            os.umask(umask)
+        self._socket.listen()
+
+        self._running = True
+        self._worker = threading.Thread(target=self._process_jobs, daemon=True)
+
+    def serve_forever(self) -> None:
+        """Accept clients until shutdown is called."""
+        h2(f'Serving build requests on "{self._socket_path}"')
+        self._worker.start()
+        try:
+            while self._running:
+                try:
+                    (connection, _) = self._socket.accept()
+                except OSError:
+                    break  # Socket was closed by shutdown
+                threading.Thread(
+                    target=self._receive_request, args=(connection,), daemon=True
+                ).start()
+        finally:
+            self.shutdown()
+            self._worker.join()
+
+    def shutdown(self) -> None:
+        """Stop accepting clients and stop after the current build."""
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+
+    def _receive_request(self, raw_connection: socket.socket) -> None:
+        connection = _Connection(raw_connection)
+        try:
+            with raw_connection.makefile("rb") as f:
+                line = f.readline()
+            request = _parse_request(line)
+        except (OSError, ValueError) as e:
+            connection.send(type="done", success=False, message=f"Bad request: {e}")
+            connection.close()
+            return
+
+        with self._pending_lock:
+            position = self._pending
+            self._pending += 1
+        connection.send(type="queued", position=position)
+        self._queue.put(_Job(request=request, connection=connection))
+
+    def _process_jobs(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                self._run_job(job)
+            finally:
+                with self._pending_lock:
+                    self._pending -= 1
+                job.connection.close()
+
+        # Tell everybody still waiting that nothing is going to happen:
+        while not self._queue.empty():
+            job = self._queue.get()
+            if job is not None:
+                job.connection.send(
+                    type="done", success=False, message="Server shut down."
+                )
+                job.connection.close()
+
+    def _run_job(self, job: _Job) -> None:
+        current_directory = os.getcwd()
+        success = False
+        message = ""
+        try:
+            with redirect_stdout(_OutputStream(job.connection)):  # type: ignore
+                self._build_function(job.request)
+            success = True
+        except SystemExit as e:
+            message = f"Build exited with status {e.code}."
+        except Exception as e:
+            message = f"Build failed: {e}"
+        finally:
+            os.chdir(current_directory)
+
+        if message:
+            error(message)
+        trace(f"Build finished (success: {success}).")
+        job.connection.send(type="done", success=success, message=message)
+
+
+def request_build(
+    socket_path: str,
+    request: BuildRequest,
+    *,
+    output: typing.Optional[typing.TextIO] = None,
+) -> bool:
+    """Send a build request to a server and stream its output.
+
+    Returns whether the build succeeded."""
+    if output is None:
+        output = sys.stdout
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        data = {
+            "systems": list(request.systems),
+            "rebuild": list(request.rebuild),
+            "ignore_errors": request.ignore_errors,
+        }
+        connection.sendall((json.dumps(data) + "\n").encode("utf-8"))
+
+        with connection.makefile("rb") as f:
+            for line in f:
+                message = json.loads(line.decode("utf-8"))
+                message_type = message.get("type", "")
+                if message_type == "output":
+                    output.write(message.get("text", ""))
+                    output.flush()
+                elif message_type == "queued":
+                    position = message.get("position", 0)
+                    if position:
+                        output.write(f"Queued behind {position} other build(s).\n")
+                elif message_type == "done":
+                    if message.get("message", ""):
+                        output.write(message["message"] + "\n")
+                    return bool(message.get("success", False))
+
+    output.write("Connection to build server lost.\n")
+    return False
@@ -7,43 +7,50 @@
 from __future__ import annotations
 
 from .exceptions import GenerateError
-from .printer import error, debug, h2, trace
+from .printer import debug, h2, trace
 from .execobject import ExecObject
+from .systemstate import SystemState, load_system_state, store_system_state
 
+import functools
 import os
-import pickle
 import string
 import typing
 
 
-def _recursive_expand(system_context: SystemContext, arg: typing.Any) -> typing.Any:
-    result = arg
-    if isinstance(arg, str):
-        try:
-            count = 0
-            while True:
-                count += 1
-                old_result = result
-                result = string.Template(old_result).safe_substitute(
-                    system_context.substitutions
-                )
-                if result == old_result or count > 20:
-                    assert count <= 20
-                    break
+# Give up on expansions that do not settle after this many passes:
+_MAX_EXPANSION_PASSES = 20
+# Forget all expanded strings once this many are cached:
+_MAX_CACHED_EXPANSIONS = 10000
 
-        except ValueError as e:
-            error(f'Failed to expand string "{arg}": {e}')
+_Template = typing.Tuple[typing.Union[str, typing.Tuple[str, str]], ...]
 
-    return result
 
+@functools.lru_cache(maxsize=4096)
+def _compile_template(template: str) -> _Template:
+    """Split template into literal text and (key, original text) references.
 
-def _unpickle(pickle_jar: str) -> SystemContext:
-    """Create a new system_context by unpickling a file."""
-    with open(pickle_jar, "rb") as pj:
-        base_context = pickle.load(pj)
-    trace("Base context was unpickled.")
+    This matches exactly what string.Template.safe_substitute replaces."""
+    parts: typing.List[typing.Union[str, typing.Tuple[str, str]]] = []
+    literal = ""
+    pos = 0
+    for match in string.Template.pattern.finditer(template):
+        literal += template[pos : match.start()]
+        pos = match.end()
 
-    return base_context
+        key = match.group("named") or match.group("braced")
+        if key:
+            if literal:
+                parts.append(literal)
+                literal = ""
+            parts.append((key, match.group()))
+        elif match.group("escaped") is not None:
+            literal += "$"
+        else:
+            literal += match.group()
+    literal += template[pos:]
+    if literal:
+        parts.append(literal)
+    return tuple(parts)
 
 
 class SystemContext:
@@ -71,6 +78,7 @@ class SystemContext:
         self._repository_base_directory = repository_base_directory
         self._scratch_directory = scratch_directory
         self._systems_definition_directory = systems_definition_directory
+        self._storage_directory = storage_directory
         self._system_storage_directory = os.path.join(storage_directory, system_name)
         self._base_storage_directory = ""
 
@@ -82,16 +90,21 @@ class SystemContext:
             + f"          system-storage: {self._system_storage_directory} ..."
         )
 
-        self._base_context: typing.Optional[SystemContext] = None
+        self._base_context: typing.Optional[SystemState] = None
         self._hooks: typing.Dict[str, typing.List[ExecObject]] = {}
         self._hooks_that_already_ran: typing.List[str] = []
         self._substitutions: typing.MutableMapping[str, str] = {}
+        self._expanded_values: typing.Dict[str, str] = {}
+        self._value_dependents: typing.Dict[str, typing.Set[str]] = {}
+        self._expansions: typing.Dict[str, str] = {}
+        self._expansion_dependents: typing.Dict[str, typing.Set[str]] = {}
+        self._keys_being_expanded: typing.List[str] = []
 
         if base_system_name:
             self._base_storage_directory = os.path.join(
                 storage_directory, base_system_name
             )
-            self._install_base_context()
+            self._install_base_context(base_system_name)
 
         self._setup_core_substitutions()
 
@@ -177,13 +190,10 @@ class SystemContext:
         return self._base_storage_directory
 
     def __collect_bases(self) -> typing.List[str]:
-        bases: typing.List[str] = []
         base_context = self.base_context
-        while base_context:
-            bases.append(base_context.system_name)
-            base_context = base_context.base_context
-
-        return bases
+        if not base_context:
+            return []
+        return [base_context.system_name, *base_context.base_system_names]
 
     def _setup_core_substitutions(self) -> None:
         """Core substitutions that may not get overridden by base system."""
@@ -228,6 +238,7 @@ class SystemContext:
     def set_substitution(self, key: str, value: str) -> str:
         """Add a substitution to the substitution table."""
         self._substitutions[key] = value
+        self._invalidate_expansions(key)
         trace(f'Added substitution: "{key}"="{value}".')
         return value
 
@@ -256,7 +267,99 @@ class SystemContext:
             print(f'"{k}"="{v}"')
 
     def expand(self, input: str) -> str:
-        return _recursive_expand(self, input)
+        if not isinstance(input, str) or "$" not in input:
+            return input
+
+        result = self._expansions.get(input, None)
+        if result is None:
+            dependencies: typing.Set[str] = set()
+            result = self._expand_string(input, dependencies)
+
+            if len(self._expansions) >= _MAX_CACHED_EXPANSIONS:
+                self._expansions.clear()
+                self._expansion_dependents.clear()
+            self._expansions[input] = result
+            for key in dependencies:
+                self._expansion_dependents.setdefault(key, set()).add(input)
+        return result
+
+    # Substitution engine:
+    #  * Templates are compiled once (see _compile_template).
+    #  * The expanded value of each key is cached in _expanded_values, as are
+    #    expanded strings in _expansions.
+    #  * _value_dependents and _expansion_dependents map keys to the keys and
+    #    strings whose expansion referenced them, so that changing a key only
+    #    drops what depends on it (even if the key was unknown before).
+    def _clear_expansion_cache(self) -> None:
+        # Reassigned, not cleared: The caches are not pickled (see __getstate__).
+        self._expanded_values = {}
+        self._value_dependents = {}
+        self._expansions = {}
+        self._expansion_dependents = {}
+        self._keys_being_expanded = []
+
+    def _invalidate_expansions(self, key: str) -> None:
+        to_invalidate = [key]
+        invalidated: typing.Set[str] = set()
+        while to_invalidate:
+            k = to_invalidate.pop()
+            if k in invalidated:
+                continue
+            invalidated.add(k)
+
+            self._expanded_values.pop(k, None)
+            for expansion in self._expansion_dependents.pop(k, set()):
+                self._expansions.pop(expansion, None)
+            to_invalidate += self._value_dependents.pop(k, set())
+
+    def _expanded_value(self, key: str) -> str:
+        result = self._expanded_values.get(key, None)
+        if result is not None:
+            return result
+
+        if key in self._keys_being_expanded:
+            cycle = " -> ".join([*self._keys_being_expanded, key])
+            raise GenerateError(f"Substitution cycle detected: {cycle}.")
+
+        self._keys_being_expanded.append(key)
+        try:
+            dependencies: typing.Set[str] = set()
+            result = self._expand_string(str(self._substitutions[key]), dependencies)
+        finally:
+            self._keys_being_expanded.pop()
+
+        self._expanded_values[key] = result
+        for k in dependencies:
+            self._value_dependents.setdefault(k, set()).add(key)
+        return result
+
+    def _expand_string(self, value: str, dependencies: typing.Set[str]) -> str:
+        # Expand repeatedly, just like string.Template.safe_substitute would
+        # need to: "$$" turns into "$", which might start a new reference.
+        result = value
+        for _ in range(_MAX_EXPANSION_PASSES):
+            if "$" not in result:
+                return result
+
+            parts: typing.List[str] = []
+            for part in _compile_template(result):
+                if isinstance(part, str):
+                    parts.append(part)
+                    continue
+                (key, text) = part
+                dependencies.add(key)
+                parts.append(
+                    self._expanded_value(key) if key in self._substitutions else text
+                )
+
+            old_result = result
+            result = "".join(parts)
+            if result == old_result:
+                return result
+
+        raise GenerateError(
+            f'Expanding "{value}" did not finish after {_MAX_EXPANSION_PASSES} passes.'
+        )
 
     def has_substitution(self, key: str) -> bool:
         """Check wether a substitution is defined."""
@@ -271,32 +374,60 @@ class SystemContext:
         return result
 
     @property
-    def base_context(self) -> typing.Optional[SystemContext]:
+    def base_context(self) -> typing.Optional[SystemState]:
         return self._base_context
 
     # Store/Restore a system:
-    def _install_base_context(self) -> None:
+    def _install_base_context(self, base_system_name: str) -> None:
         """Set up base context."""
-        base_context = _unpickle(
-            os.path.join(self.base_storage_directory, "meta", "pickle_jar.bin")
-        )
+        base_context = load_system_state(self._storage_directory, base_system_name)
 
         self._base_context = base_context
-        self._timestamp = base_context._timestamp
-        self._hooks = base_context._hooks
-        self._substitutions = base_context._substitutions
-
-    def pickle(self) -> None:
-        """Pickle this system_context."""
-        pickle_jar = os.path.join(self.meta_directory, "pickle_jar.bin")
-
-        # Remember stuff that should not get saved:
-        hooks_that_ran = self._hooks_that_already_ran
-        self._hooks_that_already_ran = []
-
-        trace(f"Pickling system_context into {pickle_jar}.")
-        with open(pickle_jar, "wb") as pj:
-            pickle.dump(self, pj)
-
-        # Restore state that should not get saved:
-        self._hooks_that_already_ran = hooks_that_ran
+        self._timestamp = base_context.timestamp
+        self._hooks = base_context.hooks
+        self._substitutions = base_context.substitutions
+        self._clear_expansion_cache()
+
+    def checkpoint_state(self) -> typing.Dict[str, typing.Any]:
+        """Return the state that commands may change while running."""
+        return {
+            "target_distribution": self._target_distribution,
+            "hooks": self._hooks,
+            "hooks_that_already_ran": self._hooks_that_already_ran,
+            "substitutions": self._substitutions,
+        }
+
+    def restore_checkpoint_state(self, state: typing.Dict[str, typing.Any]) -> None:
+        """Restore state returned by checkpoint_state."""
+        self._target_distribution = state["target_distribution"]
+        self._hooks = state["hooks"]
+        self._hooks_that_already_ran = state["hooks_that_already_ran"]
+        self._substitutions = state["substitutions"]
+        self._clear_expansion_cache()
+
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        state = self.__dict__.copy()
+        for cache in (
+            "_expanded_values",
+            "_value_dependents",
+            "_expansions",
+            "_expansion_dependents",
+            "_keys_being_expanded",
+        ):
+            del state[cache]
+        return state
+
+    def __setstate__(self, state: typing.Dict[str, typing.Any]) -> None:
+        self.__dict__.update(state)
+        self._clear_expansion_cache()
+
+    def store_state(self) -> None:
+        """Store the state systems based on this one need."""
+        store_system_state(
+            self.meta_directory,
+            system_name=self.system_name,
+            timestamp=self.timestamp,
+            base_system_names=self.__collect_bases(),
+            hooks=self._hooks,
+            substitutions=self._substitutions,
+        )
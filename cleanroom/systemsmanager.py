@@ -10,8 +10,9 @@ from .commandmanager import CommandManager
 from .exceptions import ParseError, SystemNotFoundError
 from .execobject import ExecObject
 from .location import Location
+from .parsecache import ParseCache, ParseResult
 from .parser import Parser
-from .printer import debug, info, trace, verbose
+from .printer import debug, info, trace, verbose, warn
 
 import os
 import os.path
@@ -87,6 +88,77 @@ class _DependencyNode(object):
         self.children.append(child)
 
 
+def parse_system_definition_file(
+    command_manager: CommandManager,
+    system_file: str,
+    *,
+    parse_cache: typing.Optional[ParseCache] = None,
+    fast_parser: bool = False,
+) -> ParseResult:
+    """Parse a system definition file, using the parse cache if one is given."""
+    key = ""
+    if parse_cache:
+        (key, cached_result) = parse_cache.get(system_file)
+        if cached_result is not None:
+            return cached_result
+
+    result = Parser(command_manager, fast_parser=fast_parser).parse(system_file)
+    if parse_cache:
+        parse_cache.put(key, result)
+    return result
+
+
+def reverse_dependencies(
+    command_manager: CommandManager,
+    systems_definition_directory: str,
+    *,
+    parse_cache: typing.Optional[ParseCache] = None,
+    fast_parser: bool = False,
+) -> typing.Dict[str, typing.List[str]]:
+    """Map every system in the definition directory to the systems based on it.
+
+    Systems that fail to parse are reported and left out of the graph."""
+    result: typing.Dict[str, typing.List[str]] = {}
+    for f in sorted(os.listdir(systems_definition_directory)):
+        if not f.endswith(".def"):
+            continue
+        system_file = os.path.join(systems_definition_directory, f)
+        if not os.path.isfile(system_file):
+            continue
+        try:
+            (base_system_name, _, _) = parse_system_definition_file(
+                command_manager,
+                system_file,
+                parse_cache=parse_cache,
+                fast_parser=fast_parser,
+            )
+        except ParseError as e:
+            warn(f'Ignoring "{system_file}" for dependency scan: {e}')
+            continue
+
+        system_name = f[:-4]
+        result.setdefault(system_name, [])
+        if base_system_name and base_system_name != "scratch":
+            result.setdefault(base_system_name, []).append(system_name)
+
+    return result
+
+
+def affected_systems(
+    reverse_dependency_map: typing.Dict[str, typing.List[str]], *systems: str
+) -> typing.List[str]:
+    """Return the systems and all systems (indirectly) based on them."""
+    result: typing.List[str] = []
+    to_visit = [s[:-4] if s.endswith(".def") else s for s in systems]
+    while to_visit:
+        system = to_visit.pop(0)
+        if system in result:
+            continue
+        result.append(system)
+        to_visit += reverse_dependency_map.get(system, [])
+    return result
+
+
 class SystemsManager(object):
     """Drives the generation of systems."""
 
@@ -95,9 +167,13 @@ class SystemsManager(object):
         command_manager: CommandManager,
         systems_definition_directory: str,
         *systems: str,
+        parse_cache: typing.Optional[ParseCache] = None,
+        fast_parser: bool = False,
     ) -> None:
         """Constructor."""
         self._command_manager = command_manager
+        self._parse_cache = parse_cache
+        self._fast_parser = fast_parser
         assert systems_definition_directory
         self._systems_definition_directory = systems_definition_directory
         self._systems_forest: typing.List[_DependencyNode] = []
@@ -200,9 +276,15 @@ class SystemsManager(object):
         self, system_file: str
     ) -> typing.Tuple[str, str, typing.List[ExecObject]]:
         debug(f'Parsing "{system_file}".')
-        system_parser = Parser(self._command_manager)
-        (base_system_name, target_distribution, exec_obj_list) = system_parser.parse(
-            system_file
+        (
+            base_system_name,
+            target_distribution,
+            exec_obj_list,
+        ) = parse_system_definition_file(
+            self._command_manager,
+            system_file,
+            parse_cache=self._parse_cache,
+            fast_parser=self._fast_parser,
         )
         if not base_system_name:
             raise ParseError(f'No base system was provided in "{system_file}".')
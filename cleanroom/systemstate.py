@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Store the state of a system context after the system was built.
+
+Systems based on a system need its hooks and substitutions. These are
+stored flat in the meta directory of the system: A system only refers to
+its base system by name, so loading a system state never needs to load the
+states of its base systems. Those get loaded on demand.
+
+The state only holds builtin types, so it stays readable when classes in
+cleanroom change.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from __future__ import annotations
+
+from .exceptions import GenerateError
+from .execobject import ExecObject
+from .location import Location
+from .printer import trace
+
+import os
+import os.path
+import pickle
+import typing
+
+
+# Bump this whenever the state changes in an incompatible way:
+_FORMAT_VERSION = 1
+
+STATE_FILE = "system_state.bin"
+# Written by older versions of cleanroom:
+_LEGACY_STATE_FILE = "pickle_jar.bin"
+
+
+def _location_to_data(location: Location) -> typing.Dict[str, typing.Any]:
+    return {
+        "file_name": location.file_name,
+        "line_number": location.line_number,
+        "description": location.description,
+        "parent": _location_to_data(location.parent) if location.parent else None,
+    }
+
+
+def _location_from_data(data: typing.Dict[str, typing.Any]) -> Location:
+    return Location(
+        file_name=data["file_name"],
+        line_number=data["line_number"],
+        description=data["description"],
+        parent=_location_from_data(data["parent"]) if data["parent"] else None,
+    )
+
+
+def _hooks_to_data(
+    hooks: typing.Mapping[str, typing.Sequence[ExecObject]]
+) -> typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]]:
+    return {
+        name: [
+            {
+                "location": _location_to_data(e.location),
+                "command": e.command,
+                "args": list(e.args),
+                "kwargs": dict(e.kwargs),
+            }
+            for e in exec_objects
+        ]
+        for name, exec_objects in hooks.items()
+    }
+
+
+def _hooks_from_data(
+    data: typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]]
+) -> typing.Dict[str, typing.List[ExecObject]]:
+    return {
+        name: [
+            ExecObject(
+                location=_location_from_data(e["location"]),
+                command=e["command"],
+                args=tuple(e["args"]),
+                kwargs=dict(e["kwargs"]),
+            )
+            for e in exec_objects
+        ]
+        for name, exec_objects in data.items()
+    }
+
+
+class SystemState:
+    """The state of a system context, as it was when the system was built."""
+
+    def __init__(
+        self,
+        *,
+        system_name: str,
+        storage_directory: str,
+        timestamp: str,
+        base_system_names: typing.Sequence[str],
+        hooks: typing.Dict[str, typing.List[ExecObject]],
+        substitutions: typing.Dict[str, str],
+    ) -> None:
+        """Constructor.
+
+        base_system_names lists the base system first, then its base system
+        and so on."""
+        self._system_name = system_name
+        self._storage_directory = storage_directory
+        self._timestamp = timestamp
+        self._base_system_names = list(base_system_names)
+        self._hooks = hooks
+        self._substitutions = substitutions
+        self._base_context: typing.Optional[SystemState] = None
+
+    @property
+    def system_name(self) -> str:
+        return self._system_name
+
+    @property
+    def timestamp(self) -> str:
+        return self._timestamp
+
+    @property
+    def base_system_names(self) -> typing.List[str]:
+        return self._base_system_names
+
+    @property
+    def hooks(self) -> typing.Dict[str, typing.List[ExecObject]]:
+        return self._hooks
+
+    @property
+    def substitutions(self) -> typing.Dict[str, str]:
+        return self._substitutions
+
+    @property
+    def base_context(self) -> typing.Optional[SystemState]:
+        """The state of the base system, loaded on first use."""
+        if self._base_context is None and self._base_system_names:
+            self._base_context = load_system_state(
+                self._storage_directory, self._base_system_names[0]
+            )
+        return self._base_context
+
+
+def _load_legacy_state(
+    storage_directory: str, system_name: str, file_name: str
+) -> SystemState:
+    with open(file_name, "rb") as f:
+        system_context = pickle.load(f)
+
+    base_system_names: typing.List[str] = []
+    base_context = system_context.base_context
+    while base_context:
+        base_system_names.append(base_context.system_name)
+        base_context = base_context.base_context
+
+    return SystemState(
+        system_name=system_name,
+        storage_directory=storage_directory,
+        timestamp=system_context.timestamp,
+        base_system_names=base_system_names,
+        hooks=dict(system_context._hooks),
+        substitutions=dict(system_context._substitutions),
+    )
+
+
+def load_system_state(storage_directory: str, system_name: str) -> SystemState:
+    """Load the state of system_name from its directory in storage_directory."""
+    meta_directory = os.path.join(storage_directory, system_name, "meta")
+    file_name = os.path.join(meta_directory, STATE_FILE)
+
+    if not os.path.isfile(file_name):
+        legacy_file_name = os.path.join(meta_directory, _LEGACY_STATE_FILE)
+        if os.path.isfile(legacy_file_name):
+            trace(f'Loading legacy state of "{system_name}".')
+            return _load_legacy_state(storage_directory, system_name, legacy_file_name)
+        raise GenerateError(f'No stored state found for system "{system_name}".')
+
+    with open(file_name, "rb") as f:
+        data = pickle.load(f)
+    if data.get("version", 0) != _FORMAT_VERSION:
+        raise GenerateError(
+            f'State of system "{system_name}" has unsupported version '
+            f'{data.get("version", 0)}, please rebuild it.'
+        )
+    trace(f'Loaded state of "{system_name}".')
+
+    return SystemState(
+        system_name=data["system_name"],
+        storage_directory=storage_directory,
+        timestamp=data["timestamp"],
+        base_system_names=data["base_system_names"],
+        hooks=_hooks_from_data(data["hooks"]),
+        substitutions=data["substitutions"],
+    )
+
+
+def store_system_state(
+    meta_directory: str,
+    *,
+    system_name: str,
+    timestamp: str,
+    base_system_names: typing.Sequence[str],
+    hooks: typing.Mapping[str, typing.Sequence[ExecObject]],
+    substitutions: typing.Mapping[str, str],
+) -> None:
+    """Store the state of a system into its meta directory."""
+    file_name = os.path.join(meta_directory, STATE_FILE)
+    data = {
+        "version": _FORMAT_VERSION,
+        "system_name": system_name,
+        "timestamp": timestamp,
+        "base_system_names": list(base_system_names),
+        "hooks": _hooks_to_data(hooks),
+        "substitutions": dict(substitutions),
+    }
+
+    trace(f'Storing state of "{system_name}" into {file_name}.')
+    tmp_file = f"{file_name}.tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump(data, f)
+    os.rename(tmp_file, file_name)
+
+    # Do not leave a state behind that a base system might have written:
+    legacy_file_name = os.path.join(meta_directory, _LEGACY_STATE_FILE)
+    if os.path.exists(legacy_file_name):
+        os.unlink(legacy_file_name)
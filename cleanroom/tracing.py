@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Record how long things take in the Chrome trace event format.
+
+The resulting file can be loaded into chrome://tracing or ui.perfetto.dev.
+
+Events are appended to one part file per process as they complete, so that
+events recorded in forked worker processes are not lost. The part files
+are merged into the trace file once the build is done.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+from __future__ import annotations
+
+from .printer import trace
+from .processrecords import ProcessRecords
+
+import json
+import os
+import threading
+import time
+import typing
+
+
+def _resolve(value: typing.Any) -> typing.Any:
+    value = value() if callable(value) else value
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_resolve(v) for v in value]
+    return str(value)
+
+
+def _now() -> int:
+    return time.monotonic_ns() // 1000
+
+
+class _Span:
+    """Record one complete event when leaving the with block."""
+
+    def __init__(
+        self,
+        tracer: Tracer,
+        name: str,
+        category: str,
+        args: typing.Dict[str, typing.Any],
+    ) -> None:
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self.args = args
+        self._start = 0
+
+    def __enter__(self) -> typing.Dict[str, typing.Any]:
+        self.args = {k: _resolve(v) for k, v in self.args.items()}
+        self._start = _now()
+        return self.args
+
+    def __exit__(self, exc_type: typing.Any, exc_val: typing.Any, exc_tb: typing.Any):
+        end = _now()
+        if exc_type is not None:
+            self.args["error"] = str(exc_val) if exc_val else exc_type.__name__
+        self._tracer.add_event(
+            {
+                "name": self._name,
+                "cat": self._category,
+                "ph": "X",
+                "ts": self._start,
+                "dur": end - self._start,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": {k: _resolve(v) for k, v in self.args.items()},
+            }
+        )
+        return False
+
+
+class _NoSpan:
+    """Do nothing when not tracing."""
+
+    def __enter__(self) -> typing.Dict[str, typing.Any]:
+        return {}
+
+    def __exit__(self, exc_type: typing.Any, exc_val: typing.Any, exc_tb: typing.Any):
+        return False
+
+
+class Tracer:
+    """Collect trace events and write them into a trace file."""
+
+    _instance: typing.Optional[Tracer] = None
+
+    @staticmethod
+    def instance() -> typing.Optional[Tracer]:
+        """Get the active tracer, if any."""
+        return Tracer._instance
+
+    def __init__(self, file_name: str) -> None:
+        """Constructor."""
+        self._file_name = os.path.abspath(file_name)
+        self._records = ProcessRecords(
+            os.path.dirname(self._file_name), os.path.basename(self._file_name) + "."
+        )
+        self._records.remove()  # Left over from an earlier, crashed run
+
+    def __enter__(self) -> Tracer:
+        Tracer._instance = self
+        return self
+
+    def __exit__(self, exc_type: typing.Any, exc_val: typing.Any, exc_tb: typing.Any):
+        Tracer._instance = None
+        self.write()
+        return False
+
+    def add_event(self, event: typing.Dict[str, typing.Any]) -> None:
+        self._records.append(event)
+
+    def write(self) -> None:
+        """Merge the events of all processes into the trace file."""
+        events = self._records.read()
+        self._records.remove()
+
+        events.sort(key=lambda e: (e["ts"], -e["dur"]))
+        tmp_file = f"{self._file_name}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.rename(tmp_file, self._file_name)
+        trace(f'Wrote {len(events)} trace events to "{self._file_name}".')
+
+
+def span(name: str, category: str, **args: typing.Any) -> typing.Any:
+    """Record the with block using this as a span.
+
+    The with block gets the args dictionary and may add to it, e.g. an exit
+    code. Arguments that are callable only get called when tracing, right
+    when entering the with block."""
+    tracer = Tracer._instance
+    if tracer is None:
+        return _NoSpan()
+    return _Span(tracer, name, category, args)
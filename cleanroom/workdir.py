@@ -1,78 +1,201 @@
 # -*- coding: utf-8 -*-
 """Create and manage the work directory.
 
+Scratch directories that are no longer needed get moved into the trash
+directory of the work directory and are deleted by a background thread
+while the next system is already being built.
+
 @author: Tobias Hunger <tobias.hunger@gmail.com>
 """
 
 from .exceptions import PreflightError
-from .helper.btrfs import BtrfsHelper
 from .helper.mount import umount_all
+from .helper.storage import StorageBackend
 from .printer import debug, info, trace
 
+import itertools
 import os
 import os.path
 import tempfile
+import threading
 import typing
 
 
-def _ensure_directory(directory: str, btrfs_helper: BtrfsHelper) -> None:
+_VOLUMES = ("fs", "meta", "boot", "cache")
+_trash_counter = itertools.count()
+
+
+def storage_path(work_directory: str) -> str:
+    """Get the storage directory of a work directory."""
+    return os.path.join(work_directory, "storage")
+
+
+def build_times_path(work_directory: str) -> str:
+    """Get the file holding build durations of a work directory."""
+    return os.path.join(work_directory, "build_times.json")
+
+
+def trash_path(work_directory: str) -> str:
+    """Get the directory holding the things to delete in the background."""
+    return os.path.join(work_directory, ".trash")
+
+
+def move_to_trash(directory: str, storage: StorageBackend) -> bool:
+    """Move a scratch directory into the trash of its work directory.
+
+    Returns False if the directory was not moved, e.g. because it does not
+    exist, is a mount point or is not in a work directory. It is up to the
+    caller to delete it then."""
+    trash = trash_path(os.path.dirname(os.path.abspath(directory)))
+    if not os.path.isdir(trash) or not os.path.isdir(directory):
+        return False
+    if os.path.ismount(directory):
+        return False
+
+    umount_all(directory)
+    target = os.path.join(
+        trash,
+        f"{os.path.basename(directory)}.{os.getpid()}.{next(_trash_counter)}",
+    )
+    trace(f"Moving {directory} to {target}.")
+    try:
+        os.rename(directory, target)
+    except OSError as e:
+        debug(f"Failed to move {directory} into the trash: {e}.")
+        return False
+    return True
+
+
+def _ensure_directory(
+    directory: str, storage: StorageBackend, *, scratch: bool = False
+) -> None:
     if not os.path.isdir(directory):
-        btrfs_helper.create_subvolume(directory)
-        btrfs_helper.set_property(directory, name="compression", value="none")
+        if scratch:
+            storage.create_scratch(directory)
+        else:
+            storage.create_volume(directory, compress=False)
         if not os.path.isdir(directory):
             raise PreflightError(
                 f"Failed to set up work directory: {directory} not created."
             )
 
 
-def _clear_directory(directory: str, btrfs_helper: BtrfsHelper) -> None:
+def _clear_directory(directory: str, storage: StorageBackend) -> None:
     trace(f"Cleaning directory: {directory}.")
     umount_all(directory)
 
     if os.path.isdir(directory):
         # Fast path:-)
-        btrfs_helper.delete_subvolume(os.path.join(directory, "fs"))
-        btrfs_helper.delete_subvolume(os.path.join(directory, "meta"))
-        btrfs_helper.delete_subvolume(os.path.join(directory, "cache"))
-        btrfs_helper.delete_subvolume(directory)
+        volumes = [os.path.join(directory, v) for v in _VOLUMES]
+        storage.delete_volumes(
+            [v for v in volumes if storage.is_volume(v)] + [directory]
+        )
 
         # Slow fallback path:
         if not os.path.isdir(directory):
             return
-        btrfs_helper.delete_subvolume_recursive(directory)
+        storage.delete_volume_recursive(directory)
         if os.path.isdir(directory):
             os.rmdir(directory)
 
 
+def _find_scratch_directories(work_directory: str) -> typing.List[str]:
+    """Find the scratch directories of all worker slots in the work directory."""
+    result: typing.List[str] = []
+    with os.scandir(work_directory) as it:
+        for entry in it:
+            if entry.is_dir() and (
+                entry.name == "scratch" or entry.name.startswith("scratch-")
+            ):
+                result.append(entry.path)
+    return sorted(result)
+
+
+class _Reclaimer:
+    """Delete everything in a trash directory in a background thread.
+
+    Only the process that created the reclaimer runs the thread, forked
+    workers just move their scratch directories into the trash. They never
+    touch the lock of the reclaimer, so forking does not need to wait for
+    a deletion to finish."""
+
+    def __init__(self, storage: StorageBackend, trash_directory: str) -> None:
+        self._storage = storage
+        self._trash_directory = trash_directory
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._requested = False
+
+    def reclaim(self) -> None:
+        """Delete everything in the trash directory in the background."""
+        if os.getpid() != self._pid:
+            return
+        with self._lock:
+            self._requested = True
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="clrm-reclaim", daemon=True
+                )
+                self._thread.start()
+
+    def wait(self) -> None:
+        """Wait for the background thread to finish."""
+        if os.getpid() != self._pid:
+            return
+        with self._lock:
+            thread = self._thread
+        if thread:
+            thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._requested:
+                    self._thread = None
+                    return
+                self._requested = False
+
+            with os.scandir(self._trash_directory) as it:
+                entries = [e.path for e in it if e.is_dir(follow_symlinks=False)]
+            for entry in entries:
+                try:
+                    _clear_directory(entry, self._storage)
+                except Exception as e:
+                    debug(f"Failed to reclaim {entry}: {e}.")
+
+
 class WorkDir:
     """Parse a container.conf file."""
 
     def __init__(
         self,
-        btrfs_helper: BtrfsHelper,
+        storage: StorageBackend,
         *,
         work_directory: str,
         clear_scratch_directory: bool = False,
         clear_storage: bool = False,
     ) -> None:
         """Constructor."""
-        self._btrfs_helper = btrfs_helper
+        self._storage = storage
         self._work_directory = work_directory
         self._temp_directory: typing.Optional[tempfile.TemporaryDirectory[str]] = None
+        self._reclaimer: typing.Optional[_Reclaimer] = None
 
         if work_directory:
             if not os.path.exists(work_directory):
                 trace(f'Creating permanent work directory in "{work_directory}".')
                 os.makedirs(work_directory, 0o700)
             else:
-                if not btrfs_helper.is_btrfs_filesystem(work_directory):
+                if not storage.is_supported(work_directory):
                     raise PreflightError(
-                        f'"{self.work_directory}" is not on a btrfs filesystem.'
+                        f'"{self.work_directory}" does not support the '
+                        f"{storage.name} storage backend."
                     )
 
                 trace(f'Using existing work directory in "{work_directory}".')
-                if os.path.isdir(os.path.join(work_directory, "scratch")):
-                    if not umount_all(os.path.join(work_directory, "scratch")):
+                for scratch in _find_scratch_directories(work_directory):
+                    if not umount_all(scratch):
                         raise PreflightError(
                             f'Failed to umount all in work directory "{work_directory}".'
                         )
@@ -82,7 +205,8 @@ class WorkDir:
                             f'Failed to umount all in work directory "{work_directory}".'
                         )
                 if clear_scratch_directory:
-                    self.clear_scratch_directory()
+                    for scratch in _find_scratch_directories(work_directory):
+                        _clear_directory(scratch, self._storage)
                 if clear_storage:
                     self.clear_storage_directory()
         else:
@@ -106,6 +230,8 @@ class WorkDir:
 
     def __exit__(self, exc_type: typing.Any, exc_val: typing.Any, exc_tb: typing.Any):
         """Exit a context."""
+        self._clear_scratch_directories()
+        self.finish_reclaim()
         if self._temp_directory:
             tmp_directory = self._temp_directory
             self._temp_directory = None
@@ -116,6 +242,8 @@ class WorkDir:
     def cleanup(self) -> None:
         """Clean up the work directory (if necessary)."""
         if self._temp_directory:
+            self._clear_scratch_directories()
+            self.finish_reclaim()
             self._temp_directory.cleanup()
             self._temp_directory = None
 
@@ -124,14 +252,69 @@ class WorkDir:
         """Get the system directory."""
         return os.path.join(self._work_directory, "scratch")
 
-    def clear_scratch_directory(self) -> None:
-        _clear_directory(self.scratch_directory, self._btrfs_helper)
-        _ensure_directory(self.scratch_directory, self._btrfs_helper)
+    def worker_scratch_directory(self, slot: int) -> str:
+        """Get the scratch directory of a worker slot.
+
+        Slot 0 is the normal scratch directory, all other slots get their
+        own "scratch-<slot>" subvolume next to it."""
+        assert slot >= 0
+        if slot == 0:
+            return self.scratch_directory
+        return os.path.join(self._work_directory, f"scratch-{slot}")
+
+    def _clear_scratch_directories(self) -> None:
+        """Unmount and delete the scratch directories of all slots.
+
+        Scratch directories in memory are mounted when building into them,
+        possibly by forked workers, so look at the work directory to find
+        them all."""
+        for scratch in _find_scratch_directories(self._work_directory):
+            _clear_directory(scratch, self._storage)
+
+    def clear_scratch_directory(self, slot: int = 0) -> None:
+        """Provide an empty scratch directory for a worker slot.
+
+        The old scratch directory is moved into the trash and deleted in
+        the background where possible."""
+        scratch_directory = self.worker_scratch_directory(slot)
+        if not move_to_trash(scratch_directory, self._storage):
+            _clear_directory(scratch_directory, self._storage)
+        _ensure_directory(scratch_directory, self._storage, scratch=True)
+        self.reclaim()  # e.g. the scratch directory of the last system
+
+    @property
+    def trash_directory(self) -> str:
+        """Get the directory holding things to delete in the background."""
+        return trash_path(self._work_directory)
+
+    def reclaim(self) -> None:
+        """Start deleting everything in the trash directory in the background.
+
+        Does nothing in forked worker processes."""
+        if self._reclaimer:
+            self._reclaimer.reclaim()
+
+    def finish_reclaim(self) -> None:
+        """Delete everything in the trash directory and wait for that."""
+        if self._reclaimer:
+            self._reclaimer.reclaim()
+            self._reclaimer.wait()
 
     @property
     def storage_directory(self) -> str:
         """Get the storage directory."""
-        return os.path.join(self._work_directory, "storage")
+        return storage_path(self._work_directory)
+
+    @property
+    def build_times_file(self) -> str:
+        """Get the file holding the durations of previous builds."""
+        return build_times_path(self._work_directory)
+
+    def clear_system_storage(self, system_name: str) -> None:
+        """Remove one system from storage."""
+        system_storage = os.path.join(self.storage_directory, system_name)
+        if os.path.isdir(system_storage):
+            _clear_directory(system_storage, self._storage)
 
     def clear_storage_directory(self) -> None:
         # Trigger fast-path on storage directories:
@@ -140,10 +323,15 @@ class WorkDir:
         with os.scandir(self.storage_directory) as it:
             for entry in it:
                 if entry.is_dir():
-                    _clear_directory(entry.path, self._btrfs_helper)
+                    _clear_directory(entry.path, self._storage)
 
         # slow path:
-        _clear_directory(self.storage_directory, self._btrfs_helper)
+        _clear_directory(self.storage_directory, self._storage)
+
+    @property
+    def checkpoint_directory(self) -> str:
+        """Get the directory holding command checkpoints."""
+        return os.path.join(self._work_directory, "checkpoints")
 
     @property
     def work_directory(self) -> str:
@@ -151,8 +339,12 @@ class WorkDir:
         return self._work_directory
 
     def _setup_work_directory(self) -> None:
-        _ensure_directory(self.storage_directory, self._btrfs_helper)
-        _ensure_directory(self.scratch_directory, self._btrfs_helper)
+        _ensure_directory(self.storage_directory, self._storage)
+        # The scratch gets mounted (when in memory) in the namespace of a build:
+        _ensure_directory(self.scratch_directory, self._storage)
+        os.makedirs(self.trash_directory, exist_ok=True)
+        self._reclaimer = _Reclaimer(self._storage, self.trash_directory)
+        self.reclaim()  # Left behind by an earlier run
 
         info(f'WorkDir: work directory     = "{self.work_directory}".')
         debug(f'WorkDir: scratch directory  = "{self.scratch_directory}".')
@@ -6,6 +6,7 @@
 
 import pytest  # type: ignore
 import types
+import typing
 
 import os
 import sys
@@ -81,7 +82,7 @@ class DummyCommand(Command):
     pass
 
 
-_Parser_Instance = None
+_Parser_Instances: typing.Dict[bool, Parser] = {}
 
 
 @pytest.fixture
@@ -110,9 +111,9 @@ def _parse_and_verify_string(parser, data, expected_base_system, expected):
     assert result == expected
 
 
-def _create_and_setup_parser(command_manager: CommandManager):
+def _create_and_setup_parser(command_manager: CommandManager, fast_parser: bool):
     """Set up method."""
-    result = Parser(command_manager, debug_parser=True)
+    result = Parser(command_manager, debug_parser=True, fast_parser=fast_parser)
 
     # inject for easier testing:
     result.parse_and_verify_string = types.MethodType(_parse_and_verify_string, result)
@@ -120,13 +121,15 @@ def _create_and_setup_parser(command_manager: CommandManager):
     return result
 
 
-@pytest.fixture()
-def parser(command_manager):
+@pytest.fixture(params=[False, True], ids=["pyparsing", "fast"])
+def parser(request, command_manager):
     """Return a parser."""
-    global _Parser_Instance
-    if _Parser_Instance is None:
-        _Parser_Instance = _create_and_setup_parser(command_manager)
-    return _Parser_Instance
+    fast_parser = request.param
+    if fast_parser not in _Parser_Instances:
+        _Parser_Instances[fast_parser] = _create_and_setup_parser(
+            command_manager, fast_parser
+        )
+    return _Parser_Instances[fast_parser]
 
 
 @pytest.fixture()
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+"""Test for the cache keys of systems in storage.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.buildcache import (
+    CacheState,
+    cache_state,
+    command_set_digest,
+    system_cache_key,
+    write_cache_key,
+)
+from cleanroom.execobject import ExecObject
+from cleanroom.location import Location
+
+
+def _exec_obj(command, *args, line_number=1, **kwargs):
+    return ExecObject(
+        location=Location(file_name="<test>", line_number=line_number),
+        command=command,
+        args=args,
+        kwargs=kwargs,
+    )
+
+
+def _key(definitions, exec_obj_list, *, base_cache_key="", command_digest="cmds"):
+    return system_cache_key(
+        system_name="system-test",
+        exec_obj_list=exec_obj_list,
+        systems_definition_directory=str(definitions),
+        command_digest=command_digest,
+        base_cache_key=base_cache_key,
+    )
+
+
+def test_cache_key_is_stable(tmpdir):
+    commands = [_exec_obj("based_on", "scratch"), _exec_obj("set", "A", "b")]
+    assert _key(tmpdir, commands) == _key(tmpdir, list(commands))
+
+
+def test_cache_key_ignores_locations(tmpdir):
+    first = [_exec_obj("set", "A", "b", line_number=1)]
+    second = [_exec_obj("set", "A", "b", line_number=12)]
+    assert _key(tmpdir, first) == _key(tmpdir, second)
+
+
+@pytest.mark.parametrize(
+    "other",
+    [
+        pytest.param([_exec_obj("set", "A", "c")], id="arguments"),
+        pytest.param([_exec_obj("set", "A", "b", local=True)], id="kwargs"),
+        pytest.param([_exec_obj("append", "A", "b")], id="command"),
+        pytest.param([], id="no commands"),
+    ],
+)
+def test_cache_key_covers_commands(tmpdir, other):
+    assert _key(tmpdir, [_exec_obj("set", "A", "b")]) != _key(tmpdir, other)
+
+
+def test_cache_key_covers_base_and_command_digest(tmpdir):
+    commands = [_exec_obj("set", "A", "b")]
+    key = _key(tmpdir, commands)
+    assert key != _key(tmpdir, commands, base_cache_key="other")
+    assert key != _key(tmpdir, commands, command_digest="other")
+
+
+def test_cache_key_covers_helper_directory(tmpdir):
+    commands = [_exec_obj("set", "A", "b")]
+    key = _key(tmpdir, commands)
+
+    helper = tmpdir.mkdir("system-test")
+    helper.join("file.txt").write("one")
+    with_helper = _key(tmpdir, commands)
+    assert key != with_helper
+
+    helper.join("file.txt").write("two")
+    assert with_helper != _key(tmpdir, commands)
+
+
+def test_cache_key_covers_command_config(tmpdir):
+    commands = [_exec_obj("set", "A", "b")]
+    key = _key(tmpdir, commands)
+
+    tmpdir.mkdir("config").mkdir("other").join("unrelated.conf").write("x")
+    assert key == _key(tmpdir, commands)
+
+    tmpdir.join("config").mkdir("set").join("set.conf").write("x")
+    assert key != _key(tmpdir, commands)
+
+
+def test_cache_state(tmpdir):
+    storage = str(tmpdir)
+    assert cache_state(storage, "system-test", "key") == CacheState.MISSING
+
+    os.makedirs(os.path.join(storage, "system-test"))
+    assert cache_state(storage, "system-test", "key") == CacheState.STALE
+
+    write_cache_key(storage, "system-test", "key")
+    assert cache_state(storage, "system-test", "key") == CacheState.CACHED
+    assert cache_state(storage, "system-test", "other") == CacheState.STALE
+
+
+def test_command_set_digest(command_manager):
+    digest = command_set_digest(command_manager)
+    assert digest
+    assert digest == command_set_digest(command_manager)
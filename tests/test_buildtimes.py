@@ -0,0 +1,102 @@
+#!/usr/bin/python
+"""Test for build durations and the build plan.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.buildcache import write_cache_key
+from cleanroom.buildtimes import BuildTimes
+from cleanroom.execobject import ExecObject
+from cleanroom.generator import Generator
+from cleanroom.location import Location
+
+
+class _SystemsManager:
+    def __init__(self, directory, *systems):
+        self.systems_definition_directory = directory
+        self._systems = systems
+
+    def walk_systems_forest(self):
+        for system, base in self._systems:
+            exec_obj = ExecObject(
+                Location(file_name=f"{system}.def", line_number=1),
+                "based_on",
+                (base or "scratch",),
+                {},
+            )
+            yield (system, "", base, [exec_obj], 0)
+
+
+def test_build_times(tmpdir):
+    file_name = str(tmpdir.join("build_times.json"))
+    build_times = BuildTimes(file_name, history=2)
+    assert build_times.estimate("system") is None
+
+    build_times.record("system", 10.0)
+    build_times.record("system", 20.0)
+    assert build_times.estimate("system") == 15.0
+
+    build_times.record("system", 40.0)
+    assert build_times.estimate("system") == 30.0
+
+    assert BuildTimes(file_name, history=2).estimate("system") == 30.0
+
+
+def test_build_times_broken_file(tmpdir):
+    file_name = tmpdir.join("build_times.json")
+    file_name.write("[1, 2")
+    assert BuildTimes(str(file_name)).estimate("system") is None
+
+
+def test_plan(tmpdir, command_manager):
+    storage = tmpdir.mkdir("storage")
+    build_times = BuildTimes(str(tmpdir.join("build_times.json")))
+    build_times.record("type-base", 100.0)
+    build_times.record("system-b", 5.0)
+
+    generator = Generator(
+        _SystemsManager(
+            str(tmpdir.mkdir("definitions")),
+            ("type-base", None),
+            ("system-a", "type-base"),
+            ("system-b", "type-base"),
+            ("system-c", "type-base"),
+        )
+    )
+
+    plan = generator.plan(
+        command_manager=command_manager,
+        storage_directory=str(storage),
+        build_times=build_times,
+    )
+    type_base_key = generator._build_jobs(command_manager)[0].cache_key
+    assert [(e.system_name, e.state, e.estimate) for e in plan] == [
+        ("type-base", "missing", 100.0),
+        ("system-a", "missing", None),
+        ("system-b", "missing", 5.0),
+        ("system-c", "missing", None),
+    ]
+
+    storage.mkdir("type-base")
+    write_cache_key(str(storage), "type-base", type_base_key)
+    storage.mkdir("system-b")
+
+    plan = generator.plan(
+        command_manager=command_manager,
+        storage_directory=str(storage),
+        build_times=build_times,
+        rebuild=("system-c",),
+    )
+    assert [(e.system_name, e.state, e.estimate) for e in plan] == [
+        ("type-base", "cached", 0.0),
+        ("system-a", "missing", None),
+        ("system-b", "stale", 5.0),
+        ("system-c", "rebuild", None),
+    ]
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+"""Test for checkpoints taken during system builds.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.checkpoints import CheckpointManager, checkpoint_keys
+from cleanroom.execobject import ExecObject
+from cleanroom.location import Location
+
+
+class DirectoryStorage:
+    """Stand-in for a storage backend using plain directories."""
+
+    def create_volume(self, directory, *, compress=True):
+        os.makedirs(directory)
+
+    def create_snapshot(self, source, destination, *, read_only=False):
+        shutil.copytree(source, destination, symlinks=True)
+
+    def delete_volume(self, directory):
+        shutil.rmtree(directory)
+        return True
+
+
+def _exec_obj(command, *args):
+    return ExecObject(Location(file_name="<test>", line_number=1), command, args, {})
+
+
+@pytest.fixture()
+def checkpoint_manager(tmpdir):
+    return CheckpointManager(
+        DirectoryStorage(), str(tmpdir.join("checkpoints")), max_checkpoints=2
+    )
+
+
+@pytest.fixture()
+def scratch_context(system_context):
+    for volume in ("fs", "meta", "boot", "cache"):
+        os.makedirs(os.path.join(system_context.scratch_directory, volume))
+    with open(system_context.file_name("/marker"), "w") as f:
+        f.write("checkpointed")
+    return system_context
+
+
+def _clear_scratch(system_context):
+    for volume in ("fs", "meta", "boot", "cache"):
+        shutil.rmtree(os.path.join(system_context.scratch_directory, volume))
+
+
+def test_checkpoint_keys():
+    exec_obj_list = [
+        _exec_obj("based_on", "scratch"),
+        _exec_obj("pacstrap", "base"),
+        _exec_obj("set", "A", "b"),
+        _exec_obj("pacman", "vim"),
+        _exec_obj("_teardown"),
+    ]
+    keys = checkpoint_keys(
+        exec_obj_list,
+        ("pacstrap", "pacman", "_teardown"),
+        lambda prefix: ",".join(e.command for e in prefix),
+    )
+    assert keys == {
+        1: "based_on,pacstrap",
+        3: "based_on,pacstrap,set,pacman",
+    }
+
+
+def test_checkpoint_round_trip(checkpoint_manager, scratch_context):
+    scratch_context.set_substitution("FOO", "bar")
+    scratch_context.add_hook("export", _exec_obj("set", "A", "b"))
+
+    assert checkpoint_manager.find({1: "one"}) == -1
+    checkpoint_manager.create("one", scratch_context)
+    assert checkpoint_manager.find({1: "one", 3: "three"}) == 1
+
+    scratch_context.set_substitution("FOO", "changed")
+    _clear_scratch(scratch_context)
+
+    checkpoint_manager.restore("one", scratch_context)
+    assert scratch_context.substitution("FOO") == "bar"
+    assert len(scratch_context.hooks("export")) == 1
+    with open(scratch_context.file_name("/marker"), "r") as f:
+        assert f.read() == "checkpointed"
+
+
+def test_checkpoint_eviction(checkpoint_manager, scratch_context):
+    checkpoint_manager.create("one", scratch_context)
+    time.sleep(0.01)
+    checkpoint_manager.create("two", scratch_context)
+    time.sleep(0.01)
+
+    _clear_scratch(scratch_context)
+    checkpoint_manager.restore("one", scratch_context)  # "one" is used last now
+    time.sleep(0.01)
+
+    checkpoint_manager.create("three", scratch_context)
+    assert checkpoint_manager.find({0: "one"}) == 0
+    assert checkpoint_manager.find({0: "two"}) == -1
+    assert checkpoint_manager.find({0: "three"}) == 0
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+"""Test for the CommandManager and its command index.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.commandmanager import CommandManager
+
+
+_COMMAND_TEMPLATE = """
+from cleanroom.command import Command
+
+
+class TestCommand(Command):
+    def __init__(self, **services):
+        super().__init__(
+            "{name}",
+            syntax="<ARG>",
+            target_distribution="arch",
+            help_string="{help}",
+            file=__file__,
+            **services,
+        )
+
+    def register_substitutions(self):
+        return [("TEST_KEY", "value", "Test substitution")]
+
+    def validate(self, location, *args, **kwargs):
+        self._validate_arguments_exact(location, 1, "{{}} needs an argument.", *args)
+
+    def dependency(self, *args, **kwargs):
+        return args[0]
+"""
+
+
+def _write_command(directory, name, help_string):
+    directory.join(f"{name}.py").write(
+        _COMMAND_TEMPLATE.format(name=name, help=help_string)
+    )
+
+
+@pytest.fixture()
+def commands_directory(tmpdir):
+    directory = tmpdir.mkdir("commands")
+    _write_command(directory, "test_cmd", "Help text.")
+    return directory
+
+
+def test_command_index(tmpdir, commands_directory, location):
+    index_file = str(tmpdir.join("cache", "command_index.json"))
+
+    first = CommandManager(str(commands_directory), index_file=index_file)
+    assert os.path.isfile(index_file)
+    assert len(first._instances) == 1
+
+    second = CommandManager(str(commands_directory), index_file=index_file)
+    assert not second._instances
+
+    for command_manager in (first, second):
+        command_info = command_manager.command("test_cmd")
+        assert command_info
+        assert command_info.syntax_string == "test_cmd <ARG>"
+        assert command_info.help_string == "Help text."
+        assert command_info.target_distribution == "arch"
+        assert command_info.register_substitutions() == [
+            ("TEST_KEY", "value", "Test substitution")
+        ]
+    assert not second._instances
+
+    # The command module is loaded on first use:
+    command_info = second.command("test_cmd")
+    assert command_info
+    command_info.validate_func(location, ("foo",), {})
+    assert command_info.dependency_func(("foo",), {}) == "foo"
+    assert len(second._instances) == 1
+
+
+def test_command_index_outdated(tmpdir, commands_directory):
+    index_file = str(tmpdir.join("command_index.json"))
+    CommandManager(str(commands_directory), index_file=index_file)
+
+    _write_command(commands_directory, "test_cmd", "Changed help text.")
+    command_file = str(commands_directory.join("test_cmd.py"))
+    os.utime(command_file, ns=(1, 1))
+
+    command_manager = CommandManager(str(commands_directory), index_file=index_file)
+    command_info = command_manager.command("test_cmd")
+    assert command_info
+    assert command_info.help_string == "Changed help text."
+
+
+def test_command_index_broken(tmpdir, commands_directory):
+    index_file = tmpdir.join("command_index.json")
+    index_file.write("{broken")
+
+    command_manager = CommandManager(
+        str(commands_directory), index_file=str(index_file)
+    )
+    assert command_manager.command_names() == ["test_cmd"]
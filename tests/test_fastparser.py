@@ -0,0 +1,108 @@
+#!/usr/bin/python
+"""Compare the hand-written parser to the pyparsing based one.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import glob
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.exceptions import ParseError
+from cleanroom.parser import Parser
+
+
+_EXAMPLES_DIRECTORY = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "../examples")
+)
+
+_PIECES = [
+    " ",
+    "    ",
+    "\t",
+    "\n",
+    "\n    ",
+    "\n\t\t\t\t",
+    "\n\r    ",
+    "\r",
+    "\f",
+    "\xa0",
+    "#",
+    "# comment",
+    "cmd",
+    "x-y_z",
+    "key=",
+    "key=value",
+    "=",
+    "1",
+    "0o7",
+    "0x1f",
+    "!",
+    "é",
+    "'",
+    '"',
+    "'single'",
+    '"dou ble"',
+    "<",
+    ">",
+    "<<<<",
+    ">>>>",
+    "<<<<multi\nline>>>>",
+    "\\",
+    "\\n",
+    "\\t",
+    "\\0",
+    "\\03",
+    "\\x42",
+    "\\u04",
+    "\\x41",
+]
+
+
+def _commands(parser, data):
+    try:
+        return parser._commands(data, "<TEST_DATA>")
+    except ParseError:
+        return "ERROR"
+
+
+@pytest.fixture(scope="module")
+def parsers():
+    return Parser(None), Parser(None, fast_parser=True)
+
+
+@pytest.mark.parametrize(
+    "definition_file",
+    sorted(glob.glob(os.path.join(_EXAMPLES_DIRECTORY, "*.def"))),
+    ids=os.path.basename,
+)
+def test_fast_parser_examples(parsers, definition_file):
+    with open(definition_file, "r") as f:
+        data = f.read()
+
+    (slow, fast) = parsers
+    assert _commands(fast, data) == _commands(slow, data)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_fast_parser_generated(parsers, seed):
+    generator = random.Random(seed)
+    (slow, fast) = parsers
+
+    for _ in range(200):
+        data = "".join(
+            generator.choice(_PIECES) for _ in range(generator.randint(0, 30))
+        )
+        assert _commands(fast, data) == _commands(slow, data), repr(data)
+
+
+def test_fast_parser_error_location(parsers):
+    (_, fast) = parsers
+    with pytest.raises(ParseError) as e:
+        fast._commands("cmd arg\n\ncmd 'unterminated\n", "<TEST_DATA>")
+    assert e.value.location.line_number == 3
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+"""Test for the btrfs helper module.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import errno
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import cleanroom.helper.btrfs as btrfs
+
+
+@pytest.mark.parametrize(
+    ("request_number", "expected"),
+    [
+        pytest.param(btrfs.BTRFS_IOC_SUBVOL_CREATE, 0x5000940E, id="SUBVOL_CREATE"),
+        pytest.param(btrfs.BTRFS_IOC_SNAP_DESTROY, 0x5000940F, id="SNAP_DESTROY"),
+        pytest.param(btrfs.BTRFS_IOC_SNAP_CREATE_V2, 0x50009417, id="SNAP_CREATE_V2"),
+    ],
+)
+def test_btrfs_ioctl_numbers(request_number, expected) -> None:
+    assert request_number == expected
+
+
+def test_btrfs_vol_args() -> None:
+    args = btrfs._vol_args_v2("snapshot", fd=7, flags=btrfs._BTRFS_SUBVOL_RDONLY)
+    assert len(args) == 4096
+    assert args[:8] == (7).to_bytes(8, sys.byteorder)
+    assert args[16:24] == (2).to_bytes(8, sys.byteorder)
+    assert args[56:65] == b"snapshot\0"
+
+    assert len(btrfs._vol_args("subvolume")) == 4096
+    with pytest.raises(OSError):
+        btrfs._vol_args("x" * 5000)
+
+
+def test_native_btrfs_ioctls(tmpdir, monkeypatch) -> None:
+    calls = []
+
+    def ioctl(fd, request, args):
+        calls.append((os.readlink(f"/proc/self/fd/{fd}"), request, args))
+
+    monkeypatch.setattr(btrfs.fcntl, "ioctl", ioctl)
+    helper = btrfs.NativeBtrfsHelper("/usr/bin/false")
+    source = str(tmpdir.mkdir("source"))
+
+    helper.create_subvolume(str(tmpdir.join("volume")))
+    helper.create_snapshot(source, str(tmpdir.join("snapshot")), read_only=True)
+
+    assert [(c[0], c[1]) for c in calls] == [
+        (str(tmpdir), btrfs.BTRFS_IOC_SUBVOL_CREATE),
+        (str(tmpdir), btrfs.BTRFS_IOC_SNAP_CREATE_V2),
+    ]
+    assert calls[0][2] == btrfs._vol_args("volume")
+    assert calls[1][2][16:24] == (2).to_bytes(8, sys.byteorder)
+    assert calls[1][2][56:65] == b"snapshot\0"
+
+
+def test_native_btrfs_fallback(tmpdir, monkeypatch) -> None:
+    binary_calls = []
+
+    def failing_ioctl(fd, request, args):
+        raise OSError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+
+    monkeypatch.setattr(btrfs.fcntl, "ioctl", failing_ioctl)
+    monkeypatch.setattr(
+        btrfs, "run", lambda *args, **kwargs: binary_calls.append(args[1:])
+    )
+    helper = btrfs.NativeBtrfsHelper("/usr/bin/btrfs")
+    source = str(tmpdir.mkdir("source"))
+
+    helper.create_subvolume(str(tmpdir.join("volume")))
+    helper.create_snapshot(source, str(tmpdir.join("snapshot")))
+
+    assert binary_calls == [
+        ("subvolume", "create", str(tmpdir.join("volume"))),
+        ("subvolume", "snapshot", source, str(tmpdir.join("snapshot"))),
+    ]
+
+
+def test_native_btrfs_detection(tmpdir, monkeypatch) -> None:
+    monkeypatch.setattr(btrfs, "run", None)  # The binary must not be used
+    helper = btrfs.NativeBtrfsHelper("/usr/bin/btrfs")
+
+    assert not helper.is_btrfs_filesystem(str(tmpdir.join("missing")))
+    assert not helper.is_subvolume(str(tmpdir.join("missing")))
+    assert not helper.delete_subvolume(str(tmpdir.join("missing")))
+
+    monkeypatch.setattr(btrfs, "_filesystem_type", lambda d: btrfs._BTRFS_SUPER_MAGIC)
+    assert helper.is_btrfs_filesystem(str(tmpdir))
+    assert helper.is_subvolume(str(tmpdir)) == (
+        os.stat(str(tmpdir)).st_ino == btrfs._BTRFS_FIRST_FREE_OBJECTID
+    )
+
+    monkeypatch.setattr(btrfs, "_filesystem_type", lambda d: 0xEF53)  # ext4
+    assert not helper.is_btrfs_filesystem(str(tmpdir))
+    assert not helper.is_subvolume(str(tmpdir))
+
+
+class _Result:
+    returncode = 0
+
+
+def test_btrfs_batched_delete(monkeypatch) -> None:
+    binary_calls = []
+
+    def run(*args, **kwargs):
+        binary_calls.append(args[1:])
+        return _Result()
+
+    monkeypatch.setattr(btrfs, "run", run)
+    volumes = [f"/work/.trash/scratch/v{i}" for i in range(300)]
+
+    assert btrfs.BtrfsHelper("/usr/bin/btrfs").delete_subvolumes(volumes)
+    assert binary_calls == [
+        ("subvolume", "delete", *volumes[:256]),
+        ("subvolume", "delete", *volumes[256:]),
+    ]
+
+
+def test_native_btrfs_batched_delete(tmpdir, monkeypatch) -> None:
+    binary_calls = []
+
+    def run(*args, **kwargs):
+        binary_calls.append(args[1:])
+        return _Result()
+
+    def ioctl(fd, request, args):
+        assert request == btrfs.BTRFS_IOC_SNAP_DESTROY
+        if args.startswith(btrfs._VOL_ARGS.pack(0, b"bad")):
+            raise OSError(errno.EPERM, os.strerror(errno.EPERM))
+
+    monkeypatch.setattr(btrfs, "run", run)
+    monkeypatch.setattr(btrfs.fcntl, "ioctl", ioctl)
+    volumes = [str(tmpdir.join(n)) for n in ("good", "bad", "better")]
+
+    assert btrfs.NativeBtrfsHelper("/usr/bin/btrfs").delete_subvolumes(volumes)
+    assert binary_calls == [("subvolume", "delete", str(tmpdir.join("bad")))]
+
+
+def test_btrfs_find_subvolumes(tmpdir, monkeypatch) -> None:
+    helper = btrfs.BtrfsHelper("/usr/bin/btrfs")
+    monkeypatch.setattr(helper, "is_btrfs_filesystem", lambda d: False)
+    assert helper.find_subvolumes(str(tmpdir)) == []
+
+    tmpdir.mkdir("a").mkdir("b")
+    inodes = {
+        os.lstat(str(tmpdir)).st_ino,
+        os.lstat(str(tmpdir.join("a", "b"))).st_ino,
+    }
+    monkeypatch.setattr(helper, "is_btrfs_filesystem", lambda d: True)
+    monkeypatch.setattr(btrfs, "_BTRFS_FIRST_FREE_OBJECTID", 0)
+    assert helper.find_subvolumes(str(tmpdir)) == []
+
+    # Pretend that tmpdir and a/b are subvolumes:
+    real_lstat = os.lstat
+
+    class _Stat:
+        def __init__(self, st_ino):
+            self.st_ino = st_ino
+
+    def lstat(path):
+        st_ino = real_lstat(path).st_ino
+        return _Stat(0 if st_ino in inodes else st_ino)
+
+    monkeypatch.setattr(btrfs.os, "lstat", lstat)
+    assert helper.find_subvolumes(str(tmpdir)) == [
+        str(tmpdir.join("a", "b")),
+        str(tmpdir),
+    ]
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+"""Test for the cgroup helper.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.helper.cgroup import (
+    ProcessGroup,
+    create_process_group,
+    in_process_group,
+)
+from cleanroom.helper.run import run
+
+
+def test_in_process_group() -> None:
+    group = ProcessGroup("/sys/fs/cgroup/clrm-test")
+    assert in_process_group(group, "/usr/bin/pacman", "-S", "a b") == (
+        "/bin/sh",
+        "-c",
+        'echo $$ > "$0/cgroup.procs" && exec "$@"',
+        "/sys/fs/cgroup/clrm-test",
+        "/usr/bin/pacman",
+        "-S",
+        "a b",
+    )
+
+
+def test_process_group_state(tmpdir) -> None:
+    tmpdir.join("cgroup.procs").write("12\n34\n")
+    tmpdir.join("cgroup.events").write("populated 0\nfrozen 0\n")
+    group = ProcessGroup(str(tmpdir))
+
+    assert group.pids() == [12, 34]
+    assert not group.is_populated()
+    group.kill()  # nothing to do
+
+
+def test_process_group_kills_leftovers() -> None:
+    group = create_process_group("test")
+    if not group:
+        pytest.skip("can not create cgroups here")
+
+    with group:
+        run(
+            "/bin/sh",
+            "-c",
+            "sleep 300 >/dev/null 2>&1 &",
+            process_group=group,
+            trace_output=None,
+        )
+        assert len(group.pids()) == 1
+        assert group.is_populated()
+
+    assert not os.path.exists(group.directory)
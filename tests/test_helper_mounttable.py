@@ -0,0 +1,109 @@
+#!/usr/bin/python
+"""Test for the mount table.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.helper.mounttable import MountTable, mount_table, parse_mountinfo
+
+
+_MOUNTINFO = b"""\
+22 1 0:21 / / rw,relatime shared:1 - btrfs /dev/sda2 rw,compress=zstd:3
+23 22 0:5 / /proc rw,nosuid,nodev,noexec,relatime shared:12 - proc proc rw
+41 22 0:33 / /work/scratch rw,relatime - tmpfs tmp rw,size=1048576k
+42 41 0:34 / /work/scratch/fs/proc rw,relatime - proc proc rw
+43 41 0:35 / /work/scratch/with\\040space rw master:3 propagate_from:2 - tmpfs tmp rw
+44 43 0:36 / /work/scratch/with\\040space rw - tmpfs tmp rw
+45 22 0:37 /sub\\134dir /work/scratch-1 rw - btrfs /dev/sda2 rw
+"""
+
+
+def test_parse_mountinfo() -> None:
+    entries = parse_mountinfo(_MOUNTINFO)
+
+    assert len(entries) == 7
+    assert entries[0].mount_point == "/"
+    assert entries[0].fs_type == "btrfs"
+    assert entries[0].source == "/dev/sda2"
+    assert entries[1].options == "rw,nosuid,nodev,noexec,relatime"
+    assert entries[4].mount_point == "/work/scratch/with space"
+    assert entries[4].fs_type == "tmpfs"
+    assert entries[4].parent_id == 41
+    assert entries[6].root == "/sub\\dir"
+
+
+def test_mounts_below(tmpdir) -> None:
+    mountinfo = str(tmpdir.join("mountinfo"))
+    with open(mountinfo, "wb") as f:
+        f.write(_MOUNTINFO)
+    table = MountTable(mountinfo)
+
+    assert table.mounts_below("/work/scratch") == [
+        "/work/scratch/with space",
+        "/work/scratch/with space",
+        "/work/scratch/fs/proc",
+        "/work/scratch",
+    ]
+    assert table.mounts_below("/work/scratch/fs/") == ["/work/scratch/fs/proc"]
+    assert table.mounts_below("/work/scratch-1") == ["/work/scratch-1"]
+    assert table.mounts_below("/work/scratch-2") == []
+    assert table.mounts_below("/sys") == []
+    assert len(table.mounts_below("/")) == 7
+
+    with open(mountinfo, "wb") as f:
+        f.write(_MOUNTINFO.split(b"41 22")[0])
+    table.invalidate()
+    assert table.mounts_below("/work") == []
+
+
+@pytest.mark.skipif(
+    not os.path.exists("/proc/self/mountinfo"), reason="no /proc/self/mountinfo"
+)
+def test_mount_table_of_process() -> None:
+    table = MountTable()
+    assert "/proc" in table.mounts_below("/proc")
+    assert table.mounts_below("/proc") == table.mounts_below("/proc")
+
+
+def test_mount_table_after_fork() -> None:
+    """Test that a lock held by another thread does not block children."""
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold_lock() -> None:
+        with mount_table()._lock:
+            holding.set()
+            release.wait(10)
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    assert holding.wait(10)
+    try:
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if mount_table().mounts_below("/") else 1)
+
+        deadline = time.monotonic() + 10
+        while True:
+            (done, status) = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            if time.monotonic() > deadline:
+                os.kill(pid, 9)
+                (_, status) = os.waitpid(pid, 0)
+                break
+            time.sleep(0.01)
+    finally:
+        release.set()
+        thread.join()
+
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
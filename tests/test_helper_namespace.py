@@ -0,0 +1,90 @@
+#!/usr/bin/python
+"""Test for the mount namespace helper.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import cleanroom.helper.namespace as namespace
+from cleanroom.helper.mount import mount, mount_points, umount
+from cleanroom.helper.run import run
+
+
+class FailingLibC:
+    def unshare(self, flags):
+        return -1
+
+
+def test_private_mount_namespace_fallback(monkeypatch) -> None:
+    monkeypatch.setattr(namespace, "_c_library", lambda: FailingLibC())
+    monkeypatch.setattr(namespace, "warn", lambda *args: None)
+
+    with namespace.private_mount_namespace() as private:
+        assert not private
+        assert not namespace.in_private_mount_namespace()
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="needs root")
+def test_private_mount_namespace(tmpdir) -> None:
+    directory = str(tmpdir.mkdir("mnt"))
+    namespace_before = os.readlink("/proc/self/ns/mnt")
+
+    with namespace.private_mount_namespace() as private:
+        if not private:
+            pytest.skip("can not create mount namespaces here")
+        assert namespace.in_private_mount_namespace()
+        run("/usr/bin/mount", "-t", "tmpfs", "tmp", directory)
+        assert mount_points(directory) == [directory]
+
+    assert not namespace.in_private_mount_namespace()
+    assert os.readlink("/proc/self/ns/mnt") == namespace_before
+    assert mount_points(directory) == []
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="needs root")
+def test_private_mount_namespace_in_thread(tmpdir) -> None:
+    """Test mounting in a namespace entered by a thread other than the main one."""
+    directory = str(tmpdir.mkdir("mnt"))
+    mounted = threading.Event()
+    done = threading.Event()
+    result = []
+
+    def build() -> None:
+        try:
+            with namespace.private_mount_namespace() as private:
+                if private:
+                    assert namespace.in_private_mount_namespace()
+                    mount("tmp", directory, fs_type="tmpfs")
+                    result.append(mount_points(directory))
+                    mounted.set()
+                    done.wait(10)
+                    umount(directory)
+                else:
+                    result.append(None)
+        except BaseException as e:
+            result.append(e)
+        finally:
+            mounted.set()
+
+    thread = threading.Thread(target=build)
+    thread.start()
+    assert mounted.wait(10)
+    try:
+        # The main thread does neither see the mount nor the namespace:
+        assert mount_points(directory) == []
+        assert not namespace.in_private_mount_namespace()
+    finally:
+        done.set()
+        thread.join()
+
+    if result == [None]:
+        pytest.skip("can not create mount namespaces here")
+    assert result == [[directory]]
+    assert mount_points(directory) == []
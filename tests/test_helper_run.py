@@ -0,0 +1,112 @@
+#!/usr/bin/python
+"""Test for running external commands.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.exceptions import GenerateError
+from cleanroom.helper.run import run, run_many
+
+
+def test_run_in_work_directory(tmpdir) -> None:
+    cwd = os.getcwd()
+    result = run("/bin/pwd", work_directory=str(tmpdir), trace_output=None)
+
+    assert result.stdout == f"{tmpdir}\n"
+    assert os.getcwd() == cwd
+
+
+def test_run_with_environment() -> None:
+    result = run(
+        "/bin/sh",
+        "-c",
+        'echo "$CLRM_TEST"',
+        env={**os.environ, "CLRM_TEST": "value"},
+        trace_output=None,
+    )
+
+    assert result.stdout == "value\n"
+    assert "CLRM_TEST" not in os.environ
+
+
+def test_run_return_code_of_signal() -> None:
+    result = run("/bin/sh", "-c", "kill -9 $$", returncode=None, trace_output=None)
+
+    assert result.returncode == -9
+
+
+def test_run_times_out_after_output_is_closed() -> None:
+    with pytest.raises(subprocess.TimeoutExpired):
+        run(
+            "/bin/sh",
+            "-c",
+            "exec >&- 2>&-; sleep 5",
+            timeout=0.2,
+            trace_output=None,
+        )
+
+
+def test_run_streams_lines() -> None:
+    traced = []
+    result = run(
+        "/bin/sh",
+        "-c",
+        "echo one; echo two >&2; printf 'three'",
+        trace_output=lambda *args: traced.append(args),
+    )
+
+    assert ("    [stdout] one",) in traced
+    assert ("    [stderr] two",) in traced
+    assert ("    [stdout] three",) in traced
+    assert traced[-1] == ("Return Code: 0",)
+    assert result.stdout == "one\nthree"
+    assert result.stderr == "two\n"
+
+
+def test_run_limits_output() -> None:
+    result = run(
+        "/bin/sh",
+        "-c",
+        "for i in 1 2 3 4 5 6 7 8 9; do echo line$i; done",
+        output_limit=12,
+        trace_output=None,
+    )
+
+    assert result.stdout == "[... 42 characters dropped ...]\nline8\nline9\n"
+
+    result = run("/bin/sh", "-c", "printf 'é'", output_limit=None, trace_output=None)
+    assert result.stdout == "é"
+
+
+def test_run_many() -> None:
+    results = run_many(
+        ("/bin/sh", "-c", "sleep 0.2; echo first"),
+        ("/bin/sh", "-c", "echo second"),
+        trace_output=None,
+    )
+
+    assert [r.stdout for r in results] == ["first\n", "second\n"]
+    assert run_many() == []
+
+
+def test_run_many_errors() -> None:
+    with pytest.raises(subprocess.CalledProcessError):
+        run_many(
+            ("/bin/true",),
+            ("/bin/false",),
+            check=True,
+            returncode=None,
+            trace_output=None,
+        )
+
+    with pytest.raises(GenerateError) as e:
+        run_many(("/bin/false",), ("/bin/true",), ("/bin/false",), trace_output=None)
+    assert "2 of 3 commands failed" in str(e.value)
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+"""Test for the export of build metrics.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.metrics import (
+    BuildMetrics,
+    Metric,
+    collect,
+    format_prometheus,
+    record_metric,
+)
+
+
+def _record(system, name, value, **labels):
+    return {"system": system, "name": name, "labels": labels, "value": value}
+
+
+def test_collect():
+    metrics = collect(
+        [
+            _record("a", "cache_misses", 1),
+            _record("a", "build_duration_seconds", 10.0),
+            _record("a", "build_duration_seconds", 12.5),
+            _record("b", "cache_hits", 1),
+            _record("b", "image_size_bytes", 1024, image="img"),
+            _record("b", "image_size_bytes", 512, image="efi"),
+        ]
+    )
+
+    assert Metric("build_duration_seconds", {"system": "a"}, 12.5) in metrics
+    assert len([m for m in metrics if m.name == "build_duration_seconds"]) == 1
+    assert len([m for m in metrics if m.name == "image_size_bytes"]) == 2
+    assert Metric("cache_hits_total", {}, 1.0) in metrics
+    assert Metric("cache_misses_total", {}, 1.0) in metrics
+    assert Metric("failures_total", {}, 0.0) in metrics
+
+
+def test_format_prometheus():
+    text = format_prometheus(
+        [
+            Metric("image_size_bytes", {"system": "a", "image": "img"}, 1024.0),
+            Metric("failures_total", {}, 2.0),
+        ],
+        1700000000.4,
+    )
+
+    lines = text.splitlines()
+    assert "# TYPE clrm_image_size_bytes gauge" in lines
+    assert 'clrm_image_size_bytes{system="a",image="img"} 1024' in lines
+    assert "# HELP clrm_failures_total Systems that failed to build." in lines
+    assert "clrm_failures_total 2" in lines
+    assert "clrm_last_build_timestamp_seconds 1700000000" in lines
+    assert text.endswith("\n")
+
+
+def test_format_prometheus_escapes_labels():
+    text = format_prometheus([Metric("failures", {"system": 'a"b\\c'}, 1.0)], 0.0)
+    assert 'clrm_failures{system="a\\"b\\\\c"} 1' in text.splitlines()
+
+
+@pytest.mark.parametrize(
+    "file_name,format,expected_json",
+    [
+        ("metrics.prom", "", False),
+        ("metrics.json", "", True),
+        ("metrics.txt", "json", True),
+        ("metrics.json", "prometheus", False),
+    ],
+)
+def test_build_metrics(tmpdir, file_name, format, expected_json):
+    metrics_file = str(tmpdir.join("out", file_name))
+    with BuildMetrics(metrics_file, format=format):
+        record_metric("a", "failures", 1)
+
+        pid = os.fork()
+        if pid == 0:
+            record_metric("b", "failures", 1)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+    assert BuildMetrics.instance() is None
+    assert os.listdir(str(tmpdir.join("out"))) == [file_name]
+
+    with open(metrics_file, "r") as f:
+        data = f.read()
+    if expected_json:
+        metrics = json.loads(data)["metrics"]
+        assert {"name": "failures_total", "labels": {}, "value": 2.0} in metrics
+    else:
+        assert "clrm_failures_total 2" in data.splitlines()
+
+
+def test_no_metrics():
+    assert BuildMetrics.instance() is None
+    record_metric("a", "failures", 1)
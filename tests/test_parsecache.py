@@ -0,0 +1,83 @@
+#!/usr/bin/python
+"""Test for the parse cache of system definition files.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.parsecache import ParseCache
+from cleanroom.parser import Parser
+from cleanroom.systemsmanager import SystemsManager
+
+
+@pytest.fixture()
+def definition_file(tmpdir):
+    file_name = tmpdir.join("system-test.def")
+    file_name.write("based_on scratch\n")
+    return str(file_name)
+
+
+def test_parse_cache_round_trip(tmpdir, definition_file):
+    cache = ParseCache(str(tmpdir.join("cache")), "digest")
+    (key, result) = cache.get(definition_file)
+    assert result is None
+
+    cache.put(key, ("scratch", "", []))
+    assert cache.get(definition_file) == (key, ("scratch", "", []))
+
+    # Survives a restart:
+    cache = ParseCache(str(tmpdir.join("cache")), "digest")
+    assert cache.get(definition_file) == (key, ("scratch", "", []))
+
+
+def test_parse_cache_misses(tmpdir, definition_file):
+    cache = ParseCache(str(tmpdir.join("cache")), "digest")
+    (key, _) = cache.get(definition_file)
+    cache.put(key, ("scratch", "", []))
+
+    other_commands = ParseCache(str(tmpdir.join("cache")), "other digest")
+    assert other_commands.get(definition_file)[1] is None
+
+    with open(definition_file, "a") as f:
+        f.write("# changed\n")
+    assert cache.get(definition_file)[1] is None
+
+
+def test_parse_cache_broken_entry(tmpdir, definition_file):
+    cache = ParseCache(str(tmpdir.join("cache")), "digest")
+    (key, _) = cache.get(definition_file)
+    tmpdir.join("cache").join(f"{key}.bin").write("garbage")
+    assert cache.get(definition_file)[1] is None
+
+
+def test_systems_manager_uses_parse_cache(
+    tmpdir, command_manager, definition_file, monkeypatch
+):
+    cache = ParseCache(str(tmpdir.join("cache")), "digest")
+
+    first = SystemsManager(
+        command_manager, str(tmpdir), "system-test", parse_cache=cache
+    )
+
+    def fail_parse(self, input_file):
+        raise AssertionError("Parser used despite cached result.")
+
+    monkeypatch.setattr(Parser, "parse", fail_parse)
+    second = SystemsManager(
+        command_manager, str(tmpdir), "system-test", parse_cache=cache
+    )
+
+    def commands(systems_manager):
+        return [
+            [(e.command, e.args, e.location.line_number) for e in node[3]]
+            for node in systems_manager.walk_systems_forest()
+        ]
+
+    assert commands(first) == commands(second)
+    assert commands(second) == [[("based_on", ("scratch",), 1), ("_teardown", (), 2)]]
@@ -29,9 +29,11 @@ class DummyPrinter(cleanroom.printer.Printer):
 
 
 @pytest.fixture()
-def printer() -> DummyPrinter:
-    """Return a printer."""
-    return DummyPrinter(verbosity=0)
+def printer() -> typing.Generator[DummyPrinter, None, None]:
+    """Return a printer, which is the main printer instance during the test."""
+    previous = cleanroom.printer.Printer._instance
+    yield DummyPrinter(verbosity=0)
+    cleanroom.printer.Printer._instance = previous
 
 
 def _test_message(
@@ -217,3 +219,110 @@ def test_printing_trace(printer: DummyPrinter, printer_verbosity: int) -> None:
     _test_message(
         printer, printer_verbosity, printer.trace, printer_verbosity >= 4, ("+++++",)
     )
+
+
+def test_buffer_records(printer: DummyPrinter) -> None:
+    """Test that suppressed messages end up in the buffer."""
+    printer.set_context(system="system-test", location="test.def:3")
+    printer.trace("traced", 42)
+    printer.set_context()
+    printer.msg("plain")
+
+    (traced, plain) = printer.records()
+    assert traced.level == 4
+    assert traced.system == "system-test"
+    assert traced.location == "test.def:3"
+    assert "traced 42" in traced.message
+    assert "[system-test] test.def:3:" in traced.format()
+    assert plain.level == 0
+    assert not plain.system
+    assert printer.buffer == " plain\n"
+
+
+def test_buffer_is_bounded(printer: DummyPrinter, capsys) -> None:
+    """Test that only the latest messages are kept."""
+    printer.set_buffer_size(3)
+    for i in range(10):
+        printer.trace(f"message {i}")
+    records = printer.records()
+    assert len(records) == 3
+    assert "message 7" in records[0].message
+
+    printer.flush()
+    output = capsys.readouterr().out
+    assert "message 6" not in output
+    assert "message 9" in output
+    assert not printer.records()
+
+
+def test_buffer_reset(printer: DummyPrinter) -> None:
+    """Test that headlines and success messages reset the buffer."""
+    printer.trace("before")
+    printer.success("done")
+    assert not printer.records()
+
+
+def test_buffer_spill_file(printer: DummyPrinter, tmpdir) -> None:
+    """Test that messages dropped from the buffer are written to file."""
+    spill_file = tmpdir.join("spill.log")
+    printer.set_spill_file(str(spill_file))
+    printer.set_buffer_size(2)
+    for i in range(5):
+        printer.trace(f"message {i}")
+
+    lines = spill_file.read().splitlines()
+    assert len(lines) == 3
+    assert [f"message {i}" in line for i, line in enumerate(lines)] == [True] * 3
+
+    printer.h1("Headline")
+    assert "message 4" in spill_file.read()
+
+
+def test_buffer_spills_in_batches(printer: DummyPrinter, tmpdir, monkeypatch) -> None:
+    """Test that the spill file is not opened once per message."""
+    spill_file = tmpdir.join("spill.log")
+    printer.set_spill_file(str(spill_file))
+    printer.set_buffer_size(10)
+
+    spills = []
+    original_spill = printer._spill
+    monkeypatch.setattr(
+        printer, "_spill", lambda records: spills.append(original_spill(records))
+    )
+    for i in range(16):
+        printer.trace(f"message {i}")
+
+    assert len(spills) == 2
+    lines = spill_file.read().splitlines()
+    assert len(lines) == 10
+    assert "message 9" in lines[-1]
+    assert "message 10" in printer.records()[0].message
+
+
+def test_lazy_messages(printer: DummyPrinter, capsys) -> None:
+    """Test that callable message parts are only called when needed."""
+    calls = []
+
+    def part() -> str:
+        calls.append(1)
+        return "lazy part"
+
+    printer.trace("suppressed", part)
+    assert not calls
+    assert printer.buffer == ""
+
+    printer.msg("printed", part)
+    assert len(calls) == 1
+    assert "printed lazy part" in printer.buffer
+
+    printer.flush()
+    assert len(calls) == 3
+    assert "suppressed lazy part" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("printer_verbosity", [0, 1, 2, 3, 4, 5])
+def test_enabled(printer: DummyPrinter, printer_verbosity: int) -> None:
+    """Test checking for enabled verbosity levels."""
+    printer.set_verbosity(printer_verbosity)
+    for verbosity in range(6):
+        assert cleanroom.printer.enabled(verbosity) == (verbosity <= printer_verbosity)
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+"""Test for the resource accounting of external programs.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.helper.run import run
+from cleanroom.resourceusage import (
+    ProcessUsage,
+    ResourceAccounting,
+    set_system,
+    summarize,
+)
+
+
+def test_accounting(tmpdir):
+    report_file = str(tmpdir.join("usage.json"))
+    with ResourceAccounting(report_file) as accounting:
+        run("/usr/bin/env", "true", trace_output=None)
+        set_system("system-test")
+        run("/usr/bin/env", "false", returncode=None, trace_output=None)
+
+        pid = os.fork()
+        if pid == 0:
+            run("/bin/sh", "-c", "exit 3", returncode=None, trace_output=None)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        usages = accounting.usages()
+
+    assert sorted((u.system, u.program, u.returncode) for u in usages) == [
+        ("", "env", 0),
+        ("system-test", "env", 1),
+        ("system-test", "sh", 3),
+    ]
+    for usage in usages:
+        assert usage.wall_time > 0.0
+        assert usage.max_rss > 0
+
+    with open(report_file, "r") as f:
+        data = json.load(f)
+    assert len(data["processes"]) == 3
+    assert data["programs"]["env"]["runs"] == 2
+    assert data["systems"]["system-test"]["runs"] == 2
+
+
+def test_no_accounting():
+    assert ResourceAccounting.instance() is None
+    set_system("system-test")
+    run("/usr/bin/env", "true", trace_output=None)
+
+
+def test_summarize():
+    def usage(system, program, wall_time, max_rss):
+        return ProcessUsage(system, program, 0, wall_time, 1.0, 0.5, max_rss, 2, 3)
+
+    summary = summarize(
+        [
+            usage("a", "pacman", 10.0, 100),
+            usage("a", "mksquashfs", 5.0, 400),
+            usage("b", "pacman", 20.0, 200),
+        ],
+        lambda u: u.program,
+    )
+    assert summary["pacman"].runs == 2
+    assert summary["pacman"].wall_time == 30.0
+    assert summary["pacman"].user_time == 2.0
+    assert summary["pacman"].max_rss == 200
+    assert summary["pacman"].blocks_written == 6
+    assert summary["mksquashfs"].runs == 1
+
+
+def test_run_like_subprocess_run():
+    result = run(
+        "/bin/sh", "-c", "cat; echo err >&2", input=b"input", trace_output=None
+    )
+    assert result.stdout == "input"
+    assert result.stderr == "err\n"
+
+    with pytest.raises(subprocess.CalledProcessError):
+        run("/bin/sh", "-c", "exit 2", returncode=None, check=True, trace_output=None)
+    with pytest.raises(subprocess.TimeoutExpired):
+        run("/bin/sh", "-c", "exec sleep 10", timeout=0.1, trace_output=None)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+"""Test for the build server.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import io
+import os
+import socket
+import stat
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.exceptions import PreflightError
+from cleanroom.server import BuildRequest, BuildServer, request_build
+
+
+class _Server:
+    def __init__(self, socket_path, build_function):
+        self.server = BuildServer(socket_path, build_function)
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self._thread.join()
+
+
+@pytest.fixture()
+def socket_path(tmpdir):
+    return str(tmpdir.join("clrm.sock"))
+
+
+def _request(*systems, ignore_errors=False):
+    return BuildRequest(systems=systems, rebuild=(), ignore_errors=ignore_errors)
+
+
+def test_server_build(socket_path):
+    requests = []
+
+    def build(request):
+        requests.append(request)
+        print(f"Building {', '.join(request.systems)}.")
+
+    server = _Server(socket_path, build)
+    try:
+        output = io.StringIO()
+        assert request_build(
+            socket_path, _request("system-a", "system-b"), output=output
+        )
+        assert output.getvalue() == "Building system-a, system-b.\n"
+
+        assert request_build(
+            socket_path, _request("system-c", ignore_errors=True), output=output
+        )
+    finally:
+        server.stop()
+
+    assert requests == [
+        _request("system-a", "system-b"),
+        _request("system-c", ignore_errors=True),
+    ]
+    assert not os.path.exists(socket_path)
+
+
+def test_server_build_failure(socket_path):
+    def build(request):
+        if request.systems[0] == "exit":
+            sys.exit(1)
+        raise RuntimeError("broken")
+
+    server = _Server(socket_path, build)
+    try:
+        output = io.StringIO()
+        assert not request_build(socket_path, _request("raise"), output=output)
+        assert "broken" in output.getvalue()
+
+        # The server survives failing builds:
+        assert not request_build(socket_path, _request("exit"), output=output)
+    finally:
+        server.stop()
+
+
+def test_server_queues_builds(socket_path):
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def build(request):
+        order.append(request.systems[0])
+        if request.systems[0] == "first":
+            started.set()
+            release.wait(10)
+
+    server = _Server(socket_path, build)
+    try:
+        results = {}
+
+        def client(system):
+            output = io.StringIO()
+            results[system] = (
+                request_build(socket_path, _request(system), output=output),
+                output.getvalue(),
+            )
+
+        first = threading.Thread(target=client, args=("first",))
+        first.start()
+        assert started.wait(10)
+
+        second = threading.Thread(target=client, args=("second",))
+        second.start()
+        while server.server._pending < 2:
+            time.sleep(0.01)
+        release.set()
+        first.join()
+        second.join()
+    finally:
+        server.stop()
+
+    assert order == ["first", "second"]
+    assert results["first"] == (True, "")
+    assert results["second"] == (True, "Queued behind 1 other build(s).\n")
+
+
+def test_server_bad_request(socket_path):
+    server = _Server(socket_path, lambda request: None)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+            connection.sendall(b'{"systems": []}\n')
+            with connection.makefile("rb") as f:
+                answer = f.readline()
+        assert b'"success": false' in answer
+    finally:
+        server.stop()
+
+
+def test_server_socket_permissions(socket_path):
+    server = _Server(socket_path, lambda request: None)
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o660
+    finally:
+        server.stop()
+
+
+def test_server_replaces_stale_socket(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(socket_path)  # never listens, like a server that crashed
+
+    server = _Server(socket_path, lambda request: None)
+    try:
+        assert request_build(socket_path, _request("system-a"), output=io.StringIO())
+    finally:
+        server.stop()
+
+
+def test_server_refuses_to_replace(socket_path):
+    with open(socket_path, "w") as f:
+        f.write("not a socket")
+    with pytest.raises(PreflightError):
+        BuildServer(socket_path, lambda request: None)
+    assert os.path.isfile(socket_path)
+    os.unlink(socket_path)
+
+    server = _Server(socket_path, lambda request: None)
+    try:
+        with pytest.raises(PreflightError):
+            BuildServer(socket_path, lambda request: None)
+        assert request_build(socket_path, _request("system-a"), output=io.StringIO())
+    finally:
+        server.stop()
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+"""Test for the storage backends.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import shutil
+import stat
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.exceptions import PreflightError
+import cleanroom.helper.storage as storage_module
+from cleanroom.helper.storage import (
+    BtrfsStorage,
+    MemoryScratchStorage,
+    OverlayStorage,
+    ReflinkStorage,
+    create_storage,
+)
+
+
+_CP = shutil.which("cp")
+
+
+class RecordingBtrfsHelper:
+    """Stand-in for the BtrfsHelper recording all calls."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+
+class BinaryManager:
+    def __init__(self, **binaries):
+        self._binaries = binaries
+
+    def binary(self, selector):
+        return self._binaries.get(selector.name.lower(), "")
+
+
+def test_btrfs_storage():
+    helper = RecordingBtrfsHelper()
+    storage = BtrfsStorage(helper)
+
+    storage.create_volume("/scratch", compress=False)
+    storage.create_volume("/storage/fs")
+    storage.create_snapshot("/scratch/fs", "/storage/fs", read_only=True)
+    storage.make_read_only("/storage/fs")
+    storage.delete_volume_recursive("/scratch")
+
+    assert storage.name == "btrfs"
+    assert helper.calls == [
+        ("create_subvolume", ("/scratch",), {}),
+        ("set_property", ("/scratch",), {"name": "compression", "value": "none"}),
+        ("create_subvolume", ("/storage/fs",), {}),
+        ("create_snapshot", ("/scratch/fs", "/storage/fs"), {"read_only": True}),
+        ("set_property", ("/storage/fs",), {"name": "ro", "value": "true"}),
+        ("delete_subvolume_recursive", ("/scratch",), {}),
+    ]
+
+
+@pytest.mark.skipif(not _CP, reason="cp not found")
+def test_reflink_storage(tmpdir):
+    storage = ReflinkStorage(_CP)
+    base = str(tmpdir.join("base"))
+    child = str(tmpdir.join("child"))
+
+    storage.create_volume(base)
+    assert storage.is_volume(base)
+    os.makedirs(os.path.join(base, "etc"))
+    with open(os.path.join(base, "etc", "file"), "w") as f:
+        f.write("base")
+    os.symlink("etc/file", os.path.join(base, "link"))
+
+    storage.create_snapshot(base, child)
+    with open(os.path.join(child, "etc", "file"), "w") as f:
+        f.write("child")
+
+    with open(os.path.join(base, "etc", "file"), "r") as f:
+        assert f.read() == "base"
+    assert os.readlink(os.path.join(child, "link")) == "etc/file"
+
+    assert storage.delete_volume(child)
+    assert not storage.is_volume(child)
+    assert not storage.delete_volume(child)
+
+
+def test_create_storage():
+    assert create_storage("btrfs", BinaryManager(btrfs="/bin/btrfs")).name == "btrfs"
+    assert isinstance(
+        create_storage("reflink", BinaryManager(cp="/bin/cp")), ReflinkStorage
+    )
+    assert isinstance(
+        create_storage("overlayfs", BinaryManager(cp="/bin/cp")), OverlayStorage
+    )
+
+    with pytest.raises(PreflightError):
+        create_storage("btrfs", BinaryManager(cp="/bin/cp"))
+    with pytest.raises(PreflightError):
+        create_storage("reflink", BinaryManager(btrfs="/bin/btrfs"))
+    with pytest.raises(PreflightError):
+        create_storage("zfs", BinaryManager(btrfs="/bin/btrfs", cp="/bin/cp"))
+
+    in_memory = create_storage(
+        "btrfs", BinaryManager(btrfs="/bin/btrfs", cp="/bin/cp"), scratch_in_memory="2G"
+    )
+    assert isinstance(in_memory, MemoryScratchStorage)
+    assert in_memory.name == "btrfs (scratch in tmpfs)"
+
+
+class DirectoryStorage:
+    """Stand-in for a storage backend recording calls and creating directories."""
+
+    name = "directory"
+
+    def __init__(self):
+        self.calls = []
+
+    def create_volume(self, directory, *, compress=True):
+        self.calls.append(("create_volume", directory))
+        os.makedirs(directory)
+
+    def create_snapshot(self, source, destination, *, read_only=False):
+        self.calls.append(("create_snapshot", source, destination))
+
+    def make_read_only(self, directory):
+        self.calls.append(("make_read_only", directory))
+        os.chmod(directory, 0o555)
+
+    def delete_volume(self, directory):
+        self.calls.append(("delete_volume", directory))
+        return True
+
+    def is_volume(self, directory):
+        return os.path.isdir(directory)
+
+
+@pytest.mark.skipif(not _CP, reason="cp not found")
+def test_memory_scratch_storage(tmpdir, monkeypatch):
+    mounts = []
+    monkeypatch.setattr(
+        storage_module, "mount", lambda *args, **kwargs: mounts.append((args, kwargs))
+    )
+
+    def umount_all(directory):
+        # Unmounting the tmpfs leaves the empty mount point behind:
+        mounts.append(directory)
+        shutil.rmtree(directory)
+        os.makedirs(directory)
+        return True
+
+    monkeypatch.setattr(storage_module, "umount_all", umount_all)
+
+    backend = DirectoryStorage()
+    storage = MemoryScratchStorage(backend, _CP, size="1G")
+    scratch = str(tmpdir.join("scratch"))
+    base = str(tmpdir.join("storage", "base"))
+    system = str(tmpdir.join("storage", "system"))
+    os.makedirs(os.path.join(base, "fs", "etc"))
+    with open(os.path.join(base, "fs", "etc", "file"), "w") as f:
+        f.write("base")
+
+    storage.create_scratch(scratch)
+    assert mounts == [
+        (("tmp", scratch), {"options": "size=1G,mode=0755", "fs_type": "tmpfs"})
+    ]
+
+    # Restore from storage into memory:
+    storage.create_snapshot(os.path.join(base, "fs"), os.path.join(scratch, "fs"))
+    storage.create_volume(os.path.join(scratch, "cache"))
+    assert storage.is_volume(os.path.join(scratch, "cache"))
+    with open(os.path.join(scratch, "fs", "etc", "file"), "r") as f:
+        assert f.read() == "base"
+
+    # Store from memory into storage:
+    storage.create_snapshot(
+        os.path.join(scratch, "fs"), os.path.join(system, "fs"), read_only=True
+    )
+    with open(os.path.join(system, "fs", "etc", "file"), "r") as f:
+        assert f.read() == "base"
+    assert stat.S_IMODE(os.stat(os.path.join(system, "fs")).st_mode) == 0o555
+
+    # Snapshots within storage are left to the storage backend:
+    storage.create_snapshot(os.path.join(base, "fs"), os.path.join(system, "boot"))
+
+    storage.delete_volume_recursive(scratch)
+    assert not os.path.exists(scratch)
+    assert mounts[-1] == scratch
+    assert not storage.is_volume(os.path.join(scratch, "fs"))
+
+    assert backend.calls == [
+        ("create_volume", os.path.join(system, "fs")),
+        ("make_read_only", os.path.join(system, "fs")),
+        ("create_snapshot", os.path.join(base, "fs"), os.path.join(system, "boot")),
+    ]
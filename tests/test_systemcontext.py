@@ -0,0 +1,121 @@
+#!/usr/bin/python
+"""Test for the substitution handling of SystemContext.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import pickle
+import random
+import string
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.exceptions import GenerateError
+
+
+def _reference_expand(substitutions, input):
+    """The multi-pass string.Template expansion SystemContext used to do."""
+    result = input
+    for _ in range(20):
+        next_result = string.Template(result).safe_substitute(substitutions)
+        if next_result == result:
+            return result
+        result = next_result
+    raise GenerateError("Expansion did not finish.")
+
+
+def test_expand_nested(system_context):
+    system_context.set_substitution("A", "a")
+    system_context.set_substitution("B", "${A}b")
+    system_context.set_substitution("C", "$B-c")
+
+    assert system_context.expand("$C/${C}") == "ab-c/ab-c"
+    assert system_context.substitution_expanded("C") == "ab-c"
+    assert system_context.expand("no substitutions") == "no substitutions"
+
+
+def test_expand_unknown_keys(system_context):
+    assert system_context.expand("$UNKNOWN ${UNKNOWN} $") == "$UNKNOWN ${UNKNOWN} $"
+
+
+def test_expand_escaped(system_context):
+    system_context.set_substitution("A", "a")
+
+    # "$$" turns into "$" which gets expanded again, just as before:
+    assert system_context.expand("$${A}") == "a"
+    assert system_context.expand("$$6$$salt$$hash") == "$6$salt$hash"
+
+
+def test_expand_invalidates_dependents(system_context):
+    system_context.set_substitution("A", "a")
+    system_context.set_substitution("B", "${A}b")
+    assert system_context.expand("${B}") == "ab"
+    assert system_context.expand("${NEW}") == "${NEW}"
+
+    system_context.set_substitution("A", "x")
+    assert system_context.expand("${B}") == "xb"
+
+    system_context.set_or_append_substitution("A", "y")
+    assert system_context.expand("${B}") == "x yb"
+
+    system_context.set_substitution("NEW", "$B")
+    assert system_context.expand("${NEW}") == "x yb"
+
+
+def test_expand_cycle(system_context):
+    system_context.set_substitution("A", "${B}")
+    system_context.set_substitution("B", "x${A}")
+
+    with pytest.raises(GenerateError):
+        system_context.expand("$A")
+
+    # Breaking the cycle makes things work again:
+    system_context.set_substitution("B", "b")
+    assert system_context.expand("$A") == "b"
+
+
+def test_expand_cache_not_pickled(system_context):
+    system_context.set_substitution("A", "a")
+    assert system_context.expand("$A") == "a"
+
+    restored = pickle.loads(pickle.dumps(system_context))
+    restored.set_substitution("A", "b")
+    assert restored.expand("$A") == "b"
+    assert system_context.expand("$A") == "a"
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_expand_matches_reference(system_context, seed):
+    rng = random.Random(seed)
+    keys = ["A", "B", "C", "D_1", "E"]
+    # Substitution values are fully expanded before getting inserted now, so
+    # "$$" can no longer form new references with the text around inserted
+    # values in later passes. Only compare texts without "$$" here, the
+    # common uses of "$$" are covered by test_expand_escaped:
+    snippets = ["x", "/", " ", "_", "$UNKNOWN", "${UNKNOWN}"]
+
+    def random_text(allowed_keys):
+        parts = []
+        for _ in range(rng.randint(0, 6)):
+            if allowed_keys and rng.random() < 0.4:
+                key = rng.choice(allowed_keys)
+                parts.append(rng.choice([f"${key}/", f"${{{key}}}"]))
+            else:
+                parts.append(rng.choice(snippets))
+        return "".join(parts)
+
+    for _ in range(50):
+        # Keys only refer to keys defined before them, so there are no cycles:
+        key = rng.choice(keys)
+        value = random_text(keys[: keys.index(key)])
+        system_context.set_substitution(key, value)
+
+        for _ in range(5):
+            text = random_text(keys)
+            assert system_context.expand(text) == _reference_expand(
+                system_context.substitutions, text
+            )
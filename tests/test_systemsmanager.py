@@ -0,0 +1,71 @@
+#!/usr/bin/python
+"""Test for the SystemsManager and the dependency scan of system definitions.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.systemsmanager import affected_systems, reverse_dependencies
+
+
+@pytest.fixture()
+def systems_directory(tmpdir):
+    definitions = {
+        "type-base": "scratch",
+        "type-server": "type-base",
+        "type-desktop": "type-base",
+        "system-web": "type-server",
+        "system-laptop": "type-desktop",
+        "system-other": "scratch",
+    }
+    for system, base in definitions.items():
+        tmpdir.join(f"{system}.def").write(f"based_on {base}\n")
+    tmpdir.join("broken.def").write("based_on f!oo\n")
+    tmpdir.join("README.md").write("based_on type-base\n")
+    return str(tmpdir)
+
+
+def test_reverse_dependencies(command_manager, systems_directory):
+    result = reverse_dependencies(command_manager, systems_directory)
+    assert result == {
+        "system-laptop": [],
+        "system-other": [],
+        "system-web": [],
+        "type-base": ["type-desktop", "type-server"],
+        "type-desktop": ["system-laptop"],
+        "type-server": ["system-web"],
+    }
+
+
+@pytest.mark.parametrize(
+    ("systems", "expected"),
+    [
+        pytest.param(
+            ("type-base",),
+            [
+                "type-base",
+                "type-desktop",
+                "type-server",
+                "system-laptop",
+                "system-web",
+            ],
+            id="root",
+        ),
+        pytest.param(("type-server.def",), ["type-server", "system-web"], id="def"),
+        pytest.param(("system-web",), ["system-web"], id="leaf"),
+        pytest.param(
+            ("type-server", "system-web", "system-other"),
+            ["type-server", "system-web", "system-other"],
+            id="overlapping",
+        ),
+    ],
+)
+def test_affected_systems(command_manager, systems_directory, systems, expected):
+    reverse_map = reverse_dependencies(command_manager, systems_directory)
+    assert affected_systems(reverse_map, *systems) == expected
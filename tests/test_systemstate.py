@@ -0,0 +1,124 @@
+#!/usr/bin/python
+"""Test for storing and loading system states.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import pickle
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.exceptions import GenerateError
+from cleanroom.execobject import ExecObject
+from cleanroom.location import Location
+from cleanroom.systemcontext import SystemContext
+from cleanroom.systemstate import STATE_FILE, load_system_state
+
+
+def _build_system(tmpdir, system_name, base_system_name=""):
+    """Create a system context and store it like _teardown and _store would.
+
+    The scratch directory is in the storage directory right away to
+    skip the _store step."""
+    tmpdir.join("storage", system_name, "meta").ensure(dir=True)
+    system_context = SystemContext(
+        system_name=system_name,
+        base_system_name=base_system_name,
+        scratch_directory=str(tmpdir.join("storage", system_name)),
+        systems_definition_directory=str(tmpdir.join("definitions")),
+        storage_directory=str(tmpdir.join("storage")),
+        repository_base_directory=str(tmpdir.join("repo")),
+        timestamp=f"timestamp-{system_name}",
+    )
+    location = Location(file_name=f"{system_name}.def", line_number=3).create_child(
+        description="hook"
+    )
+    system_context.add_hook(
+        "_teardown",
+        ExecObject(location, f"cmd_{system_name}", ("arg", 42), {"force": True}),
+    )
+    system_context.set_substitution(f"KEY_{system_name}", f"value_{system_name}")
+
+    system_context.store_state()
+    return system_context
+
+
+def test_store_and_load(tmpdir):
+    _build_system(tmpdir, "base")
+    state = load_system_state(str(tmpdir.join("storage")), "base")
+
+    assert state.system_name == "base"
+    assert state.timestamp == "timestamp-base"
+    assert state.base_system_names == []
+    assert state.base_context is None
+    assert state.substitutions["KEY_base"] == "value_base"
+
+    (hook,) = state.hooks["_teardown"]
+    assert hook.command == "cmd_base"
+    assert hook.args == ("arg", 42)
+    assert hook.kwargs == {"force": True}
+    assert str(hook.location) == 'base.def:3 => "hook"'
+
+
+def test_based_on(tmpdir):
+    _build_system(tmpdir, "base")
+    _build_system(tmpdir, "middle", "base")
+    system_context = _build_system(tmpdir, "top", "middle")
+
+    assert system_context.timestamp == "timestamp-base"
+    assert system_context.substitution("BASE_SYSTEM_NAME") == "middle"
+    assert system_context.substitution("BASE_SYSTEM_LIST") == "middle;base"
+    assert system_context.substitution("KEY_base") == "value_base"
+    assert system_context.substitution("KEY_middle") == "value_middle"
+    assert [h.command for h in system_context.hooks("_teardown")] == [
+        "cmd_base",
+        "cmd_middle",
+        "cmd_top",
+    ]
+
+    state = load_system_state(str(tmpdir.join("storage")), "top")
+    assert state.base_system_names == ["middle", "base"]
+
+    # Base states are only loaded when asked for:
+    assert state._base_context is None
+    base_context = state.base_context
+    assert base_context and base_context.system_name == "middle"
+    assert base_context.base_context
+    assert base_context.base_context.system_name == "base"
+
+
+def test_load_legacy_state(tmpdir):
+    system_context = _build_system(tmpdir, "base")
+    meta_directory = tmpdir.join("storage", "base", "meta")
+    os.unlink(meta_directory.join(STATE_FILE))
+    system_context._hooks_that_already_ran = []
+    with open(meta_directory.join("pickle_jar.bin"), "wb") as f:
+        pickle.dump(system_context, f)
+
+    state = load_system_state(str(tmpdir.join("storage")), "base")
+    assert state.system_name == "base"
+    assert state.substitutions["KEY_base"] == "value_base"
+    assert [h.command for h in state.hooks["_teardown"]] == ["cmd_base"]
+
+    # Storing a new state removes the legacy one:
+    system_context.store_state()
+    assert not os.path.exists(meta_directory.join("pickle_jar.bin"))
+
+
+def test_load_unsupported_version(tmpdir):
+    _build_system(tmpdir, "base")
+    state_file = tmpdir.join("storage", "base", "meta", STATE_FILE)
+    with open(state_file, "wb") as f:
+        pickle.dump({"version": 9999}, f)
+
+    with pytest.raises(GenerateError):
+        load_system_state(str(tmpdir.join("storage")), "base")
+
+
+def test_load_missing_state(tmpdir):
+    with pytest.raises(GenerateError):
+        load_system_state(str(tmpdir.join("storage")), "missing")
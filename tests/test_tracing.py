@@ -0,0 +1,83 @@
+#!/usr/bin/python
+"""Test for recording trace events.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.helper.run import run
+from cleanroom.tracing import Tracer, span
+
+
+def _events(trace_file):
+    with open(trace_file, "r") as f:
+        data = json.load(f)
+    return {e["name"]: e for e in data["traceEvents"]}
+
+
+def test_no_tracer():
+    calls = []
+    with span("test", "test", value=lambda: calls.append(1)) as args:
+        args["exit_code"] = 0
+    assert not calls
+
+
+def test_spans(tmpdir):
+    trace_file = str(tmpdir.join("trace.json"))
+    with Tracer(trace_file):
+        with span("outer", "system", base_system=None) as args:
+            with span("inner", "command", arguments=lambda: ("a", 1)):
+                pass
+            args["exit_code"] = 3
+        with pytest.raises(RuntimeError):
+            with span("broken", "command"):
+                raise RuntimeError("Broken!")
+
+    events = _events(trace_file)
+    assert set(events.keys()) == {"outer", "inner", "broken"}
+
+    outer = events["outer"]
+    inner = events["inner"]
+    assert outer["ph"] == "X"
+    assert outer["cat"] == "system"
+    assert outer["args"] == {"base_system": None, "exit_code": 3}
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert inner["args"] == {"arguments": ["a", 1]}
+    assert events["broken"]["args"] == {"error": "Broken!"}
+
+    assert os.listdir(str(tmpdir)) == ["trace.json"]
+
+
+def test_process_span(tmpdir):
+    trace_file = str(tmpdir.join("trace.json"))
+    with Tracer(trace_file):
+        run("/usr/bin/env", "false", returncode=None, trace_output=None)
+
+    event = _events(trace_file)["env"]
+    assert event["cat"] == "process"
+    assert event["args"]["argv"] == ["/usr/bin/env", "false"]
+    assert event["args"]["exit_code"] == 1
+
+
+def test_forked_spans(tmpdir):
+    trace_file = str(tmpdir.join("trace.json"))
+    with Tracer(trace_file):
+        with span("parent", "test"):
+            pid = os.fork()
+            if pid == 0:
+                with span("child", "test"):
+                    pass
+                os._exit(0)
+            os.waitpid(pid, 0)
+
+    events = _events(trace_file)
+    assert events["child"]["pid"] == pid
+    assert events["parent"]["pid"] == os.getpid()
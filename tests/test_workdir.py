@@ -0,0 +1,167 @@
+#!/usr/bin/python
+"""Test for the work directory.
+
+@author: Tobias Hunger <tobias.hunger@gmail.com>
+"""
+
+import pytest  # type: ignore
+
+import os
+import shutil
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cleanroom.helper.mount import mount_points
+from cleanroom.helper.storage import MemoryScratchStorage, ReflinkStorage
+from cleanroom.workdir import WorkDir, move_to_trash
+
+
+_CP = shutil.which("cp")
+
+
+class DirectoryStorage:
+    """Stand-in for a storage backend using plain directories."""
+
+    name = "directory"
+
+    def __init__(self):
+        self.deleted_in = set()
+        self.scratches = 0
+
+    def is_supported(self, directory):
+        return True
+
+    def create_volume(self, directory, *, compress=True):
+        os.makedirs(directory)
+
+    def create_scratch(self, directory):
+        self.scratches += 1
+        os.makedirs(directory)
+
+    def delete_volume(self, directory):
+        if not os.path.isdir(directory):
+            return False
+        self.deleted_in.add(threading.current_thread().name)
+        shutil.rmtree(directory)
+        return True
+
+    def delete_volumes(self, directories):
+        return all([self.delete_volume(d) for d in directories])
+
+    def delete_volume_recursive(self, directory):
+        self.delete_volume(directory)
+
+    def is_volume(self, directory):
+        return os.path.isdir(directory)
+
+
+def test_move_to_trash(tmpdir) -> None:
+    storage = DirectoryStorage()
+    scratch = str(tmpdir.mkdir("scratch"))
+
+    # Not in a work directory:
+    assert not move_to_trash(scratch, storage)
+    assert os.path.isdir(scratch)
+
+    tmpdir.mkdir(".trash")
+    assert move_to_trash(scratch, storage)
+    assert not os.path.exists(scratch)
+    assert len(os.listdir(str(tmpdir.join(".trash")))) == 1
+
+    assert not move_to_trash(scratch, storage)
+
+
+def test_workdir_reclaims_in_background(tmpdir) -> None:
+    storage = DirectoryStorage()
+    work_directory = str(tmpdir.mkdir("work"))
+
+    with WorkDir(storage, work_directory=work_directory) as work_dir:
+        scratch = work_dir.worker_scratch_directory(1)
+        work_dir.clear_scratch_directory(1)
+        os.makedirs(os.path.join(scratch, "fs", "etc"))
+
+        work_dir.clear_scratch_directory(1)
+        assert os.path.isdir(scratch)
+        assert not os.path.exists(os.path.join(scratch, "fs"))
+
+        work_dir.finish_reclaim()
+        assert os.listdir(work_dir.trash_directory) == []
+        assert storage.deleted_in == {"clrm-reclaim"}
+
+
+def test_workdir_reclaims_leftovers(tmpdir) -> None:
+    storage = DirectoryStorage()
+    work_directory = str(tmpdir.mkdir("work"))
+    os.makedirs(os.path.join(work_directory, ".trash", "scratch.1.0", "fs"))
+
+    with WorkDir(storage, work_directory=work_directory) as work_dir:
+        pass
+
+    assert os.listdir(work_dir.trash_directory) == []
+
+
+def test_fork_does_not_wait_for_reclaim(tmpdir) -> None:
+    started = threading.Event()
+    release = threading.Event()
+
+    class BlockingStorage(DirectoryStorage):
+        def delete_volume(self, directory):
+            started.set()
+            release.wait(10)
+            return super().delete_volume(directory)
+
+    storage = BlockingStorage()
+    work_directory = str(tmpdir.mkdir("work"))
+
+    with WorkDir(storage, work_directory=work_directory) as work_dir:
+        os.makedirs(os.path.join(work_dir.trash_directory, "scratch.1.0"))
+        work_dir.reclaim()
+        assert started.wait(10)
+
+        timer = threading.Timer(5, release.set)
+        timer.start()
+        start = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        forked_in = time.monotonic() - start
+        release.set()
+        timer.cancel()
+        assert os.waitpid(pid, 0)[1] == 0
+
+    assert forked_in < 2
+    assert os.listdir(work_dir.trash_directory) == []
+
+
+def test_workdir_deletes_scratch_directories(tmpdir) -> None:
+    storage = DirectoryStorage()
+    work_directory = str(tmpdir.mkdir("work"))
+
+    with WorkDir(storage, work_directory=work_directory) as work_dir:
+        # Scratch directories are only set up for builds:
+        assert storage.scratches == 0
+        work_dir.clear_scratch_directory(0)
+        work_dir.clear_scratch_directory(2)
+        assert storage.scratches == 2
+
+    assert sorted(os.listdir(work_directory)) == [".trash", "storage"]
+
+
+@pytest.mark.skipif(os.geteuid() != 0 or not _CP, reason="needs root and cp")
+def test_workdir_unmounts_scratch_in_memory(tmpdir) -> None:
+    work_directory = str(tmpdir.join("work"))
+    storage = MemoryScratchStorage(ReflinkStorage(_CP), _CP, size="16M")
+    # Stands in for a forked worker, the storage above never sees its mount:
+    worker_storage = MemoryScratchStorage(ReflinkStorage(_CP), _CP, size="16M")
+
+    with WorkDir(storage, work_directory=work_directory) as work_dir:
+        assert mount_points(work_directory) == []
+        work_dir.clear_scratch_directory(0)
+        worker_storage.create_scratch(work_dir.worker_scratch_directory(1))
+        assert len(mount_points(work_directory)) == 2
+
+    assert mount_points(work_directory) == []
+    assert sorted(os.listdir(work_directory)) == [".trash", "storage"]